@@ -422,15 +422,10 @@ class UserFaceEmbeddingInline(admin.TabularInline):
 
     def embedding_preview(self, obj):
         """Display first 10 dimensions of the 512D embedding vector."""
-        if obj and obj.embedding:
+        embedding = obj.get_vector() if obj else None
+        if embedding is not None:
             try:
-                import json
-                if isinstance(obj.embedding, str):
-                    embedding = json.loads(obj.embedding)
-                else:
-                    embedding = obj.embedding
-                
-                preview = embedding[:10] if len(embedding) > 10 else embedding
+                preview = embedding[:10]
                 preview_str = ", ".join([f"{x:.4f}" for x in preview])
                 return format_html(
                     "<span title='512D vector' style='font-family: monospace; font-size: 11px;'>[{}...]</span>",
@@ -822,7 +817,7 @@ class UserFaceEmbeddingAdmin(admin.ModelAdmin):
     list_display = ("user_link", "image_preview", "model_name", "embedding_dimensions", "created_at")
     list_filter = ("model_name", "created_at")
     search_fields = ("user__username", "user__enrollment_no", "image_path")
-    readonly_fields = ("user", "image_path", "image_preview_large", "embedding", "model_name", "created_at", "embedding_preview", "embedding_dimensions")
+    readonly_fields = ("user", "image_path", "image_preview_large", "raw_embedding", "model_name", "created_at", "embedding_preview", "embedding_dimensions")
     date_hierarchy = "created_at"
     ordering = ("-created_at",)
     
@@ -834,7 +829,7 @@ class UserFaceEmbeddingAdmin(admin.ModelAdmin):
             "fields": ("model_name", "embedding_dimensions", "embedding_preview", "created_at")
         }),
         ("Raw Embedding Data", {
-            "fields": ("embedding",),
+            "fields": ("raw_embedding",),
             "classes": ("collapse",),  # Collapsed by default
             "description": "Full 512D embedding vector (collapsed for performance)"
         }),
@@ -885,32 +880,21 @@ class UserFaceEmbeddingAdmin(admin.ModelAdmin):
 
     def embedding_dimensions(self, obj):
         """Display the dimension count of the embedding."""
-        if obj and obj.embedding:
-            try:
-                import json
-                if isinstance(obj.embedding, str):
-                    embedding = json.loads(obj.embedding)
-                else:
-                    embedding = obj.embedding
-                return f"{len(embedding)}D"
-            except:
-                return "Error"
+        if obj and obj.dimension:
+            return f"{obj.dimension}D"
+        embedding = obj.get_vector() if obj else None
+        if embedding is not None:
+            return f"{len(embedding)}D"
         return "N/A"
     embedding_dimensions.short_description = "Dimensions"
 
     def embedding_preview(self, obj):
         """Display first 10 dimensions of the 512D embedding vector."""
-        if obj and obj.embedding:
+        embedding = obj.get_vector() if obj else None
+        if embedding is not None:
             try:
-                import json
-                if isinstance(obj.embedding, str):
-                    embedding = json.loads(obj.embedding)
-                else:
-                    embedding = obj.embedding
-                
-                preview = embedding[:10] if len(embedding) > 10 else embedding
+                preview = embedding[:10]
                 preview_str = ", ".join([f"{x:.6f}" for x in preview])
-                full_str = ", ".join([f"{x:.6f}" for x in embedding])
                 
                 return format_html(
                     "<div style='font-family: monospace; font-size: 11px;'>"
@@ -925,6 +909,17 @@ class UserFaceEmbeddingAdmin(admin.ModelAdmin):
         return "No embedding"
     embedding_preview.short_description = "Embedding Preview"
 
+    def raw_embedding(self, obj):
+        """Display the full embedding vector, whichever column it is stored in."""
+        embedding = obj.get_vector() if obj else None
+        if embedding is None:
+            return "No embedding"
+        return format_html(
+            "<code style='font-size: 11px;'>[{}]</code>",
+            ", ".join([f"{x:.6f}" for x in embedding])
+        )
+    raw_embedding.short_description = "Embedding"
+
     def has_add_permission(self, request):
         """Prevent manual creation - embeddings should be computed programmatically."""
         return False
@@ -4,6 +4,7 @@ API Service for interacting with external Perfect Office API
 import requests
 from typing import Dict, List, Optional
 import logging
+import weakref
 
 logger = logging.getLogger(__name__)
 
@@ -105,3 +106,79 @@ def check_in_user(user_id: int) -> Dict:
 def check_out_user(user_id: int) -> Dict:
     """Convenience method for check-out"""
     return post_attendance(user_id, 'check_out')
+
+
+# -----------------------------
+# Async variants (async_views.py)
+# -----------------------------
+# One connection pool per event loop: an httpx client cannot outlive its loop
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _async_client():
+    import asyncio
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = httpx.AsyncClient(timeout=10)
+    return client
+
+
+async def post_attendance_async(user_id: int, attendance_type: str) -> Dict:
+    """
+    post_attendance() with httpx, so the request waits on the event loop
+    instead of holding a worker thread for up to the 10 s timeout.
+    """
+    import httpx
+
+    try:
+        payload = {
+            "user_id": str(user_id),
+            "type": attendance_type
+        }
+        
+        response = await _async_client().post(
+            API_ATTENDANCE_ENDPOINT,
+            json=payload,
+            headers={'Content-Type': 'application/json'},
+        )
+        response.raise_for_status()
+        
+        data = response.json()
+        
+        if data.get('success') and data.get('statusCode') == 200:
+            message = data.get('data', {}).get('message', 'Success')
+            logger.info(f"Attendance posted successfully for user {user_id}: {message}")
+            return {
+                'success': True,
+                'message': message
+            }
+        else:
+            logger.error(f"API returned unsuccessful response: {data}")
+            return {
+                'success': False,
+                'message': 'Failed to post attendance'
+            }
+            
+    except httpx.HTTPError as e:
+        logger.error(f"Error posting attendance to API: {str(e)}")
+        return {
+            'success': False,
+            'message': f'Network error: {str(e)}'
+        }
+    except Exception as e:
+        logger.error(f"Unexpected error posting attendance: {str(e)}")
+        return {
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }
+
+
+async def check_in_user_async(user_id: int) -> Dict:
+    return await post_attendance_async(user_id, 'check_in')
+
+
+async def check_out_user_async(user_id: int) -> Dict:
+    return await post_attendance_async(user_id, 'check_out')
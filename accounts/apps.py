@@ -1,3 +1,5 @@
+import os
+
 from django.apps import AppConfig
     
 class AccountsConfig(AppConfig):
@@ -6,4 +8,13 @@ class AccountsConfig(AppConfig):
 
     def ready(self):
         import accounts.signal
+
+        # Under gunicorn, gunicorn.conf.py warms up the models. For
+        # `manage.py runserver`, warm up in the serving process (not the
+        # autoreloader parent) without blocking startup.
+        from django.conf import settings
+        if getattr(settings, 'FACE_WARMUP_ON_RUNSERVER', False) and os.environ.get('RUN_MAIN') == 'true':
+            import threading
+            from accounts.warmup import warm_up
+            threading.Thread(target=warm_up, name='face-warmup', daemon=True).start()
         
@@ -0,0 +1,348 @@
+"""
+Async versions of the scanner endpoints, for the ASGI profile in
+gunicorn.conf.py (GUNICORN_ASGI=1).
+
+A sync view holds its worker thread for the whole request: decoding,
+inference, and up to 10 s waiting on the Perfect Office API. Here the
+request waits on the event loop instead:
+
+- decoding, inference and writing face images run in a bounded thread pool
+  of FACE_ASYNC_INFERENCE_THREADS threads. At most FACE_ASYNC_MAX_PENDING
+  jobs may be queued or running; beyond that the view answers 503 instead
+  of piling frames up in memory;
+- the ORM is reached through the async queryset methods or sync_to_async;
+- the external API is called with httpx (api_service.post_attendance_async).
+
+Request parsing and responses are shared with simple_views, so both
+flavours behave the same.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime
+from functools import partial
+import json
+import logging
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+
+from .api_service import check_in_user_async, check_out_user_async
+from .attendance_service import (
+    attendance_date_for, mark_check_in, mark_check_out, release_check_in, release_check_out, summary_refresher
+)
+from .face_quality import FrameQualityError
+from .metrics import stage, timed
+from .models import CustomUser
+from .recognition import parse_face_box
+from . import simple_views
+
+logger = logging.getLogger(__name__)
+
+
+BUSY_ERROR = 'Server busy, please try again.'
+
+
+class InferenceBusy(Exception):
+    """More than FACE_ASYNC_MAX_PENDING jobs are waiting for the inference threads."""
+
+
+_executor = None
+_lock = threading.Lock()
+_pending = 0
+
+
+def _run_closing_connections(function, *args):
+    from django.db import close_old_connections
+
+    try:
+        return function(*args)
+    finally:
+        # Pool threads outlive requests; do not leave connections open in them
+        close_old_connections()
+
+
+async def run_inference(function, *args):
+    """
+    Run a blocking decode/inference job in the inference thread pool.
+
+    Raises:
+        InferenceBusy: FACE_ASYNC_MAX_PENDING jobs are already queued or running
+    """
+    global _executor, _pending
+
+    with _lock:
+        if _pending >= getattr(settings, 'FACE_ASYNC_MAX_PENDING', 256):
+            raise InferenceBusy()
+        _pending += 1
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'FACE_ASYNC_INFERENCE_THREADS', 4),
+                thread_name_prefix='face-async',
+            )
+    try:
+        loop = asyncio.get_running_loop()
+        # Run in the request's context so stage timings (metrics.py) reach the view
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(_executor, context.run, _run_closing_connections, function, *args)
+    finally:
+        with _lock:
+            _pending -= 1
+
+
+def _busy_response():
+    return JsonResponse({'success': False, 'error': BUSY_ERROR}, status=503)
+
+
+def _error_response(e):
+    logger.error(f"Error in face recognition: {str(e)}")
+    import traceback
+    logger.error(traceback.format_exc())
+    return JsonResponse({
+        'success': False,
+        'error': f'Recognition error: {str(e)}'
+    })
+
+
+# -----------------------------
+# Recognition
+# -----------------------------
+def _decode_and_match(decode, action, tracker=None, face_box=None, client=None, roi=None):
+    """
+    Pool job: decode the frame and recognize the face in it (see
+    simple_views.match_scan for tracker, face_box, client and roi).
+
+    Returns:
+        tuple or None: simple_views.match_scan() result, None if the frame
+        could not be decoded
+    """
+    with stage('decode'):
+        img = decode()
+    if img is None:
+        return None
+    return simple_views.match_scan(img, action, tracker, face_box, client, roi)
+
+
+async def recognize_and_mark(decode, action, tracker=None, face_box=None, client=None, roi=None):
+    """
+    Recognize the face in a frame and mark attendance for it.
+
+    Args:
+        decode: Callable returning the decoded BGR frame, or None; it runs
+            in the inference pool
+        action: 'check_in' or 'check_out'
+        tracker: face_tracker.FaceTracker of a stream, if any
+        face_box: The client's face box, used for tracking
+        client: simple_views.scan_client() of the request
+        roi: The place of an uploaded crop in the client's video, used for
+            tracking
+
+    Returns:
+        dict: The scanner response payload
+
+    Raises:
+        InferenceBusy: The inference pool is saturated
+    """
+    try:
+        match = await run_inference(_decode_and_match, decode, action, tracker, face_box, client, roi)
+    except FrameQualityError as e:
+        return simple_views.quality_payload(e)
+    if match is None:
+        return {'success': False, 'error': 'Failed to decode image'}
+
+    query_embedding, user_id, distance, confidence, tracked = match
+    if query_embedding is None:
+        return {'success': False, 'error': simple_views.NO_FACE_ERROR}
+    if user_id is None:
+        return {'success': False, 'error': simple_views.NOT_RECOGNIZED_ERROR}
+
+    try:
+        with stage('db'):
+            recognized_user = await CustomUser.objects.aget(id=user_id)
+    except CustomUser.DoesNotExist:
+        return {'success': False, 'error': 'User data error'}
+    if tracked:
+        # Only a verified (embedded) frame may mark attendance
+        return simple_views.tracked_payload(recognized_user, action)
+    simple_views.log_recognized(recognized_user, distance, confidence)
+
+    # Day starts at 8:00 AM (see attendance_date_for)
+    now = datetime.now()
+    current_time = now.time()
+    attendance_date = attendance_date_for(now)
+
+    # Claim the mark with a conditional write; duplicates and racing scans do not apply
+    mark = mark_check_in if action == 'check_in' else mark_check_out
+    with stage('db'):
+        write = await sync_to_async(mark)(recognized_user, attendance_date, current_time)
+    if not write.applied:
+        return simple_views.unapplied_payload(recognized_user, action, write)
+
+    # Post attendance to external API without holding a thread
+    post = check_in_user_async if action == 'check_in' else check_out_user_async
+    with stage('api'):
+        api_response = await post(recognized_user.api_user_id)
+
+    if not api_response['success']:
+        # Release the claim so the next scan can try again
+        release = release_check_in if action == 'check_in' else release_check_out
+        with stage('db'):
+            await sync_to_async(release)(write)
+        return {
+            'success': False,
+            'error': f"API Error: {api_response['message']}"
+        }
+
+    await sync_to_async(summary_refresher.schedule)(recognized_user.id, attendance_date)
+
+    return simple_views.marked_payload(recognized_user, action, current_time, distance, confidence)
+
+
+def _decode_and_match_faces(decode, action):
+    """Pool job: decode the frame and recognize every face in it; None if it does not decode."""
+    with stage('decode'):
+        img = decode()
+    if img is None:
+        return None
+    return simple_views.match_faces_scan(img, action)
+
+
+async def recognize_and_mark_faces(decode, action):
+    """
+    Group scan flavour of recognize_and_mark(): mark every face in the frame,
+    posting the marks to the external API concurrently.
+
+    Returns:
+        dict: The simple_views.faces_payload() response
+
+    Raises:
+        InferenceBusy: The inference pool is saturated
+    """
+    matches = await run_inference(_decode_and_match_faces, decode, action)
+    if matches is None:
+        return {'success': False, 'error': 'Failed to decode image'}
+    if not matches:
+        return {'success': False, 'error': simple_views.NO_FACE_ERROR, 'multi_face': True, 'faces': []}
+
+    claim = await sync_to_async(simple_views.claim_faces)(matches, action)
+
+    users = simple_views.claimed_users(claim)
+    post = check_in_user_async if action == 'check_in' else check_out_user_async
+    with stage('api'):
+        responses = await asyncio.gather(*[post(user.api_user_id) for user in users])
+    api_responses = dict(zip([user.id for user in users], responses))
+    await sync_to_async(simple_views.settle_faces)(claim, api_responses)
+
+    return simple_views.faces_payload(matches, claim, api_responses)
+
+
+@csrf_exempt
+@timed
+async def recognize_and_mark_attendance_async(request):
+    """Async simple_views.recognize_and_mark_attendance (JSON body with a data URL)."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+    try:
+        data = json.loads(request.body)
+        image_data = data.get('image')
+        action = data.get('action', 'check_in')  # check_in or check_out
+
+        if not image_data:
+            return JsonResponse({'success': False, 'error': 'No image data provided'})
+
+        if simple_views.multi_face_flag(data.get('multi_face')):
+            decode = partial(simple_views.decode_base64_image, image_data)
+            return JsonResponse(await recognize_and_mark_faces(decode, action))
+
+        try:
+            face_box = parse_face_box(data.get('face_box'))
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': f'Invalid face box: {str(e)}'})
+
+        decode = partial(simple_views.decode_face_frame, simple_views.decode_base64_image, image_data, face_box)
+        return JsonResponse(await recognize_and_mark(decode, action, client=simple_views.scan_client(request)))
+
+    except InferenceBusy:
+        return _busy_response()
+    except Exception as e:
+        return _error_response(e)
+
+
+@csrf_exempt
+@timed
+async def recognize_frame_upload_async(request):
+    """Async simple_views.recognize_frame_upload (raw JPEG body or multipart)."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+    try:
+        try:
+            action, face_box = simple_views.frame_upload_params(request)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)})
+
+        if not simple_views.has_frame_upload(request):
+            return JsonResponse({'success': False, 'error': 'No image data provided'})
+
+        if simple_views.frame_upload_multi_face(request):
+            decode = partial(simple_views.decode_frame_upload, request, None)
+            return JsonResponse(await recognize_and_mark_faces(decode, action))
+
+        decode = partial(simple_views.decode_frame_upload, request, face_box)
+        return JsonResponse(await recognize_and_mark(decode, action, client=simple_views.scan_client(request)))
+
+    except InferenceBusy:
+        return _busy_response()
+    except Exception as e:
+        return _error_response(e)
+
+
+# -----------------------------
+# Registration
+# -----------------------------
+def _decode_and_save(user, images_data):
+    """Pool job: decode, write and embed registration frames; None if none decodes."""
+    with stage('decode'):
+        images = [simple_views.decode_base64_image(image_data) for image_data in images_data]
+        images = [img for img in images if img is not None]
+    if not images:
+        return None
+    return simple_views.save_face_frames(user, images)
+
+
+@csrf_exempt
+@timed
+async def save_face_image_async(request):
+    """Async simple_views.save_face_image."""
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+
+    try:
+        data = json.loads(request.body)
+        user_id = data.get('user_id')
+        images_data = data.get('images') or ([data['image']] if data.get('image') else [])
+
+        if not user_id or not images_data:
+            return JsonResponse({'success': False, 'error': 'Missing user_id or image data'})
+
+        user = await CustomUser.objects.aget(id=user_id)
+
+        saved = await run_inference(_decode_and_save, user, images_data)
+        if saved is None:
+            return JsonResponse({'success': False, 'error': 'Failed to decode image'})
+
+        with stage('db'):
+            stored = await sync_to_async(simple_views.store_face_embeddings)(user, *saved)
+        return JsonResponse(stored)
+
+    except CustomUser.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'User not found'})
+    except InferenceBusy:
+        return _busy_response()
+    except Exception as e:
+        logger.error(f"Error saving face image: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
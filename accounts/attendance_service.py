@@ -0,0 +1,252 @@
+"""
+Check-in/check-out writes for the scanner.
+
+Every mark is claimed with a single conditional UPDATE ... RETURNING:
+check-in only fills check_in where it is still NULL, and check-out only
+fills check_out where check_in is set and check_out is NULL. The rows the
+UPDATE returns are the marks this call owns, so two scans of the same person
+arriving together cannot both apply. The day row is read first, so a
+duplicate scan costs that one SELECT; a missing row is inserted empty with
+ignore_conflicts (racing inserts collapse into one row) before the claim.
+
+The scanner claims the mark first, then posts it to the external API, and
+releases the claim by the row id it returned if the API call fails. Group
+scans claim the marks of every recognized face with
+mark_check_ins/mark_check_outs, which cost the same few queries however many
+people are in the frame.
+
+None of this goes through Attendance.save(), which recomputes the monthly
+summary synchronously. Instead, summary_refresher recomputes it in the
+background once a burst of marks for the same user and month has settled.
+"""
+from collections import namedtuple
+from datetime import timedelta
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import Attendance
+
+logger = logging.getLogger(__name__)
+
+# applied: whether this call wrote the mark. time: the mark now stored.
+# row: the Attendance id of a mark this call applied, used to release it.
+# For a check-out that did not apply, time is None when there is no check-in yet.
+AttendanceWrite = namedtuple('AttendanceWrite', 'applied time row', defaults=(None,))
+
+# What each mark sets, and the condition under which it may set it
+_CLAIMS = {
+    'check_in': ('Checked In', 'check_in IS NULL'),
+    'check_out': ('Present', 'check_in IS NOT NULL AND check_out IS NULL'),
+}
+
+
+def attendance_date_for(now):
+    """
+    The attendance day a moment belongs to: the day starts at 8:00 AM and
+    ends at 8:00 AM the next day.
+    """
+    if now.hour < 8:
+        return (now - timedelta(days=1)).date()
+    return now.date()
+
+
+def _insert_empty_days(users, attendance_date):
+    """
+    Make sure each user has a row for the day: a plain INSERT (no
+    Attendance.save()) whose conflicts with existing or racing rows are ignored.
+    """
+    Attendance.objects.bulk_create(
+        [Attendance(user=user, date=attendance_date, status='Absent') for user in users],
+        ignore_conflicts=True,
+    )
+
+
+def _claim(users, attendance_date, field, at_time):
+    """
+    The conditional UPDATE behind every mark. The QuerySet API only reports
+    how many rows an update changed, so this is raw SQL with RETURNING
+    (PostgreSQL, SQLite 3.35+) to learn which ones.
+
+    Returns:
+        dict: {user id: Attendance id} for the marks this call applied
+    """
+    if not users:
+        return {}
+    status, condition = _CLAIMS[field]
+    meta = Attendance._meta
+    date = meta.get_field('date').get_db_prep_value(attendance_date, connection)
+    time = meta.get_field(field).get_db_prep_value(at_time, connection)
+    placeholders = ', '.join(['%s'] * len(users))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {connection.ops.quote_name(meta.db_table)} SET {field} = %s, status = %s "
+            f"WHERE user_id IN ({placeholders}) AND date = %s AND {condition} "
+            f"RETURNING user_id, id",
+            [time, status, *(user.id for user in users), date],
+        )
+        return dict(cursor.fetchall())
+
+
+def _writes(users, attendance_date, field, at_time, claimed):
+    """AttendanceWrite per user after _claim; reads the stored mark of the users it did not apply to."""
+    others = [user for user in users if user.id not in claimed]
+    stored = {}
+    if others:
+        stored = dict(
+            Attendance.objects.filter(user__in=others, date=attendance_date)
+            .values_list('user_id', field)
+        )
+    return {
+        user.id: (
+            AttendanceWrite(True, at_time, claimed[user.id]) if user.id in claimed
+            else AttendanceWrite(False, stored.get(user.id))
+        )
+        for user in users
+    }
+
+
+def mark_check_in(user, attendance_date, at_time):
+    """Set check_in for the day unless it is already set."""
+    row = (
+        Attendance.objects.filter(user=user, date=attendance_date)
+        .values('check_in')
+        .first()
+    )
+    if row is not None and row['check_in'] is not None:
+        return AttendanceWrite(False, row['check_in'])
+    if row is None:
+        _insert_empty_days([user], attendance_date)
+
+    # The day row exists now; whichever racing scan's UPDATE returns it wins
+    claimed = _claim([user], attendance_date, 'check_in', at_time)
+    return _writes([user], attendance_date, 'check_in', at_time, claimed)[user.id]
+
+
+def mark_check_out(user, attendance_date, at_time):
+    """Set check_out for the day if checked in and not yet checked out."""
+    row = (
+        Attendance.objects.filter(user=user, date=attendance_date)
+        .values('check_in', 'check_out')
+        .first()
+    )
+    if row is None or row['check_in'] is None:
+        return AttendanceWrite(False, None)
+    if row['check_out'] is not None:
+        return AttendanceWrite(False, row['check_out'])
+
+    claimed = _claim([user], attendance_date, 'check_out', at_time)
+    return _writes([user], attendance_date, 'check_out', at_time, claimed)[user.id]
+
+
+def release_check_in(write):
+    """Undo a check-in mark_check_in(s) applied, unless the day was checked out since."""
+    return bool(
+        Attendance.objects.filter(
+            pk=write.row, check_in__isnull=False, check_out__isnull=True
+        ).update(check_in=None, status='Absent')
+    )
+
+
+def release_check_out(write):
+    """Undo a check-out mark_check_out(s) applied."""
+    return bool(
+        Attendance.objects.filter(
+            pk=write.row, check_out__isnull=False
+        ).update(check_out=None, status='Checked In')
+    )
+
+
+def mark_check_ins(users, attendance_date, at_time):
+    """
+    mark_check_in for several users with one INSERT ignoring existing rows,
+    one conditional UPDATE and, when some were already checked in, one
+    SELECT of their stored times.
+
+    Returns:
+        dict: {user id: AttendanceWrite}
+    """
+    _insert_empty_days(users, attendance_date)
+    claimed = _claim(users, attendance_date, 'check_in', at_time)
+    return _writes(users, attendance_date, 'check_in', at_time, claimed)
+
+
+def mark_check_outs(users, attendance_date, at_time):
+    """
+    mark_check_out for several users with one SELECT and one UPDATE.
+
+    Returns:
+        dict: {user id: AttendanceWrite}
+    """
+    rows = {
+        user_id: (check_in, check_out)
+        for user_id, check_in, check_out in Attendance.objects.filter(
+            user__in=users, date=attendance_date
+        ).values_list('user_id', 'check_in', 'check_out')
+    }
+    writes = {}
+    open_users = []
+    for user in users:
+        check_in, check_out = rows.get(user.id, (None, None))
+        if check_in is None:
+            writes[user.id] = AttendanceWrite(False, None)
+        elif check_out is not None:
+            writes[user.id] = AttendanceWrite(False, check_out)
+        else:
+            open_users.append(user)
+
+    if open_users:
+        claimed = _claim(open_users, attendance_date, 'check_out', at_time)
+        writes.update(_writes(open_users, attendance_date, 'check_out', at_time, claimed))
+    return writes
+
+
+class MonthlySummaryRefresher:
+    """
+    Debounced background refresh of MonthlyAttendance. Marks queue their
+    (user, month); the summaries are recomputed once no mark has arrived for
+    ATTENDANCE_SUMMARY_DELAY seconds.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._pending = set()
+
+    def schedule(self, user_id, attendance_date):
+        """Queue a refresh once the current transaction commits."""
+        transaction.on_commit(lambda: self._queue(user_id, attendance_date))
+
+    def _queue(self, user_id, attendance_date):
+        delay = getattr(settings, 'ATTENDANCE_SUMMARY_DELAY', 5.0)
+        with self._lock:
+            self._pending.add((user_id, attendance_date.replace(day=1)))
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(delay, self._refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _refresh(self):
+        from .models import CustomUser
+        from .utils import update_monthly_attendance
+
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            self._timer = None
+        try:
+            users = CustomUser.objects.in_bulk({user_id for user_id, _ in pending})
+            for user_id, month in sorted(pending):
+                if user_id in users:
+                    update_monthly_attendance(users[user_id], month)
+            logger.info(f"Refreshed {len(pending)} monthly attendance summaries")
+        except Exception as e:
+            logger.error(f"Error refreshing monthly attendance summaries: {str(e)}")
+        finally:
+            from django.db import connection
+            connection.close()
+
+
+summary_refresher = MonthlySummaryRefresher()
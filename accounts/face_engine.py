@@ -0,0 +1,407 @@
+"""
+Face embedding engines behind utils.compute_face_embedding.
+
+FACE_ENGINE selects how a frame becomes an embedding:
+
+- 'deepface': DeepFace.represent() with SFace and the OpenCV Haar detector
+  (the original path; imports TensorFlow/Keras);
+- 'opencv':   cv2.FaceDetectorYN (YuNet) + cv2.FaceRecognizerSF running the
+  same SFace ONNX weights directly in OpenCV's DNN module, with no
+  TensorFlow in the process.
+
+Both engines run batches of aligned faces through one forward pass of the
+SFace network (SFaceBatchNet).
+
+Both engines produce 128D SFace embeddings in the same space, but they
+detect and align faces differently, so their vectors are close rather than
+identical. Each embedding row records the engine's model_tag in
+UserFaceEmbedding.model_name; after switching engines, re-embed the stored
+images with `manage.py compute_embeddings --stale`.
+"""
+from abc import ABC, abstractmethod
+import logging
+import os
+import threading
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WEIGHTS_DIR = os.path.join(settings.MEDIA_ROOT, "deepface_models", ".deepface", "weights")
+
+
+def _describe(image):
+    if isinstance(image, np.ndarray):
+        return f"frame {image.shape[1]}x{image.shape[0]}"
+    return image
+
+
+class SFaceBatchNet:
+    """
+    The SFace ONNX network as a plain cv2.dnn net, loaded on first use, which
+    embeds a whole batch of aligned crops in one forward pass with the same
+    preprocessing as FaceRecognizerSF.feature().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._net = None
+        self._lock = threading.Lock()
+
+    def forward(self, crops):
+        """
+        Args:
+            crops: 112x112 uint8 BGR aligned faces
+
+        Returns:
+            ndarray: (len(crops), 128) embeddings
+
+        Raises:
+            cv2.error: The model was exported with a fixed batch size of 1
+        """
+        import cv2
+
+        # Same blob as FaceRecognizerSF.feature(): 112x112, RGB, no scaling
+        blob = cv2.dnn.blobFromImages(crops, 1.0, (112, 112), (0, 0, 0), True, False)
+        with self._lock:
+            if self._net is None:
+                self._net = cv2.dnn.readNetFromONNX(self.path)
+            self._net.setInput(blob)
+            return self._net.forward().reshape(len(crops), -1)
+
+
+def sface_weights_path():
+    return getattr(settings, 'FACE_SFACE_MODEL', os.path.join(WEIGHTS_DIR, "face_recognition_sface_2021dec.onnx"))
+
+
+class FaceEngine(ABC):
+    """
+    Base class: represent() one image; represent_batch() loops over it
+    unless the engine batches; represent_faces() embeds every face of one
+    image.
+    """
+    name = None
+    model_tag = None
+
+    @abstractmethod
+    def represent(self, image, model_name="SFace"):
+        """
+        Embed the most prominent face of an image path or BGR frame.
+
+        Returns:
+            list: Embedding vector, or None if no face was found
+        """
+
+    @abstractmethod
+    def represent_faces(self, image, model_name="SFace", max_faces=None):
+        """
+        Embed every face detected in an image path or BGR frame.
+
+        Returns:
+            list: (box, embedding) per face, largest first, at most
+            max_faces of them; box is (x, y, width, height) in image pixels
+        """
+
+    def represent_batch(self, images, model_name="SFace", batch_size=32):
+        """
+        Embed the most prominent face of each image path or BGR frame.
+
+        Returns:
+            list: One embedding per input, None where no face was found or
+            the image could not be processed
+        """
+        embeddings = []
+        for image in images:
+            try:
+                embeddings.append(self.represent(image, model_name=model_name))
+            except Exception as e:
+                logger.warning(f"Could not embed {_describe(image)}: {str(e)}")
+                embeddings.append(None)
+        return embeddings
+
+
+class DeepFaceEngine(FaceEngine):
+    name = 'deepface'
+    model_tag = 'SFace'
+
+    def __init__(self):
+        # DeepFace downloads the same weights to DEEPFACE_HOME
+        self._batch_net = SFaceBatchNet(sface_weights_path())
+
+    def represent(self, image, model_name="SFace"):
+        """
+        Embed the most prominent face of an image path or BGR frame.
+
+        Returns:
+            list: Embedding vector, or None if no face was found
+        """
+        from deepface import DeepFace
+
+        # enforce_detection=False: fall back to the whole frame when the
+        # Haar detector misses, as the scanner always did
+        result = DeepFace.represent(
+            img_path=image,
+            model_name=model_name,
+            detector_backend="opencv",
+            enforce_detection=False
+        )
+        # DeepFace.represent returns a list of dicts (one per detected face)
+        if result and len(result) > 0:
+            return result[0]["embedding"]
+        return None
+
+    def represent_faces(self, image, model_name="SFace", max_faces=None):
+        from deepface import DeepFace
+
+        result = DeepFace.represent(
+            img_path=image,
+            model_name=model_name,
+            detector_backend="opencv",
+            enforce_detection=False
+        )
+        # Without a detection DeepFace embeds the whole frame with
+        # face_confidence 0; that is no use for telling faces apart
+        faces = [
+            (
+                tuple(float(face["facial_area"][key]) for key in ("x", "y", "w", "h")),
+                face["embedding"],
+            )
+            for face in result or []
+            if face.get("face_confidence", 1) > 0
+        ]
+        faces.sort(key=lambda face: face[0][2] * face[0][3], reverse=True)
+        return faces[:max_faces]
+
+    def represent_batch(self, images, model_name="SFace", batch_size=32):
+        """
+        Detect and align every image with DeepFace, then embed the faces
+        batch_size at a time with one model call per batch. The faces are
+        what represent() would embed: DeepFace's first face, or the whole
+        frame when the detector misses.
+        """
+        from deepface import DeepFace
+        from deepface.modules import preprocessing
+
+        faces, owners = [], []
+        for position, image in enumerate(images):
+            try:
+                # Faces come back RGB in [0, 1]
+                extracted = DeepFace.extract_faces(
+                    img_path=image,
+                    detector_backend="opencv",
+                    enforce_detection=False,
+                    align=True,
+                )
+            except Exception as e:
+                logger.warning(f"Could not embed {_describe(image)}: {str(e)}")
+                continue
+            if extracted:
+                faces.append(preprocessing.resize_image(extracted[0]["face"][:, :, ::-1], (112, 112)))
+                owners.append(position)
+
+        embeddings = [None] * len(images)
+        for start in range(0, len(faces), batch_size):
+            batch = np.concatenate(faces[start:start + batch_size])
+            for position, embedding in zip(owners[start:start + batch_size], self._forward(batch, model_name)):
+                embeddings[position] = embedding.tolist()
+        return embeddings
+
+    def _forward(self, batch, model_name):
+        """(N, D) embeddings of a (N, 112, 112, 3) BGR [0, 1] batch."""
+        import cv2
+        from deepface import DeepFace
+
+        if model_name == "SFace":
+            # DeepFace's SFace client calls FaceRecognizerSF once per face;
+            # its ONNX weights take the whole batch in one forward pass
+            crops = list((batch * 255).astype(np.uint8))
+            try:
+                return self._batch_net.forward(crops)
+            except cv2.error as e:
+                logger.warning(f"Batched SFace forward failed, embedding one face at a time: {e}")
+
+        model = DeepFace.build_model(model_name=model_name, task='facial_recognition')
+        return np.asarray(model.forward(batch), dtype=np.float32).reshape(len(batch), -1)
+
+    def warm_up(self):
+        from deepface import DeepFace
+
+        DeepFace.build_model(model_name=self.model_tag, task='facial_recognition')
+        DeepFace.build_model(model_name='opencv', task='face_detector')
+        # One pass through the real scan path initialises the remaining
+        # lazy state (graph tracing, detector cascades, thread pools)
+        self.represent(np.zeros((160, 160, 3), dtype=np.uint8))
+
+
+class OpenCVEngine(FaceEngine):
+    """
+    YuNet detection + SFace recognition in OpenCV's DNN module.
+
+    The detector's input size is per-call state, so inference is serialised
+    with a lock; each gunicorn worker has its own engine. Batches of aligned
+    crops go through SFaceBatchNet in one forward pass.
+    """
+    name = 'opencv'
+    model_tag = 'SFace-OpenCV'
+
+    def __init__(self):
+        import cv2
+
+        detector_path = getattr(
+            settings, 'FACE_YUNET_MODEL', os.path.join(WEIGHTS_DIR, "face_detection_yunet_2023mar.onnx")
+        )
+        recognizer_path = sface_weights_path()
+        for path in (detector_path, recognizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} is missing, run attendease/download_model.py")
+
+        self._detector = cv2.FaceDetectorYN.create(
+            detector_path, "", (320, 320),
+            getattr(settings, 'FACE_DETECTOR_SCORE_THRESHOLD', 0.8),
+            0.3,  # NMS threshold
+            5000,  # candidates kept before NMS
+        )
+        self._recognizer = cv2.FaceRecognizerSF.create(recognizer_path, "")
+        self._batch_net = SFaceBatchNet(recognizer_path)
+        self._lock = threading.Lock()
+        logger.info(f"Loaded OpenCV face engine: {detector_path}, {recognizer_path}")
+
+    def detect(self, image):
+        """
+        Returns:
+            ndarray: (F, 15) YuNet rows (box, 5 landmarks, score); empty if no face
+        """
+        height, width = image.shape[:2]
+        with self._lock:
+            self._detector.setInputSize((width, height))
+            _, faces = self._detector.detect(image)
+        return faces if faces is not None else np.zeros((0, 15), dtype=np.float32)
+
+    @staticmethod
+    def _read(image):
+        import cv2
+
+        if isinstance(image, np.ndarray):
+            return image
+        frame = cv2.imread(image, cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("could not read image")
+        return frame
+
+    def aligned_crop(self, image):
+        """112x112 aligned crop of the largest face, or None."""
+        faces = self.detect(image)
+        if not len(faces):
+            return None
+        largest = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        with self._lock:
+            return self._recognizer.alignCrop(image, largest)
+
+    def represent(self, image, model_name="SFace"):
+        """
+        Embed the largest face of an image path or BGR frame.
+
+        Returns:
+            list: Embedding vector, or None if no face was found
+        """
+        crop = self.aligned_crop(self._read(image))
+        if crop is None:
+            return None
+        with self._lock:
+            return self._recognizer.feature(crop)[0].tolist()
+
+    def represent_faces(self, image, model_name="SFace", max_faces=None):
+        """Embed every face of an image with one forward pass for all crops."""
+        frame = self._read(image)
+        faces = self.detect(frame)
+        if not len(faces):
+            return []
+        order = np.argsort(-(faces[:, 2] * faces[:, 3]))[:max_faces]
+        with self._lock:
+            crops = [self._recognizer.alignCrop(frame, faces[index]) for index in order]
+        features = self.features(crops)
+        return [
+            (tuple(faces[index, :4].tolist()), feature.tolist())
+            for index, feature in zip(order, features)
+        ]
+
+    def represent_batch(self, images, model_name="SFace", batch_size=32):
+        """
+        Detect and align every image first, then embed the crops batch_size
+        at a time with one forward pass per batch.
+        """
+        crops, owners = [], []
+        for position, image in enumerate(images):
+            try:
+                crop = self.aligned_crop(self._read(image))
+            except Exception as e:
+                logger.warning(f"Could not embed {_describe(image)}: {str(e)}")
+                continue
+            if crop is not None:
+                crops.append(crop)
+                owners.append(position)
+
+        embeddings = [None] * len(images)
+        for start in range(0, len(crops), batch_size):
+            features = self.features(crops[start:start + batch_size])
+            for position, feature in zip(owners[start:start + batch_size], features):
+                embeddings[position] = feature.tolist()
+        return embeddings
+
+    def features(self, crops):
+        """(len(crops), 128) embeddings of aligned crops in one forward pass."""
+        import cv2
+
+        try:
+            return self._batch_net.forward(crops)
+        except cv2.error as e:
+            # Models exported with a fixed batch size of 1 cannot take a batch
+            logger.warning(f"Batched SFace forward failed, embedding one crop at a time: {e}")
+            with self._lock:
+                return np.vstack([self._recognizer.feature(crop) for crop in crops])
+
+    def warm_up(self):
+        # The first forward pass allocates the DNN buffers
+        self._recognizer.feature(np.zeros((112, 112, 3), dtype=np.uint8))
+        self.represent(np.zeros((160, 160, 3), dtype=np.uint8))
+
+
+ENGINES = {
+    DeepFaceEngine.name: DeepFaceEngine,
+    OpenCVEngine.name: OpenCVEngine,
+}
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def engine_model_tag(name=None):
+    """model_tag of the engine `name` (default: FACE_ENGINE), without creating it."""
+    name = name or getattr(settings, 'FACE_ENGINE', 'deepface')
+    if name not in ENGINES:
+        raise ValueError(f"Unknown FACE_ENGINE {name!r}, expected one of {sorted(ENGINES)}")
+    return ENGINES[name].model_tag
+
+
+def get_engine(name=None):
+    """
+    Return this process's engine for `name` (default: FACE_ENGINE), creating
+    it once. When the gunicorn master started an inference pool for that
+    engine (inference_pool.py), the pool is returned instead.
+    """
+    from .inference_pool import active_pool
+
+    name = name or getattr(settings, 'FACE_ENGINE', 'deepface')
+    pool = active_pool()
+    if pool is not None and pool.name == name:
+        return pool
+    engine = _engines.get(name)
+    if engine is None:
+        if name not in ENGINES:
+            raise ValueError(f"Unknown FACE_ENGINE {name!r}, expected one of {sorted(ENGINES)}")
+        with _engines_lock:
+            engine = _engines.get(name)
+            if engine is None:
+                engine = _engines[name] = ENGINES[name]()
+    return engine
@@ -0,0 +1,487 @@
+"""
+Process-wide in-memory gallery of face embeddings.
+
+All stored embeddings are kept as one L2-normalized float32 matrix with
+parallel arrays of user ids and embedding ids, so a recognition request
+never has to query and JSON-decode UserFaceEmbedding rows. Rows are kept
+grouped by user id, which lets the matcher reduce per-user scores with
+contiguous segments.
+
+With FACE_GALLERY_PRECISION set to 'float16' or 'int8', a quantized copy of
+the matrix (see face_quantization) is what gets scanned on every match.
+
+The gallery is loaded lazily on first use and kept current in place by the
+signal handlers in accounts/signal.py. Other worker processes notice changes
+in one of two ways:
+
+- with FACE_GALLERY_SNAPSHOTS on, by following the shared memory-mapped
+  snapshot published through accounts/gallery_snapshot.py;
+- in every case, through a cheap (count, max id) fingerprint query that runs
+  at most once every FACE_GALLERY_REFRESH_INTERVAL seconds: a gallery older
+  than the database is reloaded, or with snapshots republished, so a
+  snapshot that a dead process never published cannot go stale for good.
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max
+
+logger = logging.getLogger(__name__)
+
+# Columns read from UserFaceEmbedding when building the gallery
+ROW_FIELDS = ('id', 'user_id', 'vector', 'norm', 'embedding')
+
+
+def normalize_rows(vectors):
+    """
+    L2-normalize a vector or a matrix of row vectors as float32.
+
+    Zero vectors are left as zeros, so they score a cosine similarity of 0
+    against everything (same as utils.cosine_similarity).
+    """
+    arr = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(arr, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return arr / norms
+
+
+def user_segments(user_ids):
+    """Start offset of each user's contiguous run of rows in a grouped id array."""
+    if not len(user_ids):
+        return np.zeros(0, dtype=np.intp)
+    return np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+
+
+def gallery_precision():
+    return getattr(settings, 'FACE_GALLERY_PRECISION', 'float32')
+
+
+def user_centroids(matrix, starts):
+    """Normalized mean of each user's rows (one row per segment)."""
+    if not len(starts):
+        return np.zeros((0, matrix.shape[1] if matrix.ndim == 2 else 0), dtype=np.float32)
+    return normalize_rows(np.add.reduceat(matrix, starts, axis=0))
+
+
+class EmbeddingGallery:
+    """
+    Normalized embedding matrix for every user eligible for recognition.
+
+    Arrays are never modified in place: every update builds new arrays and
+    swaps them in under the lock, so a reader holding a reference from
+    ``arrays()`` always sees a consistent snapshot.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._checked_at = 0.0
+        self.matrix = np.zeros((0, 0), dtype=np.float32)
+        self.user_ids = np.zeros(0, dtype=np.int64)
+        self.embedding_ids = np.zeros(0, dtype=np.int64)
+        self.starts = np.zeros(0, dtype=np.intp)
+        self.centroids = np.zeros((0, 0), dtype=np.float32)  # one normalized mean per user segment
+        self.codes = None  # quantized matrix, if FACE_GALLERY_PRECISION is not 'float32'
+        self.scales = None  # per-row int8 scales
+        self.version = None  # snapshot version currently mapped, if any
+        self.generation = 0  # bumped on every change, for caches of match results
+        self._index = None  # IVFIndex, built on demand when FACE_MATCH_INDEX = 'ivf'
+
+    # -----------------------------
+    # Queries
+    # -----------------------------
+    @staticmethod
+    def eligible_embeddings():
+        """
+        Embedding rows of users that can be recognized by the scanner, made
+        by the current FACE_ENGINE. Rows of another engine live in a different
+        embedding space; re-embed them with `compute_embeddings --stale`.
+        """
+        from .face_engine import engine_model_tag
+        from .models import UserFaceEmbedding
+        return UserFaceEmbedding.objects.filter(
+            user__has_face_data=True,
+            user__api_user_id__isnull=False,
+            model_name=engine_model_tag(),
+        )
+
+    @staticmethod
+    def is_user_eligible(user):
+        return bool(user.has_face_data) and user.api_user_id is not None
+
+    @staticmethod
+    def is_embedding_current(embedding):
+        """Whether a UserFaceEmbedding was made by the current FACE_ENGINE."""
+        from .face_engine import engine_model_tag
+        return embedding.model_name == engine_model_tag()
+
+    def _fingerprint(self):
+        from .gallery_snapshot import embedding_fingerprint
+        return embedding_fingerprint(self.embedding_ids)
+
+    @classmethod
+    def database_fingerprint(cls):
+        """(count, max id) of the eligible embedding rows: one cheap aggregate query."""
+        stats = cls.eligible_embeddings().aggregate(count=Count('id'), last=Max('id'))
+        return stats['count'], stats['last']
+
+    # -----------------------------
+    # Loading
+    # -----------------------------
+    def load(self):
+        """(Re)load the whole gallery from the database."""
+        rows = list(
+            self.eligible_embeddings()
+            .order_by('user_id', 'id')
+            .values_list(*ROW_FIELDS)
+        )
+        self._set_arrays(*self._build(rows))
+        logger.info(
+            f"Loaded embedding gallery: {len(self.embedding_ids)} embeddings "
+            f"for {self.user_count} users"
+        )
+
+    def _set_arrays(self, matrix, user_ids, embedding_ids, centroids=None, codes=None, scales=None,
+                    version=None):
+        """Swap in new arrays; centroids and quantized codes are computed unless given."""
+        from .face_quantization import quantize_rows
+
+        starts = user_segments(user_ids)
+        if centroids is None or len(centroids) != len(starts):
+            centroids = user_centroids(matrix, starts)
+        precision = gallery_precision()
+        if codes is None or codes.dtype != np.dtype(precision) or precision == 'float32':
+            codes, scales = quantize_rows(matrix, precision)
+
+        with self._lock:
+            self.matrix = matrix
+            self.user_ids = user_ids
+            self.embedding_ids = embedding_ids
+            self.starts = starts
+            self.centroids = centroids
+            self.codes = codes
+            self.scales = scales
+            self.version = version
+            self.generation += 1
+            self._index = None
+            self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def _follow_snapshot(self):
+        """Map the current snapshot, publishing the first one if there is none."""
+        from .gallery_snapshot import current_version, load_snapshot, publish_from_database
+
+        version = current_version()
+        if version is not None and version == self.version:
+            return
+
+        if version is None:
+            if self._loaded:
+                return
+            try:
+                version = publish_from_database()
+            except OSError as e:
+                logger.error(f"Could not publish gallery snapshot, loading from database: {e}")
+                self.load()
+                return
+
+        arrays = load_snapshot(version)
+        if arrays is not None:
+            self._set_arrays(**arrays, version=version)
+            logger.info(
+                f"Mapped gallery snapshot {version}: {len(self.embedding_ids)} embeddings "
+                f"for {self.user_count} users"
+            )
+        elif not self._loaded:
+            self.load()
+
+    @staticmethod
+    def _build(rows, dimension=None):
+        """
+        Turn (embedding_id, user_id, vector, norm, embedding) rows into gallery
+        arrays. Binary rows are joined and read with one np.frombuffer call;
+        legacy rows that only have the JSON embedding are converted first.
+        """
+        chunks, norms, user_ids, embedding_ids = [], [], [], []
+        for embedding_id, user_id, vector, norm, embedding in rows:
+            if vector is None:
+                if not embedding:
+                    continue
+                values = np.asarray(embedding, dtype=np.float32)
+                vector, norm = values.tobytes(), None
+            size = len(vector) // 4
+            if dimension is None:
+                dimension = size
+            if size != dimension:
+                logger.warning(
+                    f"Skipping embedding {embedding_id}: {size}D, gallery is {dimension}D"
+                )
+                continue
+            chunks.append(vector)
+            norms.append(norm)
+            user_ids.append(user_id)
+            embedding_ids.append(embedding_id)
+
+        if not chunks:
+            return (
+                np.zeros((0, dimension or 0), dtype=np.float32),
+                np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64),
+            )
+
+        matrix = np.frombuffer(b''.join(chunks), dtype=np.float32).reshape(-1, dimension)
+        if any(norm is None for norm in norms):
+            matrix = normalize_rows(matrix)
+        else:
+            norms = np.asarray(norms, dtype=np.float32)
+            norms[norms == 0] = 1.0
+            matrix = matrix / norms[:, None]
+
+        return (
+            matrix,
+            np.asarray(user_ids, dtype=np.int64),
+            np.asarray(embedding_ids, dtype=np.int64),
+        )
+
+    def ensure_loaded(self):
+        """
+        Load the gallery on first use and pick up changes made by other
+        processes: by checking the snapshot pointer on every call when
+        snapshots are on, and the database fingerprint at most once per
+        FACE_GALLERY_REFRESH_INTERVAL seconds.
+        """
+        from .gallery_snapshot import snapshots_enabled
+
+        with self._lock:
+            if snapshots_enabled():
+                self._follow_snapshot()
+            elif not self._loaded:
+                self.load()
+                return
+
+            interval = getattr(settings, 'FACE_GALLERY_REFRESH_INTERVAL', 5.0)
+            if interval is None or time.monotonic() - self._checked_at < interval:
+                return
+
+            self._checked_at = time.monotonic()
+            if self.database_fingerprint() == self._fingerprint():
+                return
+            if snapshots_enabled():
+                self._republish_snapshot()
+            else:
+                logger.info("Embedding gallery is out of date, reloading")
+                self.load()
+
+    def _republish_snapshot(self):
+        """The mapped snapshot is older than the database: publish a current one and map it."""
+        from .gallery_snapshot import load_snapshot, publish_from_database
+
+        logger.info("Gallery snapshot is older than the database, republishing")
+        try:
+            version = publish_from_database(if_stale=True)
+        except OSError as e:
+            logger.error(f"Could not publish gallery snapshot, loading from database: {e}")
+            self.load()
+            return
+        arrays = load_snapshot(version)
+        if arrays is not None:
+            self._set_arrays(**arrays, version=version)
+        else:
+            self.load()
+
+    def arrays(self):
+        """Return a consistent (matrix, user_ids, starts) triple, loading if needed."""
+        self.ensure_loaded()
+        with self._lock:
+            return self.matrix, self.user_ids, self.starts
+
+    def match(self, query_embeddings, threshold=0.45, top_k=1):
+        """
+        Match one embedding or a batch against the gallery.
+
+        Uses the exact matcher (face_matcher) unless FACE_MATCH_INDEX is 'ivf'
+        and the gallery holds at least FACE_IVF_MIN_EMBEDDINGS rows, in which
+        case the approximate IVF index (face_index) is searched instead. The
+        exact matcher scans every row (a quantized gallery's best
+        FACE_MATCH_RERANK_USERS users are re-scored in float32); with the
+        opt-in FACE_MATCH_PREFILTER_USERS it ranks users by centroid first
+        and re-scores only the best of them, which can change decisions.
+        """
+        from .face_matcher import match_embeddings
+        self.ensure_loaded()
+        with self._lock:
+            matrix, user_ids, starts, centroids = self.matrix, self.user_ids, self.starts, self.centroids
+            quantized = self.codes, self.scales
+
+        index = self._approximate_index()
+        if index is not None:
+            return index.search(query_embeddings, threshold=threshold, top_k=top_k)
+
+        return match_embeddings(
+            query_embeddings, matrix, user_ids,
+            threshold=threshold, top_k=top_k, starts=starts,
+            centroids=centroids,
+            prefilter_users=getattr(settings, 'FACE_MATCH_PREFILTER_USERS', 0),
+            quantized=quantized,
+            rerank_users=getattr(settings, 'FACE_MATCH_RERANK_USERS', 10),
+        )
+
+    def _approximate_index(self):
+        """Return the IVF index when it is enabled and worth using, building it if needed."""
+        if getattr(settings, 'FACE_MATCH_INDEX', 'exact') != 'ivf':
+            return None
+        if len(self) < getattr(settings, 'FACE_IVF_MIN_EMBEDDINGS', 20000):
+            return None
+
+        with self._lock:
+            if self._index is None:
+                from .face_index import IVFIndex
+                index = IVFIndex(
+                    n_lists=getattr(settings, 'FACE_IVF_LISTS', None),
+                    nprobe=getattr(settings, 'FACE_IVF_NPROBE', 8),
+                )
+                index.build(self.matrix, self.user_ids, self.embedding_ids)
+                self._index = index
+            return self._index
+
+    def __len__(self):
+        return len(self.embedding_ids)
+
+    @property
+    def user_count(self):
+        return len(self.starts)
+
+    def has_user(self, user_id):
+        with self._lock:
+            return bool(np.any(self.user_ids == user_id))
+
+    # -----------------------------
+    # In-place updates (called from signals)
+    # -----------------------------
+    def _replace(self, keep, new_rows=()):
+        """
+        Swap in arrays made of the kept rows plus new rows, grouped by user.
+        
+        Returns:
+            bool: Whether any row was removed or added
+        """
+        if keep.all() and not new_rows:
+            return False
+
+        from .face_quantization import quantize_rows
+
+        removed_ids = self.embedding_ids[~keep]
+        matrix = self.matrix[keep]
+        user_ids = self.user_ids[keep]
+        embedding_ids = self.embedding_ids[keep]
+        codes = self.codes[keep] if self.codes is not None else None
+        scales = self.scales[keep] if self.scales is not None else None
+
+        if new_rows:
+            dimension = matrix.shape[1] if len(matrix) else None
+            new_matrix, new_user_ids, new_embedding_ids = self._build(new_rows, dimension)
+            if len(new_matrix):
+                if not len(matrix):
+                    matrix = np.zeros((0, new_matrix.shape[1]), dtype=np.float32)
+                # A stable sort keeps existing rows in place and appends the
+                # new ones at the end of their user's segment
+                user_ids = np.concatenate([user_ids, new_user_ids])
+                order = np.argsort(user_ids, kind='stable')
+                user_ids = user_ids[order]
+                matrix = np.concatenate([matrix, new_matrix])[order]
+                embedding_ids = np.concatenate([embedding_ids, new_embedding_ids])[order]
+                # Only the new rows need quantizing
+                new_codes, new_scales = quantize_rows(new_matrix, gallery_precision())
+                if codes is not None and new_codes is not None and codes.dtype == new_codes.dtype:
+                    codes = np.concatenate([codes, new_codes])[order]
+                    scales = np.concatenate([scales, new_scales])[order] if scales is not None else None
+                else:
+                    codes, scales = quantize_rows(matrix, gallery_precision())
+
+            if self._index is not None:
+                self._index.remove(removed_ids)
+                self._index.add(new_embedding_ids, new_user_ids, new_matrix)
+        elif self._index is not None:
+            self._index.remove(removed_ids)
+
+        changed_users = np.union1d(
+            self.user_ids[~keep],
+            new_user_ids if new_rows and len(new_matrix) else np.zeros(0, dtype=np.int64),
+        )
+        starts = user_segments(user_ids)
+        self.centroids = self._updated_centroids(matrix, user_ids, starts, changed_users)
+        self.matrix = matrix
+        self.user_ids = user_ids
+        self.embedding_ids = embedding_ids
+        self.starts = starts
+        self.codes = codes
+        self.scales = scales
+        self.generation += 1
+        return True
+
+    def _updated_centroids(self, matrix, user_ids, starts, changed_users):
+        """Reuse the centroids of untouched users; recompute only the changed ones."""
+        segment_users = user_ids[starts]
+        if not len(self.starts) or not len(segment_users):
+            return user_centroids(matrix, starts)
+
+        old_segment_users = self.user_ids[self.starts]
+        positions = np.minimum(np.searchsorted(old_segment_users, segment_users), len(old_segment_users) - 1)
+        reused = (old_segment_users[positions] == segment_users) & ~np.isin(segment_users, changed_users)
+
+        centroids = np.empty((len(starts), matrix.shape[1]), dtype=np.float32)
+        centroids[reused] = self.centroids[positions[reused]]
+        ends = np.r_[starts[1:], len(user_ids)]
+        for segment in np.flatnonzero(~reused):
+            centroids[segment] = normalize_rows(matrix[starts[segment]:ends[segment]].sum(axis=0))
+        return centroids
+
+    def add_embedding(self, embedding_id, user_id, embedding):
+        """Insert or replace a single embedding row."""
+        with self._lock:
+            if not self._loaded:
+                return False
+            values = np.asarray(embedding, dtype=np.float32)
+            row = (embedding_id, user_id, values.tobytes(), float(np.linalg.norm(values)), None)
+            return self._replace(self.embedding_ids != embedding_id, [row])
+
+    def remove_embedding(self, embedding_id):
+        with self._lock:
+            if not self._loaded:
+                return False
+            return self._replace(self.embedding_ids != embedding_id)
+
+    def load_user(self, user_id):
+        """Replace all rows of one user with what the database holds now."""
+        with self._lock:
+            if not self._loaded:
+                return False
+            rows = list(
+                self.eligible_embeddings()
+                .filter(user_id=user_id)
+                .order_by('id')
+                .values_list(*ROW_FIELDS)
+            )
+            return self._replace(self.user_ids != user_id, rows)
+
+    def remove_user(self, user_id):
+        with self._lock:
+            if not self._loaded:
+                return False
+            return self._replace(self.user_ids != user_id)
+
+    def sync_user(self, user_id, eligible):
+        """Add or drop a user whose recognition eligibility may have changed."""
+        with self._lock:
+            if eligible and not self.has_user(user_id):
+                return self.load_user(user_id)
+            if not eligible and self.has_user(user_id):
+                return self.remove_user(user_id)
+            return False
+
+
+# Shared by every request handled by this process
+embedding_gallery = EmbeddingGallery()
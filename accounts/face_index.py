@@ -0,0 +1,217 @@
+"""
+Approximate nearest-neighbour index for very large embedding galleries.
+
+IVFIndex is an inverted-file index in pure NumPy: spherical k-means splits
+the normalized gallery rows into FACE_IVF_LISTS coarse cells, and a query
+only scans the rows of the FACE_IVF_NPROBE cells whose centroids are closest
+to it. The rows of that shortlist are then re-scored exactly (full float32
+dot products) and reduced to a best score per user, so results have the
+same MatchResult shape and distance/threshold semantics as the brute-force
+matcher in face_matcher.
+
+nprobe is the recall/latency knob: scanning more cells finds more of the
+true neighbours at the cost of more dot products. Rows can be added and
+removed incrementally; centroids are only trained again on a full rebuild.
+"""
+import logging
+import math
+import threading
+
+import numpy as np
+
+from .face_gallery import normalize_rows
+from .face_matcher import NO_MATCH, rank_users
+
+logger = logging.getLogger(__name__)
+
+
+def train_centroids(vectors, n_lists, iterations=10, sample_size=None, seed=0):
+    """
+    Spherical k-means on L2-normalized rows.
+
+    Trains on a random sample (64 rows per list by default), which is plenty
+    for coarse quantization and keeps training time flat as the gallery grows.
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or 64 * n_lists
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+
+    centroids = np.array(vectors[rng.choice(len(vectors), n_lists, replace=False)], dtype=np.float32)
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        counts = np.bincount(assignments, minlength=n_lists)
+        offsets = np.r_[0, np.cumsum(counts)[:-1]]
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(
+            vectors[np.argsort(assignments, kind='stable')], offsets[~empty], axis=0
+        )
+        # Re-seed empty cells with random rows so every list stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index over normalized gallery rows.
+
+    Rows live in append-only arrays addressed by slot; removing an embedding
+    drops its slot from its list and marks it dead. Dead slots are reclaimed
+    on the next build().
+
+    Updates hold the index lock. A search takes a snapshot of the lists and
+    arrays under it and scans them without it: updates replace a list
+    rather than changing it in place and never overwrite a live slot, so the
+    snapshot stays consistent while gallery signals keep updating the index.
+    """
+
+    def __init__(self, n_lists=None, nprobe=8, iterations=10, seed=0):
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.lists = []
+        self._vectors = None
+        self._user_ids = None
+        self._embedding_ids = None
+        self._cells = None  # slot -> list it belongs to
+        self._slots = {}  # embedding_id -> slot
+        self._size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._slots)
+
+    # -----------------------------
+    # Building and updates
+    # -----------------------------
+    def build(self, matrix, user_ids, embedding_ids):
+        """Train centroids on the gallery and assign every row to a list."""
+        with self._lock:
+            self._build(matrix, user_ids, embedding_ids)
+
+    def _build(self, matrix, user_ids, embedding_ids):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        count = len(matrix)
+        n_lists = self.n_lists or max(1, int(math.sqrt(count)))
+        n_lists = max(1, min(n_lists, count))
+
+        if count:
+            self.centroids = train_centroids(matrix, n_lists, self.iterations, seed=self.seed)
+        else:
+            self.centroids = None
+
+        self._vectors = np.array(matrix, dtype=np.float32)
+        self._user_ids = np.asarray(user_ids, dtype=np.int64).copy()
+        self._embedding_ids = np.asarray(embedding_ids, dtype=np.int64).copy()
+        self._size = count
+        self._slots = {int(embedding_id): slot for slot, embedding_id in enumerate(self._embedding_ids)}
+
+        self.lists = []
+        self._cells = np.zeros(count, dtype=np.intp)
+        if count:
+            assignments = self._assign(self._vectors)
+            self._cells = assignments
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+        logger.info(f"Built IVF index: {count} embeddings in {len(self.lists)} lists")
+
+    def _assign(self, vectors, chunk_size=8192):
+        assignments = np.empty(len(vectors), dtype=np.intp)
+        for start in range(0, len(vectors), chunk_size):
+            chunk = vectors[start:start + chunk_size]
+            assignments[start:start + chunk_size] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignments
+
+    def add(self, embedding_ids, user_ids, matrix):
+        """Insert normalized rows into the lists of their nearest centroids."""
+        with self._lock:
+            self._add(embedding_ids, user_ids, matrix)
+
+    def _add(self, embedding_ids, user_ids, matrix):
+        if self.centroids is None:
+            # Nothing to partition yet: a build over just these rows
+            return self._build(matrix, user_ids, embedding_ids)
+
+        self._remove(embedding_ids)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        first = self._size
+        needed = first + len(matrix)
+        if needed > len(self._vectors):
+            capacity = max(needed, 2 * len(self._vectors))
+            self._vectors = np.resize(self._vectors, (capacity, self._vectors.shape[1]))
+            self._user_ids = np.resize(self._user_ids, capacity)
+            self._embedding_ids = np.resize(self._embedding_ids, capacity)
+            self._cells = np.resize(self._cells, capacity)
+
+        self._vectors[first:needed] = matrix
+        self._user_ids[first:needed] = user_ids
+        self._embedding_ids[first:needed] = embedding_ids
+        self._size = needed
+
+        for offset, (embedding_id, cell) in enumerate(zip(embedding_ids, self._assign(matrix))):
+            slot = first + offset
+            self._cells[slot] = cell
+            self._slots[int(embedding_id)] = slot
+            self.lists[cell] = np.append(self.lists[cell], slot)
+
+    def remove(self, embedding_ids):
+        """Drop rows from their lists (their slots become dead)."""
+        with self._lock:
+            self._remove(embedding_ids)
+
+    def _remove(self, embedding_ids):
+        for embedding_id in embedding_ids:
+            slot = self._slots.pop(int(embedding_id), None)
+            if slot is None:
+                continue
+            cell = self._cells[slot]
+            self.lists[cell] = self.lists[cell][self.lists[cell] != slot]
+
+    # -----------------------------
+    # Search
+    # -----------------------------
+    def search(self, query_embeddings, threshold=0.45, top_k=1, nprobe=None):
+        """
+        Approximate counterpart of face_matcher.match_embeddings.
+
+        Returns:
+            list: One MatchResult per query
+        """
+        queries = normalize_rows(np.atleast_2d(query_embeddings))
+        with self._lock:
+            if not self._slots:
+                return [NO_MATCH] * len(queries)
+            centroids, lists = self.centroids, list(self.lists)
+            vectors, user_ids = self._vectors, self._user_ids
+        if queries.shape[1] != vectors.shape[1]:
+            logger.error(
+                f"Query embedding is {queries.shape[1]}D but the index is {vectors.shape[1]}D"
+            )
+            return [NO_MATCH] * len(queries)
+
+        nprobe = max(1, min(nprobe or self.nprobe, len(lists)))
+        centroid_similarities = queries @ centroids.T
+        probes = np.argpartition(-centroid_similarities, nprobe - 1, axis=1)[:, :nprobe]
+
+        results = []
+        for query, cells in zip(queries, probes):
+            slots = np.concatenate([lists[cell] for cell in cells])
+            if not len(slots):
+                results.append(NO_MATCH)
+                continue
+
+            # Exact re-rank of the shortlist, reduced to the best row per user
+            similarities = vectors[slots] @ query
+            users = user_ids[slots]
+            order = np.argsort(users, kind='stable')
+            users, similarities = users[order], similarities[order]
+            starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+            user_similarities = np.maximum.reduceat(similarities, starts)[None, :]
+            results.extend(rank_users(user_similarities, users[starts], threshold, top_k))
+        return results
@@ -0,0 +1,148 @@
+"""
+Vectorized 1:N face matching.
+
+Scores a query embedding (or a batch of them) against every gallery row with
+a single matrix product, reduces the row scores to a best score per user with
+a segment max, and picks the top-k users with argpartition. Distances and
+confidences follow the same definitions as utils.cosine_distance:
+
+    distance   = 1 - cosine_similarity   (lower = more similar)
+    confidence = (1 - distance) * 100
+"""
+from collections import namedtuple
+import logging
+
+import numpy as np
+
+from .face_gallery import normalize_rows, user_segments
+from .face_quantization import quantized_similarities
+
+logger = logging.getLogger(__name__)
+
+# candidates: [(user_id, distance), ...] for the top_k users, best first.
+# user_id/distance/confidence are None when the best distance exceeds the threshold.
+MatchResult = namedtuple('MatchResult', ['user_id', 'distance', 'confidence', 'candidates'])
+
+NO_MATCH = MatchResult(None, None, None, [])
+
+
+def match_embeddings(query_embeddings, matrix, user_ids, threshold=0.45, top_k=1, starts=None,
+                     centroids=None, prefilter_users=0, quantized=None, rerank_users=0):
+    """
+    Find the best matching users for one or more query embeddings.
+
+    With per-user centroids and a prefilter depth, users are first ranked by
+    centroid similarity and only the rows of the best `prefilter_users` users
+    are scored exactly (see prefilter_match). Otherwise, with a quantized
+    copy of the gallery, every row is scored at reduced precision and the
+    best `rerank_users` users are re-scored from the float32 rows.
+
+    Args:
+        query_embeddings: A single embedding (D,) or a batch (Q, D)
+        matrix: (N, D) L2-normalized gallery rows, grouped by user
+        user_ids: (N,) user id of every gallery row
+        threshold: Maximum cosine distance for a valid match
+        top_k: Number of best users to report per query
+        starts: Precomputed user_segments(user_ids), if available
+        centroids: (U, D) normalized per-user centroids, one per segment
+        prefilter_users: Users re-scored exactly after the centroid ranking
+            (0 = score every row)
+        quantized: (codes, scales) from face_quantization.quantize_rows
+        rerank_users: Users re-scored in float32 after a quantized scan
+            (0 = report the quantized distances)
+
+    Returns:
+        list: One MatchResult per query
+    """
+    queries = normalize_rows(np.atleast_2d(query_embeddings))
+
+    if not len(user_ids):
+        return [NO_MATCH] * len(queries)
+
+    if queries.shape[1] != matrix.shape[1]:
+        logger.error(
+            f"Query embedding is {queries.shape[1]}D but the gallery is {matrix.shape[1]}D"
+        )
+        return [NO_MATCH] * len(queries)
+
+    if starts is None:
+        starts = user_segments(user_ids)
+
+    if centroids is not None and 0 < prefilter_users < len(starts):
+        return prefilter_match(
+            queries, matrix, user_ids, starts, centroids, prefilter_users, threshold, top_k
+        )
+
+    segment_users = user_ids[starts]
+
+    if quantized is not None and quantized[0] is not None:
+        similarities = quantized_similarities(queries, *quantized)
+        user_similarities = np.maximum.reduceat(similarities, starts, axis=1)
+        if rerank_users > 0:
+            depth = min(max(rerank_users, top_k), len(starts))
+            candidates = np.argpartition(-user_similarities, depth - 1, axis=1)[:, :depth]
+            return rescore_users(queries, candidates, matrix, user_ids, starts, threshold, top_k)
+        return rank_users(user_similarities, segment_users, threshold, top_k)
+
+    # (Q, N) row similarities -> (Q, U) best similarity per user
+    similarities = queries @ matrix.T
+    user_similarities = np.maximum.reduceat(similarities, starts, axis=1)
+
+    return rank_users(user_similarities, segment_users, threshold, top_k)
+
+
+def prefilter_match(queries, matrix, user_ids, starts, centroids, prefilter_users, threshold, top_k):
+    """
+    Rank users by centroid similarity, then re-score the full embedding sets
+    of the top `prefilter_users` users. Each user's ~25 captures are nearly
+    identical, so the true best user is almost always among the closest
+    centroids while only a fraction of the rows is touched.
+    """
+    candidates = np.argpartition(-(queries @ centroids.T), prefilter_users - 1, axis=1)[:, :prefilter_users]
+    return rescore_users(queries, candidates, matrix, user_ids, starts, threshold, top_k)
+
+
+def rescore_users(queries, candidates, matrix, user_ids, starts, threshold, top_k):
+    """Score every float32 row of each query's candidate user segments and rank them."""
+    ends = np.r_[starts[1:], len(user_ids)]
+    results = []
+    for query, segments in zip(queries, candidates):
+        segments = np.sort(segments)
+        lengths = ends[segments] - starts[segments]
+        offsets = np.r_[0, np.cumsum(lengths)[:-1]]
+        rows = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts[segments], lengths)
+
+        similarities = matrix[rows] @ query
+        user_similarities = np.maximum.reduceat(similarities, offsets)[None, :]
+        results.extend(rank_users(user_similarities, user_ids[starts[segments]], threshold, top_k))
+    return results
+
+
+def rank_users(user_similarities, segment_users, threshold, top_k):
+    """Turn a (Q, U) per-user similarity matrix into top-k MatchResults."""
+    user_count = user_similarities.shape[1]
+    k = max(1, min(top_k, user_count))
+
+    if k < user_count:
+        top = np.argpartition(-user_similarities, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(user_count), user_similarities.shape)
+    top_similarities = np.take_along_axis(user_similarities, top, axis=1)
+
+    order = np.argsort(-top_similarities, axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top_similarities = np.take_along_axis(top_similarities, order, axis=1)
+
+    results = []
+    for users, similarities in zip(segment_users[top], top_similarities):
+        candidates = [
+            (int(user_id), 1.0 - float(similarity))
+            for user_id, similarity in zip(users, similarities)
+        ]
+        best_user_id, best_distance = candidates[0]
+        if best_distance <= threshold:
+            confidence = (1.0 - best_distance) * 100
+            results.append(MatchResult(best_user_id, best_distance, confidence, candidates))
+        else:
+            results.append(MatchResult(None, None, None, candidates))
+    return results
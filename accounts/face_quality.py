@@ -0,0 +1,272 @@
+"""
+Quality gate run on scanner frames before the embedding model.
+
+Dark, blurred or tiny-face frames used to go all the way through the
+recognition model (the DeepFace engine even embeds the whole frame when its
+detector finds nothing) and were then rejected by the match threshold or,
+worse, produced a junk embedding close enough to someone. check_frame()
+measures the frame on a copy downscaled to FACE_QUALITY_ANALYSIS_SIZE and
+raises FrameQualityError with a retry hint for the user when:
+
+- the face (or the whole frame when no face is found) is darker than
+  FACE_QUALITY_MIN_BRIGHTNESS or brighter than FACE_QUALITY_MAX_BRIGHTNESS
+  (mean 0-255 luminance);
+- it is blurred: the variance of the Laplacian of the face, cropped from
+  the full-resolution frame and reduced to at most the 112x112 recognition
+  input, is below FACE_QUALITY_MIN_SHARPNESS;
+- no face is found, or its shorter side is under FACE_QUALITY_MIN_FACE_SIZE
+  frame pixels;
+- the head is tilted more than FACE_QUALITY_MAX_ROLL degrees or turned
+  more than FACE_QUALITY_MAX_YAW (horizontal offset of the nose from the
+  eye midpoint, in eye distances).
+
+Faces are found with YuNet when its weights are present (FACE_YUNET_MODEL,
+see face_engine.py), which also gives the landmarks for the pose checks;
+otherwise with OpenCV's frontal-face Haar cascade, which only finds roughly
+frontal faces and has no landmarks, so the pose checks are skipped. The
+cascade finds nothing smaller than its 24 px window, so it runs on a copy
+large enough for faces a little under FACE_QUALITY_MIN_FACE_SIZE to be
+found and reported as too small. Without either detector only brightness
+and sharpness are checked.
+"""
+from collections import Counter, namedtuple
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Size of the face crop the sharpness is measured on: the SFace input
+SHARPNESS_SIZE = 112
+
+# Detection window of the frontal-face Haar cascade: it finds no smaller face
+HAAR_WINDOW = 24
+
+# Measurements of one frame; box (x, y, width, height in frame pixels),
+# face_size, roll and yaw are None when not measured
+QualityReport = namedtuple('QualityReport', 'brightness sharpness box face_size roll yaw milliseconds')
+
+HINTS = {
+    'too_dark': 'The image is too dark. Please move to a brighter spot and face the light.',
+    'too_bright': 'The image is overexposed. Please avoid strong light on or behind your face.',
+    'blurry': 'The image is blurry. Please hold still and look at the camera.',
+    'no_face': 'No face found. Please look straight at the camera from closer.',
+    'face_too_small': 'Your face is too small in the picture. Please move closer to the camera.',
+    'head_tilted': 'Please keep your head straight.',
+    'face_turned': 'Please face the camera directly.',
+}
+
+
+class FrameQualityError(Exception):
+    """A frame failed the quality gate; `hint` tells the user how to retry."""
+
+    def __init__(self, reason, report):
+        super().__init__(f"{reason}: {HINTS[reason]}")
+        self.reason = reason
+        self.hint = HINTS[reason]
+        self.report = report
+
+
+# -----------------------------
+# Cheap face detection
+# -----------------------------
+_local = threading.local()  # detectors keep per-call state: one per thread
+_detector_missing_logged = False
+
+
+def _detector():
+    """This thread's ('yunet' | 'haar', detector), or None if neither is available."""
+    if not hasattr(_local, 'detector'):
+        _local.detector = _create_detector()
+    return _local.detector
+
+
+def _create_detector():
+    global _detector_missing_logged
+    import cv2
+    from .face_engine import WEIGHTS_DIR
+
+    yunet_path = getattr(settings, 'FACE_YUNET_MODEL', os.path.join(WEIGHTS_DIR, "face_detection_yunet_2023mar.onnx"))
+    if os.path.exists(yunet_path):
+        return 'yunet', cv2.FaceDetectorYN.create(
+            yunet_path, "", (320, 320), getattr(settings, 'FACE_DETECTOR_SCORE_THRESHOLD', 0.8), 0.3, 5000
+        )
+
+    data = getattr(cv2, 'data', None)
+    cascade_path = os.path.join(data.haarcascades, 'haarcascade_frontalface_default.xml') if data else None
+    if hasattr(cv2, 'CascadeClassifier') and cascade_path and os.path.exists(cascade_path):
+        return 'haar', cv2.CascadeClassifier(cascade_path)
+
+    if not _detector_missing_logged:
+        _detector_missing_logged = True
+        logger.warning("No YuNet weights or Haar cascade found: face size and pose quality checks are skipped")
+    return None
+
+
+def _largest_face(frame, small, scale, min_size):
+    """
+    Args:
+        frame: The decoded frame
+        small: frame downscaled by scale for analysis
+        min_size: Smallest face side worth finding, in frame pixels
+
+    Returns:
+        tuple or None: (box in frame pixels, landmarks) of the largest face;
+        landmarks are YuNet's (5, 2) points in analysis pixels, or None
+    """
+    import cv2
+
+    detector = _detector()
+    if detector is None:
+        return None
+    kind, model = detector
+    if kind == 'yunet':
+        model.setInputSize((small.shape[1], small.shape[0]))
+        _, faces = model.detect(small)
+        if faces is None or not len(faces):
+            return None
+        face = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+        return face[:4] / scale, face[4:14].reshape(5, 2)
+
+    # A min_size face can be under the window on the analysis copy: detect
+    # on one where it covers the window
+    haar_scale = min(max(scale, HAAR_WINDOW / max(min_size, 1.0)), 1.0)
+    image = small
+    if haar_scale != scale:
+        image = cv2.resize(frame, None, fx=haar_scale, fy=haar_scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    side = max(int(min_size * haar_scale), HAAR_WINDOW)
+    faces = model.detectMultiScale(gray, scaleFactor=1.2, minNeighbors=4, minSize=(side, side))
+    if not len(faces):
+        return None
+    return faces[np.argmax(faces[:, 2] * faces[:, 3])].astype(np.float32) / haar_scale, None
+
+
+# -----------------------------
+# Checks
+# -----------------------------
+def _crop(image, box):
+    x, y, width, height = (int(round(value)) for value in box)
+    return image[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)]
+
+
+def _gray(image):
+    import cv2
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def assess_frame(frame):
+    """
+    Measure a decoded BGR frame.
+
+    Returns:
+        QualityReport
+    """
+    import cv2
+
+    started = time.perf_counter()
+    min_face = getattr(settings, 'FACE_QUALITY_MIN_FACE_SIZE', 60)
+    scale = min(getattr(settings, 'FACE_QUALITY_ANALYSIS_SIZE', 160) / max(frame.shape[:2]), 1.0)
+    small = frame if scale == 1.0 else cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    if small.ndim == 2:
+        small = cv2.cvtColor(small, cv2.COLOR_GRAY2BGR)
+
+    # Faces well under the minimum would be rejected anyway: skip those scales
+    face = _largest_face(frame, small, scale, min_face * 0.8)
+    face_box = face_size = roll = yaw = None
+    region, crop = small, None
+    if face is not None:
+        box, landmarks = face
+        face_box = tuple(float(value) for value in box)
+        face_size = min(face_box[2], face_box[3])
+        region = _crop(small, [value * scale for value in face_box])
+        crop = _crop(frame, face_box)
+        if not region.size or not crop.size:
+            region, crop = small, None
+        if landmarks is not None:
+            right_eye, left_eye, nose = landmarks[0], landmarks[1], landmarks[2]
+            eye_distance = float(np.linalg.norm(left_eye - right_eye))
+            roll = math.degrees(math.atan2(left_eye[1] - right_eye[1], left_eye[0] - right_eye[0]))
+            yaw = float(abs(nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance) if eye_distance else None
+
+    brightness = float(_gray(region).mean())
+    # Sharpness of the face cropped from the full frame, reduced to the
+    # 112x112 recognition input but never upscaled (upscaling blurs it);
+    # without a face, of the whole analysis copy
+    sharp = _gray(small if crop is None else crop)
+    if crop is None or min(sharp.shape) > SHARPNESS_SIZE:
+        sharp = cv2.resize(sharp, (SHARPNESS_SIZE, SHARPNESS_SIZE), interpolation=cv2.INTER_AREA)
+    sharpness = float(cv2.Laplacian(sharp, cv2.CV_64F).var())
+    return QualityReport(
+        brightness, sharpness, face_box, face_size, roll, yaw, (time.perf_counter() - started) * 1000
+    )
+
+
+def problem(report, detector_available=True):
+    """The first failed check of a QualityReport (see HINTS), or None."""
+    if report.brightness < getattr(settings, 'FACE_QUALITY_MIN_BRIGHTNESS', 40):
+        return 'too_dark'
+    if report.brightness > getattr(settings, 'FACE_QUALITY_MAX_BRIGHTNESS', 220):
+        return 'too_bright'
+    if report.sharpness < getattr(settings, 'FACE_QUALITY_MIN_SHARPNESS', 40.0):
+        return 'blurry'
+    if report.face_size is None:
+        return 'no_face' if detector_available else None
+    if report.face_size < getattr(settings, 'FACE_QUALITY_MIN_FACE_SIZE', 60):
+        return 'face_too_small'
+    if report.roll is not None and abs(report.roll) > getattr(settings, 'FACE_QUALITY_MAX_ROLL', 25):
+        return 'head_tilted'
+    if report.yaw is not None and report.yaw > getattr(settings, 'FACE_QUALITY_MAX_YAW', 0.35):
+        return 'face_turned'
+    return None
+
+
+_counters = Counter()
+_counters_lock = threading.Lock()
+
+
+def check_frame(frame):
+    """
+    Run the quality gate on a decoded BGR frame.
+
+    Returns:
+        QualityReport: The measurements of an accepted frame
+
+    Raises:
+        FrameQualityError: The frame should not reach the recognition model
+    """
+    report = assess_frame(frame)
+    reason = problem(report, detector_available=_detector() is not None)
+    with _counters_lock:
+        _counters['checked'] += 1
+        _counters[reason or 'accepted'] += 1
+    if reason is not None:
+        logger.info(
+            f"Frame rejected by quality gate ({reason}) in {report.milliseconds:.1f} ms: "
+            f"brightness={report.brightness:.0f} sharpness={report.sharpness:.0f} face_size={report.face_size}"
+        )
+        raise FrameQualityError(reason, report)
+    return report
+
+
+def enabled():
+    return getattr(settings, 'FACE_QUALITY_CHECKS', True)
+
+
+def stats():
+    with _counters_lock:
+        counters = dict(_counters)
+    checked = counters.pop('checked', 0)
+    accepted = counters.pop('accepted', 0)
+    return {
+        'enabled': enabled(),
+        'checked': checked,
+        'accepted': accepted,
+        'rejected': checked - accepted,
+        'rejections': counters,
+    }
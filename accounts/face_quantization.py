@@ -0,0 +1,72 @@
+"""
+Reduced-precision copies of the embedding gallery.
+
+FACE_GALLERY_PRECISION selects how the rows scanned on every match are
+stored:
+
+- 'float32': no quantized copy, the normalized matrix is scanned directly;
+- 'float16': half precision, 2x smaller;
+- 'int8':    symmetric per-row quantization, codes = round(row / scale) with
+             scale = max(|row|) / 127, 4x smaller.
+
+What a reduced precision saves is memory: the copy every worker keeps (or
+maps, with snapshots) is 2x or 4x smaller. It does not make the scan
+cheaper. NumPy has no BLAS-backed float16 or integer matrix product (both
+measure many times slower than float32), so scanning walks the codes in
+cache-sized chunks and widens each chunk to float32 just before a float32
+matrix product. An int8 scan costs about what a float32 scan does; float16
+costs more because widening it is slow. The float32 rows stay available
+(memory-mapped when snapshots are on) for re-ranking the best candidates
+exactly.
+"""
+import numpy as np
+
+PRECISIONS = ('float32', 'float16', 'int8')
+
+# Rows widened to float32 at a time (~2 MB for 128D embeddings)
+CHUNK_ROWS = 4096
+
+
+def quantize_rows(matrix, precision):
+    """
+    Quantize normalized rows.
+
+    Returns:
+        tuple: (codes, scales); scales is None unless precision is 'int8',
+        and both are None for 'float32'
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown gallery precision {precision!r}, expected one of {PRECISIONS}")
+    if precision == 'float32':
+        return None, None
+
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if precision == 'float16':
+        return matrix.astype(np.float16), None
+
+    scales = np.abs(matrix).max(axis=1) / 127.0 if len(matrix) else np.zeros(0, dtype=np.float32)
+    scales = scales.astype(np.float32)
+    safe_scales = np.where(scales == 0, 1.0, scales)
+    codes = np.clip(np.rint(matrix / safe_scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_rows(codes, scales):
+    rows = codes.astype(np.float32)
+    if scales is not None:
+        rows *= scales[:, None]
+    return rows
+
+
+def quantized_similarities(queries, codes, scales):
+    """
+    Approximate (Q, N) cosine similarities of normalized queries against
+    quantized rows. The products are float32; only the storage is reduced.
+    """
+    similarities = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), CHUNK_ROWS):
+        chunk = codes[start:start + CHUNK_ROWS].astype(np.float32)
+        similarities[:, start:start + CHUNK_ROWS] = queries @ chunk.T
+    if scales is not None:
+        similarities *= scales
+    return similarities
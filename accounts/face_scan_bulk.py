@@ -52,7 +52,6 @@ import pickle
 import numpy as np
 from datetime import datetime
 from django.conf import settings
-from deepface import DeepFace
 from .models import Attendance, CustomUser
 
 # -----------------------------
@@ -61,8 +60,6 @@ from .models import Attendance, CustomUser
 FACE_DB = os.path.join(settings.MEDIA_ROOT, "faces")
 os.makedirs(FACE_DB, exist_ok=True)
 
-TEMP_IMAGE = os.path.join(settings.MEDIA_ROOT, "temp.jpg")
-
 # Optional embeddings file (if you want to save embeddings)
 EMBEDDINGS_FILE = os.path.join(settings.MEDIA_ROOT, "face_embeddings.pkl")
 
@@ -90,13 +87,12 @@ def add_face_image(username, img):
 # Recognize Face
 # -----------------------------
 def recognize_face(frame, threshold=0.45):
-    import cv2
     """
     Recognize face from frame using DeepFace.verify against stored images.
+    The decoded frame is passed to DeepFace as-is, never written to disk.
     Returns username if match found.
     """
-    # Save frame temporarily
-    cv2.imwrite(TEMP_IMAGE, frame)
+    from deepface import DeepFace  # imported on use: pulls in TensorFlow
 
     best_match = None
     best_distance = 10.0
@@ -110,7 +106,7 @@ def recognize_face(frame, threshold=0.45):
             db_img_path = os.path.join(user_folder, img_file)
             try:
                 result = DeepFace.verify(
-                    TEMP_IMAGE,
+                    frame,
                     db_img_path,
                     model_name="SFace",
                     detector_backend="mtcnn",  # more reliable than opencv
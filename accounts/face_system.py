@@ -3,7 +3,6 @@ import os
 import numpy as np
 from datetime import datetime
 from django.conf import settings
-from deepface import DeepFace
 from .models import Attendance, CustomUser
 
 # -----------------------------
@@ -12,8 +11,6 @@ from .models import Attendance, CustomUser
 FACE_DB = os.path.join(settings.MEDIA_ROOT, "faces")
 os.makedirs(FACE_DB, exist_ok=True)
 
-TEMP_IMAGE = os.path.join(settings.MEDIA_ROOT, "temp.jpg")
-
 # -----------------------------
 # Add Face Image
 # -----------------------------
@@ -48,17 +45,17 @@ def add_face_image(username, img):
 # Recognize Logged-in User Face Only
 # -----------------------------
 import os
-from deepface import DeepFace
 from django.conf import settings
 from .models import CustomUser
 
 def recognize_logged_in_user(frame, username, threshold=0.45):
-    import cv2
     """
     Recognize only the logged-in user's approved face images.
     Ignores pending/unapproved images.
     Returns username if match found, else None.
     """
+    from deepface import DeepFace  # imported on use: pulls in TensorFlow
+
     # Paths
     FACE_DB = os.path.join(settings.MEDIA_ROOT, "faces")
     PENDING_DB = os.path.join(settings.MEDIA_ROOT, "pending_faces")
@@ -68,10 +65,6 @@ def recognize_logged_in_user(frame, username, threshold=0.45):
     if not os.path.exists(user_folder) or len(os.listdir(user_folder)) == 0:
         return None
 
-    # Save current frame temporarily
-    temp_image = os.path.join(settings.MEDIA_ROOT, "temp.jpg")
-    cv2.imwrite(temp_image, frame)
-
     best_match = None
     best_distance = 10.0
 
@@ -79,8 +72,9 @@ def recognize_logged_in_user(frame, username, threshold=0.45):
     for img_file in os.listdir(user_folder):
         db_img_path = os.path.join(user_folder, img_file)
         try:
+            # DeepFace takes the decoded BGR frame directly, no temp file
             result = DeepFace.verify(
-                temp_image,
+                frame,
                 db_img_path,
                 model_name="SFace",
                 detector_backend="mtcnn",
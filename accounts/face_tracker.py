@@ -0,0 +1,230 @@
+"""
+Face tracking across the consecutive frames of one camera stream.
+
+A kiosk streaming frames over the recognition socket sends the same person
+many times a second, and each frame used to be embedded and matched on its
+own. A FaceTracker follows face boxes from frame to frame (IoU overlap,
+falling back to centroid distance for fast movement) and remembers who each
+track was recognized as:
+
+- a track is identified once FACE_TRACK_CONFIRM_MATCHES consecutive
+  embeddings matched the same user;
+- later frames of an identified track skip the embedding and reuse its
+  match, until the track is lost (no box for FACE_TRACK_MAX_AGE seconds) or
+  FACE_TRACK_REVERIFY_SECONDS have passed since the last embedding, when the
+  next frame is embedded again; a disagreeing match starts the vote over.
+
+Boxes are in the client's full-frame video coordinates: the client's own
+face box, or the quality gate's box (face_quality.py) moved back into the
+video by the place of the uploaded crop. Frames without such a box are
+always embedded. A reused match identifies the face but never marks
+attendance; only an embedded frame does. Each socket connection owns one
+tracker; stats() of every live tracker in the process feeds
+api/stats/face-tracks/.
+"""
+from collections import Counter
+from itertools import count
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_track_ids = count(1)
+_trackers = weakref.WeakSet()
+
+
+def box_iou(a, b):
+    """Intersection over union of two (x, y, width, height) boxes."""
+    left, top = max(a[0], b[0]), max(a[1], b[1])
+    right = min(a[0] + a[2], b[0] + b[2])
+    bottom = min(a[1] + a[3], b[1] + b[3])
+    intersection = max(right - left, 0) * max(bottom - top, 0)
+    union = a[2] * a[3] + b[2] * b[3] - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def _centroid_shift(a, b):
+    """Distance between box centres, in units of the larger box side."""
+    dx = (a[0] + a[2] / 2) - (b[0] + b[2] / 2)
+    dy = (a[1] + a[3] / 2) - (b[1] + b[3] / 2)
+    return (dx * dx + dy * dy) ** 0.5 / max(a[2], a[3], b[2], b[3], 1)
+
+
+class Track:
+    """One face followed across frames, and what it was recognized as."""
+
+    def __init__(self, box, now):
+        self.id = next(_track_ids)
+        self.box = box
+        self.started = now
+        self.last_seen = now
+        self.frames = 0
+        self.embedded = 0
+        self.skipped = 0
+        # Identity vote: the user the last embeddings agreed on
+        self.candidate = None
+        self.votes = 0
+        self.verified_at = None
+        self.embedding = None
+        self.match = None  # (user_id, distance, confidence) of the last embedding
+
+    def identified(self):
+        return self.candidate is not None and self.votes >= getattr(settings, 'FACE_TRACK_CONFIRM_MATCHES', 2)
+
+    def stats(self, now):
+        user_id, distance, _ = self.match or (None, None, None)
+        return {
+            'id': self.id,
+            'user_id': self.candidate if self.identified() else None,
+            'identified': self.identified(),
+            'seconds': round(now - self.started, 2),
+            'frames': self.frames,
+            'embedded': self.embedded,
+            'skipped': self.skipped,
+            'last_distance': None if distance is None else round(distance, 4),
+        }
+
+
+class FaceTracker:
+    """IoU/centroid tracker for the frames of one camera."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._tracks = []
+        self._counters = Counter()
+        _trackers.add(self)
+
+    def update(self, box, now=None):
+        """
+        Assign a frame's face box to a live track, or start a new one.
+
+        Returns:
+            Track
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            track = self._closest(box)
+            if track is None:
+                track = Track(box, now)
+                self._tracks.append(track)
+                self._counters['tracks'] += 1
+            track.box = box
+            track.last_seen = now
+            track.frames += 1
+            self._counters['frames'] += 1
+            return track
+
+    def reusable_match(self, track, now=None):
+        """
+        The match a frame of this track can reuse without embedding, or None
+        when the track is not identified or is due for re-verification.
+
+        Returns:
+            tuple or None: (embedding, (user_id, distance, confidence))
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if not track.identified():
+                return None
+            if now - track.verified_at >= getattr(settings, 'FACE_TRACK_REVERIFY_SECONDS', 3.0):
+                self._counters['reverifications'] += 1
+                return None
+            track.skipped += 1
+            self._counters['skipped'] += 1
+            return track.embedding, track.match
+
+    def record(self, track, embedding, match, now=None):
+        """Record the result of embedding a frame of this track."""
+        now = time.monotonic() if now is None else now
+        user_id = match[0]
+        with self._lock:
+            track.embedded += 1
+            self._counters['embedded'] += 1
+            if user_id is not None and user_id == track.candidate:
+                track.votes += 1
+            else:
+                if track.identified():
+                    logger.info(f"Track {track.id} ({self.name}): user {track.candidate} not confirmed on re-verification")
+                track.candidate = user_id
+                track.votes = 1 if user_id is not None else 0
+            track.embedding = embedding
+            track.match = match
+            track.verified_at = now
+
+    def _closest(self, box):
+        min_iou = getattr(settings, 'FACE_TRACK_MIN_IOU', 0.3)
+        best, best_iou = None, min_iou
+        for track in self._tracks:
+            iou = box_iou(track.box, box)
+            if iou >= best_iou:
+                best, best_iou = track, iou
+        if best is None:
+            # Fast movement between frames: fall back to the nearest centre
+            shifts = [(_centroid_shift(track.box, box), track) for track in self._tracks]
+            shifts = [(shift, track) for shift, track in shifts if shift <= 0.5]
+            if shifts:
+                best = min(shifts, key=lambda item: item[0])[1]
+        return best
+
+    def _expire(self, now):
+        max_age = getattr(settings, 'FACE_TRACK_MAX_AGE', 1.0)
+        for track in [track for track in self._tracks if now - track.last_seen > max_age]:
+            self._tracks.remove(track)
+            self._counters['lost'] += 1
+            self._log_track(track, now)
+
+    def _log_track(self, track, now):
+        stats = track.stats(now)
+        logger.info(
+            f"Track {track.id} ({self.name}) ended: user_id={stats['user_id']} {stats['frames']} frames, "
+            f"{stats['embedded']} embedded, {stats['skipped']} skipped, {stats['seconds']}s"
+        )
+
+    def close(self):
+        """End every track (the stream is gone) and stop reporting this tracker."""
+        now = time.monotonic()
+        with self._lock:
+            for track in self._tracks:
+                self._log_track(track, now)
+            self._tracks = []
+        _trackers.discard(self)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            counters = dict(self._counters)
+            tracks = [track.stats(now) for track in self._tracks]
+        frames = counters.get('frames', 0)
+        return {
+            'name': self.name,
+            'frames': frames,
+            'embedded': counters.get('embedded', 0),
+            'skipped': counters.get('skipped', 0),
+            'skip_rate': counters.get('skipped', 0) / frames if frames else 0.0,
+            'tracks_started': counters.get('tracks', 0),
+            'tracks_lost': counters.get('lost', 0),
+            'reverifications': counters.get('reverifications', 0),
+            'active_tracks': tracks,
+        }
+
+
+def enabled():
+    return getattr(settings, 'FACE_TRACKING', True)
+
+
+def stats():
+    """Stats of every live tracker in this process (one per streaming connection)."""
+    trackers = [tracker.stats() for tracker in list(_trackers)]
+    return {
+        'enabled': enabled(),
+        'trackers': trackers,
+        'frames': sum(tracker['frames'] for tracker in trackers),
+        'skipped': sum(tracker['skipped'] for tracker in trackers),
+    }
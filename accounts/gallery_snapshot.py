@@ -0,0 +1,279 @@
+"""
+Versioned on-disk snapshots of the embedding gallery.
+
+A snapshot is a directory of .npy files (normalized matrix, user ids,
+embedding ids, per-user centroids and, for a reduced FACE_GALLERY_PRECISION,
+the quantized matrix) under FACE_GALLERY_SNAPSHOT_DIR. The CURRENT file names the
+active version and is swapped atomically with os.replace(). Readers open the
+matrix with np.load(mmap_mode='r'), so every gunicorn worker shares the same
+page-cache pages instead of holding a private copy, and a freshly forked
+worker can serve its first scan without touching the database.
+
+Snapshots are always rebuilt from the database while holding an exclusive
+file lock, so concurrent publishers in different workers cannot overwrite a
+newer state with an older one.
+
+Workers republish after embedding changes with a debounce timer (see
+SnapshotPublisher). Processes that may exit before the timer fires flush it:
+the management commands that write embeddings publish synchronously when
+they finish, and any other process (shell, recycled worker) publishes a
+pending snapshot at interpreter exit. Readers also compare the mapped
+snapshot with the database every FACE_GALLERY_REFRESH_INTERVAL seconds and
+republish it when it is older (face_gallery.EmbeddingGallery.ensure_loaded).
+"""
+import atexit
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARRAY_NAMES = ('matrix', 'user_ids', 'embedding_ids')
+
+# Derived arrays; readers compute them when missing
+OPTIONAL_ARRAY_NAMES = ('centroids', 'codes', 'scales')
+
+# Older versions kept around for readers that have not switched yet
+KEEP_VERSIONS = 2
+
+
+def snapshots_enabled():
+    return getattr(settings, 'FACE_GALLERY_SNAPSHOTS', False)
+
+
+def snapshot_dir():
+    return getattr(
+        settings, 'FACE_GALLERY_SNAPSHOT_DIR',
+        os.path.join(settings.MEDIA_ROOT, 'gallery_snapshots'),
+    )
+
+
+def current_version():
+    """Return the active snapshot version, or None if none was published yet."""
+    try:
+        with open(os.path.join(snapshot_dir(), 'CURRENT')) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_snapshot(version):
+    """
+    Memory-map one snapshot version.
+
+    Returns:
+        dict: Array name -> memory-mapped array (optional arrays that were
+        not written are None), or None if the snapshot is gone
+    """
+    version_dir = os.path.join(snapshot_dir(), version)
+    try:
+        arrays = {
+            name: np.load(os.path.join(version_dir, f'{name}.npy'), mmap_mode='r')
+            for name in ARRAY_NAMES
+        }
+        for name in OPTIONAL_ARRAY_NAMES:
+            path = os.path.join(version_dir, f'{name}.npy')
+            arrays[name] = np.load(path, mmap_mode='r') if os.path.exists(path) else None
+        return arrays
+    except (FileNotFoundError, ValueError) as e:
+        logger.warning(f"Could not open gallery snapshot {version}: {e}")
+        return None
+
+
+def _write_array(path, array):
+    with open(path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def write_snapshot(matrix, user_ids, embedding_ids, **derived):
+    """
+    Write a new snapshot version and make it the current one.
+
+    Args:
+        derived: Optional arrays named in OPTIONAL_ARRAY_NAMES (None = skip)
+    """
+    root = snapshot_dir()
+    os.makedirs(root, exist_ok=True)
+
+    version = f"v{time.time_ns()}-{os.getpid()}"
+    staging_dir = os.path.join(root, f".staging-{version}")
+    os.makedirs(staging_dir)
+    arrays = dict(zip(ARRAY_NAMES, (matrix, user_ids, embedding_ids)), **derived)
+    for name, array in arrays.items():
+        if array is not None:
+            _write_array(os.path.join(staging_dir, f'{name}.npy'), array)
+    os.rename(staging_dir, os.path.join(root, version))
+
+    pointer = os.path.join(root, f".CURRENT-{version}")
+    with open(pointer, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer, os.path.join(root, 'CURRENT'))
+
+    _prune(root, version)
+    logger.info(f"Published gallery snapshot {version}: {len(embedding_ids)} embeddings")
+    return version
+
+
+def _prune(root, current):
+    versions = sorted(
+        (name for name in os.listdir(root) if name.startswith('v') and name != current),
+        key=lambda name: int(name[1:].split('-')[0]),
+    )
+    for name in versions[:-KEEP_VERSIONS]:
+        # Open memory maps keep their pages alive after the files are removed
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class _PublishLock:
+    """Exclusive lock shared by every process publishing to the snapshot dir."""
+
+    def __enter__(self):
+        os.makedirs(snapshot_dir(), exist_ok=True)
+        self._file = open(os.path.join(snapshot_dir(), '.lock'), 'w')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+
+
+def embedding_fingerprint(embedding_ids):
+    """(count, max id) of a gallery's embedding ids, comparable with EmbeddingGallery.database_fingerprint()."""
+    count = len(embedding_ids)
+    return count, int(np.max(embedding_ids)) if count else None
+
+
+def publish_from_database(if_stale=False):
+    """
+    Rebuild the gallery from the database and publish it as a snapshot.
+
+    Args:
+        if_stale: Keep the current snapshot when it already matches the
+            database fingerprint (another process republished it while this
+            one waited for the lock)
+
+    Returns:
+        str: The current snapshot version
+    """
+    from .face_gallery import ROW_FIELDS, EmbeddingGallery, gallery_precision, user_centroids, user_segments
+    from .face_quantization import quantize_rows
+
+    with _PublishLock():
+        if if_stale:
+            version = current_version()
+            arrays = load_snapshot(version) if version is not None else None
+            if arrays is not None and (
+                embedding_fingerprint(arrays['embedding_ids']) == EmbeddingGallery.database_fingerprint()
+            ):
+                return version
+
+        rows = (
+            EmbeddingGallery.eligible_embeddings()
+            .order_by('user_id', 'id')
+            .values_list(*ROW_FIELDS)
+            .iterator(chunk_size=2000)
+        )
+        matrix, user_ids, embedding_ids = EmbeddingGallery._build(rows)
+        codes, scales = quantize_rows(matrix, gallery_precision())
+        return write_snapshot(
+            matrix, user_ids, embedding_ids,
+            centroids=user_centroids(matrix, user_segments(user_ids)),
+            codes=codes, scales=scales,
+        )
+
+
+class SnapshotPublisher:
+    """
+    Debounced background publisher. Registering a face saves ~25 embeddings
+    in a row; they are folded into one snapshot written once the changes
+    have settled for FACE_GALLERY_SNAPSHOT_DELAY seconds. A publish still
+    pending when the interpreter exits is done synchronously by flush().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer = None
+        self._if_stale = False
+        self._exit_hook = False
+
+    def schedule(self, if_stale=False):
+        """
+        Args:
+            if_stale: Skip the rebuild if the current snapshot still matches
+                the database (see publish_from_database); only honoured when
+                every change folded into this publish asked for it
+        """
+        delay = getattr(settings, 'FACE_GALLERY_SNAPSHOT_DELAY', 2.0)
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                if_stale = if_stale and self._if_stale
+            self._if_stale = if_stale
+            self._timer = threading.Timer(delay, self._publish)
+            self._timer.daemon = True
+            self._timer.start()
+            if not self._exit_hook:
+                atexit.register(self.flush)
+                self._exit_hook = True
+
+    def flush(self):
+        """Publish now if a publish is pending."""
+        with self._lock:
+            if self._timer is None:
+                return
+            self._timer.cancel()
+        self._publish()
+
+    def publish(self):
+        """Publish now, replacing any pending publish (end of a bulk change)."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._if_stale = False
+        self._publish()
+
+    def _publish(self):
+        with self._lock:
+            self._timer = None
+            if_stale, self._if_stale = self._if_stale, False
+        try:
+            publish_from_database(if_stale=if_stale)
+        except Exception as e:
+            logger.error(f"Error publishing gallery snapshot: {str(e)}")
+        finally:
+            from django.db import connection
+            connection.close()
+
+
+snapshot_publisher = SnapshotPublisher()
+
+
+def publish_now():
+    """
+    Publish synchronously, when snapshots are on, at the end of a management
+    command that changed embeddings; its pending timer would die with it.
+
+    Returns:
+        bool: Whether a snapshot was published
+    """
+    if not snapshots_enabled():
+        return False
+    snapshot_publisher.publish()
+    return True
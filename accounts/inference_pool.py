@@ -0,0 +1,638 @@
+"""
+Machine-wide pool of model-holding processes for face embedding.
+
+Without the pool every gunicorn worker imports TensorFlow and builds its
+own copy of the face models, and each copy sizes its thread pools to the
+whole machine. With FACE_INFERENCE_POOL_PROCESSES > 0 the gunicorn master
+starts that many model processes before forking workers (on_starting in
+gunicorn.conf.py). The HTTP workers stay free of TensorFlow, so there can be
+many of them, while model memory and thread counts are set once per machine.
+
+Frames go to the model processes through fixed slots in shared memory:
+
+- a client takes a free slot number from the free-slot pipe, copies the
+  decoded frame into the slot and writes (slot, shape, max_faces) to the
+  request pipe;
+- a model process reads whatever requests are queued (up to
+  FACE_INFERENCE_POOL_MAX_BATCH), embeds them with one represent_batch()
+  call (frames asking for every face go through represent_faces()), writes
+  the result to the head of its slot and signals the slot's done pipe;
+- the client reads the result and returns the slot to the free-slot pipe.
+
+Only slot numbers and shapes go through the pipes; pixels are never pickled.
+The slots live in an unlinked temporary file mapped by every process (in
+/dev/shm where there is one), not in multiprocessing.shared_memory, whose
+resource tracker unlinks a segment when a process that attached it exits.
+Pipes and the mapping are plain file descriptors, so workers forked from the
+master inherit them as they are: there are no feeder threads or locks to
+repair after the fork.
+
+The model processes are started with subprocess, not multiprocessing, so
+forked workers do not adopt them as children of their own. A monitor thread
+in the master watches them: a process that exits is restarted (with a
+growing delay while it keeps dying before its models load) and the frames
+it was embedding are failed at once instead of timing out. It also returns
+the slots of clients that died holding them (a worker killed mid-request) to
+the free-slot pipe, once no model process is on them any more. Clients embed
+inline, with the engine loaded in their own process, while no model process
+is running and for frames whose model process died.
+
+The pool stands in for the configured engine: face_engine.get_engine()
+returns it in every process forked from the master that started it, so
+compute_face_embedding(s) and everything built on them (scans,
+registration, the inference scheduler, warm-up) use it unchanged.
+"""
+from collections import deque
+import json
+import logging
+import mmap
+import os
+import select
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from .face_engine import ENGINES, FaceEngine, _describe
+
+logger = logging.getLogger(__name__)
+
+# Head of each slot: int32 (status, length) then `length` float32 values:
+# the embedding, or for STATUS_FACES the row width followed by one
+# (x, y, width, height, embedding...) row per face
+RESULT_FLOATS = 4096  # room for the largest DeepFace embedding (VGG-Face)
+RESULT_BYTES = 8 + RESULT_FLOATS * 4
+
+STATUS_NO_FACE = 0
+STATUS_EMBEDDING = 1
+STATUS_FACES = 2
+STATUS_FAILED = 3  # the model process died before answering
+
+# Control block at the start of the mapping: the restart and recovered-slot
+# counts (uint32), a state byte per model process and, per slot, the model
+# process embedding it, the pid of the client holding it and whether its
+# request is still queued
+CONTROL_BYTES = 4096
+MAX_PROCESSES = 64
+MAX_SLOTS = 255  # slot numbers go through the free-slot pipe as single bytes
+RESTARTS_OFFSET = 0
+RECOVERED_OFFSET = 4
+STATES_OFFSET = 8
+OWNERS_OFFSET = STATES_OFFSET + MAX_PROCESSES
+HOLDERS_OFFSET = 512
+QUEUED_OFFSET = HOLDERS_OFFSET + MAX_SLOTS * 4
+
+PROCESS_DOWN = 0
+PROCESS_LOADING = 1
+PROCESS_READY = 2
+
+# One request: slot, height, width, channels, max_faces (-1 for a single
+# embedding). Requests are far below PIPE_BUF, so writes never interleave
+REQUEST = struct.Struct('<5i')
+
+RESTART_DELAY = 1.0  # seconds before restarting a process that died loading its models, doubling
+RESTART_DELAY_MAX = 60.0
+
+
+def _slot_offset(slot, slot_bytes):
+    return CONTROL_BYTES + slot * (RESULT_BYTES + slot_bytes)
+
+
+class InferencePool(FaceEngine):
+    """
+    Client side of the pool, shared by the master and every forked worker.
+    Only the process that created it may start or stop it.
+    """
+
+    def __init__(self, engine_name, processes, slots, slot_bytes, threads=0, max_batch=8, timeout=30.0,
+                 startup_timeout=120.0):
+        if engine_name not in ENGINES:
+            raise ValueError(f"Unknown FACE_ENGINE {engine_name!r}, expected one of {sorted(ENGINES)}")
+        if not 0 < processes <= MAX_PROCESSES:
+            raise ValueError(f"FACE_INFERENCE_POOL_PROCESSES must be 1-{MAX_PROCESSES}, got {processes}")
+        if not 0 < slots <= MAX_SLOTS:
+            raise ValueError(f"FACE_INFERENCE_POOL_SLOTS must be 1-{MAX_SLOTS}, got {slots}")
+
+        self.name = engine_name
+        self.model_tag = ENGINES[engine_name].model_tag
+        self.slot_bytes = slot_bytes
+        self.threads = threads
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self._owner = os.getpid()
+
+        size = _slot_offset(slots, slot_bytes)
+        self._file = tempfile.TemporaryFile(dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+        self._file.truncate(size)
+        self._memory = mmap.mmap(self._file.fileno(), size)
+        self._restarts = np.ndarray(1, dtype=np.uint32, buffer=self._memory, offset=RESTARTS_OFFSET)
+        self._recovered = np.ndarray(1, dtype=np.uint32, buffer=self._memory, offset=RECOVERED_OFFSET)
+        self._states = np.ndarray(processes, dtype=np.uint8, buffer=self._memory, offset=STATES_OFFSET)
+        self._owners = np.ndarray(slots, dtype=np.int8, buffer=self._memory, offset=OWNERS_OFFSET)
+        self._owners[:] = -1
+        self._holders = np.ndarray(slots, dtype=np.int32, buffer=self._memory, offset=HOLDERS_OFFSET)
+        self._queued = np.ndarray(slots, dtype=np.uint8, buffer=self._memory, offset=QUEUED_OFFSET)
+
+        # Readers of the free-slot and request pipes race for what is
+        # queued: they wait with select() and read without blocking
+        self._free = os.pipe()
+        os.set_blocking(self._free[0], False)
+        os.write(self._free[1], bytes(range(slots)))
+        self._requests = os.pipe()
+        os.set_blocking(self._requests[0], False)
+        self._done = [os.pipe() for _ in range(slots)]
+        # Held by the master and its workers only: model processes exit when
+        # it reaches end of file, i.e. once every client is gone
+        self._lifeline = os.pipe()
+
+        self._processes = [None] * processes
+        self._monitor = None
+        self._stopping = threading.Event()
+        self._abandoned = []  # slots whose caller timed out, per process
+        self._abandoned_lock = threading.Lock()
+        self._inline = None  # engine for frames the pool cannot take, per process
+        self._inline_lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    # -----------------------------
+    # Lifecycle (creating process only)
+    # -----------------------------
+    def start(self):
+        for number in range(len(self._processes)):
+            self._spawn(number)
+        self._monitor = threading.Thread(target=self._watch, name='face-inference-monitor', daemon=True)
+        self._monitor.start()
+        logger.info(
+            f"Started {len(self._processes)} inference processes ({self.name}) with "
+            f"{len(self._done)} frame slots of {self.slot_bytes // 1024} KiB"
+        )
+
+    def stop(self, timeout=10.0):
+        if os.getpid() != self._owner:
+            return
+        self._stopping.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        running = [process for process in self._processes if process is not None and process.poll() is None]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for process in running:
+            try:
+                process.wait(max(deadline - time.monotonic(), 0.0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        # The mapping cannot close while arrays still point into it
+        self._restarts = self._recovered = self._states = self._owners = self._holders = self._queued = None
+        self._memory.close()
+        self._file.close()
+        for pair in (self._free, self._requests, self._lifeline, *self._done):
+            for fd in pair:
+                os.close(fd)
+        logger.info("Stopped inference processes")
+
+    def _after_fork(self):
+        self._abandoned = []
+        self._abandoned_lock = threading.Lock()
+        self._inline_lock = threading.Lock()
+
+    def _spawn(self, number):
+        """Start model process `number` in a fresh interpreter."""
+        config = {
+            'engine': self.name,
+            'number': number,
+            'threads': self.threads,
+            'max_batch': self.max_batch,
+            'slot_bytes': self.slot_bytes,
+            'slots': len(self._done),
+            'memory': self._file.fileno(),
+            'requests': self._requests[0],
+            'lifeline': self._lifeline[0],
+            'done': [write for _, write in self._done],
+        }
+        env = dict(os.environ)
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'attendease.settings')
+        # The import path of this process, as multiprocessing's spawn passes it
+        env['PYTHONPATH'] = os.pathsep.join(path for path in sys.path if path)
+        if self.threads:
+            # Must be set before NumPy / TensorFlow create their thread pools
+            for variable in ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS'):
+                env[variable] = str(self.threads)
+            env['TF_NUM_INTEROP_THREADS'] = '1'
+
+        self._states[number] = PROCESS_LOADING
+        self._processes[number] = subprocess.Popen(
+            [sys.executable, '-m', __name__, json.dumps(config)],
+            pass_fds=[config['memory'], config['requests'], config['lifeline'], *config['done']],
+            env=env,
+        )
+
+    def _watch(self):
+        """
+        Monitor thread: restart model processes that exit and fail the frames
+        they held, and recover the slots of clients that died.
+        """
+        delays = [RESTART_DELAY] * len(self._processes)
+        restart_at = [None] * len(self._processes)
+        idle = set()  # slots of dead clients found idle on the previous pass
+        while not self._stopping.wait(0.2):
+            self._recover_slots(idle)
+            for number, process in enumerate(self._processes):
+                if restart_at[number] is not None:
+                    if time.monotonic() >= restart_at[number]:
+                        restart_at[number] = None
+                        self._restarts[0] += 1
+                        self._spawn(number)
+                    continue
+                if process.poll() is None:
+                    continue
+
+                loaded = self._states[number] == PROCESS_READY
+                self._states[number] = PROCESS_DOWN
+                failed = self._fail_slots(number)
+                if loaded:
+                    delay, delays[number] = 0.0, RESTART_DELAY
+                else:
+                    delay, delays[number] = delays[number], min(delays[number] * 2, RESTART_DELAY_MAX)
+                logger.error(
+                    f"Inference process {process.pid} exited with code {process.returncode} "
+                    f"{'' if loaded else 'before loading its models '}({failed} frames failed); "
+                    f"restarting in {delay:.0f}s"
+                )
+                restart_at[number] = time.monotonic() + delay
+
+    def _fail_slots(self, number):
+        """Answer the frames model process `number` was embedding with STATUS_FAILED."""
+        slots = np.flatnonzero(self._owners == number)
+        for slot in slots:
+            head = np.ndarray(2, dtype=np.int32, buffer=self._memory, offset=_slot_offset(slot, self.slot_bytes))
+            head[:] = (STATUS_FAILED, 0)
+            del head
+            self._owners[slot] = -1
+            os.write(self._done[slot][1], b'\0')
+        return len(slots)
+
+    def _recover_slots(self, idle):
+        """
+        Return the slots held by clients that no longer exist to the free-slot
+        pipe. A slot whose request is queued or being embedded is left until
+        it is answered; then it must stay idle for a whole monitor pass, so
+        an answer written just as the model process let go of the slot is
+        drained rather than read by the slot's next client.
+
+        Args:
+            idle: Slots found idle on the previous pass; updated in place
+        """
+        recovered = 0
+        for slot in np.flatnonzero(self._holders):
+            if _running(int(self._holders[slot])) or self._owners[slot] != -1 or self._queued[slot]:
+                idle.discard(slot)
+                continue
+            self._wait_done(slot, 0)  # drop a late answer
+            if slot not in idle:
+                idle.add(slot)
+                continue
+            idle.discard(slot)
+            self._release(slot)
+            recovered += 1
+        if recovered:
+            self._recovered[0] += recovered
+            logger.warning(f"Recovered {recovered} inference slots held by clients that exited")
+
+    # -----------------------------
+    # Engine interface
+    # -----------------------------
+    def represent(self, image, model_name="SFace"):
+        return self.represent_batch([image], model_name=model_name)[0]
+
+    def represent_batch(self, images, model_name="SFace", batch_size=32):
+        """
+        Embed images in the model processes. Every frame is queued as soon as
+        it has a slot, so the model processes can batch across callers.
+
+        Raises:
+            TimeoutError: No slot became free or no result came back within
+                FACE_INFERENCE_TIMEOUT seconds
+        """
+        return self._run(images)
+
+    def represent_faces(self, image, model_name="SFace", max_faces=None):
+        """Embed every face of an image in a model process; faces past the slot's result space are left out."""
+        return self._run([image], max_faces=max_faces or RESULT_FLOATS)[0] or []
+
+    def _run(self, images, max_faces=None):
+        """One result per image: an embedding, or with max_faces a list of (box, embedding)."""
+        embeddings = [None] * len(images)
+        if not self.alive_processes():
+            # Nothing would answer until the monitor restarts a process
+            return self._run_inline(images, range(len(images)), max_faces, embeddings)
+
+        self._reclaim()
+        pending = deque()  # (position, slot) in submission order
+        failed = []  # positions whose model process died
+
+        try:
+            for position, image in enumerate(images):
+                frame = self._frame(image)
+                if frame is None:
+                    continue
+                slot = self._acquire(pending, embeddings, failed)
+                offset = _slot_offset(slot, self.slot_bytes) + RESULT_BYTES
+                np.ndarray(frame.shape, dtype=np.uint8, buffer=self._memory, offset=offset)[...] = frame
+                self._queued[slot] = 1
+                os.write(self._requests[1], REQUEST.pack(slot, *frame.shape, -1 if max_faces is None else max_faces))
+                pending.append((position, slot))
+
+            while pending:
+                self._collect(pending, embeddings, failed)
+        finally:
+            # Results that never came back: the slots return once they do
+            if pending:
+                with self._abandoned_lock:
+                    self._abandoned.extend(slot for _, slot in pending)
+        if failed:
+            self._run_inline(images, failed, max_faces, embeddings)
+        return embeddings
+
+    def _run_inline(self, images, positions, max_faces, embeddings):
+        """Embed images[positions] with an engine of this process's own."""
+        with self._inline_lock:
+            if self._inline is None:
+                logger.warning(f"Inference pool could not embed a frame; loading {self.name} in process {os.getpid()}")
+                self._inline = ENGINES[self.name]()
+        positions = list(positions)
+        if max_faces is None:
+            for position, embedding in zip(positions, self._inline.represent_batch([images[p] for p in positions])):
+                embeddings[position] = embedding
+        else:
+            for position in positions:
+                embeddings[position] = self._inline.represent_faces(images[position], max_faces=max_faces)
+        return embeddings
+
+    def warm_up(self):
+        """Wait for every model process to finish loading its models."""
+        deadline = time.monotonic() + self.startup_timeout
+        while self.ready_processes() < len(self._processes):
+            if time.monotonic() > deadline:
+                raise RuntimeError(
+                    f"{self.ready_processes()}/{len(self._processes)} inference processes ready "
+                    f"after {self.startup_timeout:.0f}s"
+                )
+            time.sleep(0.1)
+
+    def ready_processes(self):
+        return int(np.count_nonzero(self._states == PROCESS_READY))
+
+    def alive_processes(self):
+        """Model processes running, ready or still loading their models."""
+        return int(np.count_nonzero(self._states != PROCESS_DOWN))
+
+    def status(self):
+        return {
+            'engine': self.name,
+            'processes': len(self._processes),
+            'alive_processes': self.alive_processes(),
+            'ready_processes': self.ready_processes(),
+            'restarts': int(self._restarts[0]),
+            'recovered_slots': int(self._recovered[0]),
+            'inline_fallback': self._inline is not None,
+        }
+
+    # -----------------------------
+    # Slots
+    # -----------------------------
+    def _frame(self, image):
+        """Contiguous uint8 BGR frame that fits a slot, or None if unreadable."""
+        import cv2
+
+        frame = image if isinstance(image, np.ndarray) else cv2.imread(image, cv2.IMREAD_COLOR)
+        if frame is None:
+            logger.warning(f"Could not read {_describe(image)}")
+            return None
+        if frame.ndim == 2:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        if frame.nbytes > self.slot_bytes:
+            scale = (self.slot_bytes / frame.nbytes) ** 0.5
+            size = (int(frame.shape[1] * scale), int(frame.shape[0] * scale))
+            frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(frame, dtype=np.uint8)
+
+    def _acquire(self, pending, embeddings, failed):
+        """
+        Take a free slot. While waiting, collect this caller's own finished
+        frames so callers holding slots never wait on each other.
+        """
+        deadline = time.monotonic() + self.timeout
+        while True:
+            wait = 0.05 if pending else max(deadline - time.monotonic(), 0.0)
+            if select.select([self._free[0]], [], [], wait)[0]:
+                try:
+                    slot = os.read(self._free[0], 1)[0]
+                except BlockingIOError:
+                    continue  # another client took it first
+                self._holders[slot] = os.getpid()
+                return slot
+            if pending:
+                self._collect(pending, embeddings, failed)
+            elif time.monotonic() >= deadline:
+                raise TimeoutError(f"No free inference slot within {self.timeout:.0f}s")
+
+    def _collect(self, pending, embeddings, failed):
+        position, slot = pending[0]
+        if not self._wait_done(slot, self.timeout):
+            raise TimeoutError(f"No embedding from the inference processes within {self.timeout:.0f}s")
+        pending.popleft()
+        offset = _slot_offset(slot, self.slot_bytes)
+        status, length = np.ndarray(2, dtype=np.int32, buffer=self._memory, offset=offset)
+        values = np.ndarray(length, dtype=np.float32, buffer=self._memory, offset=offset + 8)
+        if status == STATUS_EMBEDDING:
+            embeddings[position] = values.tolist()
+        elif status == STATUS_FACES:
+            rows = values[1:].reshape(-1, int(values[0])) if length else ()
+            embeddings[position] = [(tuple(row[:4].tolist()), row[4:].tolist()) for row in rows]
+        elif status == STATUS_FAILED:
+            failed.append(position)
+        del values
+        self._release(slot)
+
+    def _wait_done(self, slot, timeout):
+        """Wait for the answer in `slot`; False if none came within `timeout` seconds."""
+        done = self._done[slot][0]
+        if not select.select([done], [], [], timeout)[0]:
+            return False
+        os.read(done, 1)
+        return True
+
+    def _reclaim(self):
+        with self._abandoned_lock:
+            waiting = []
+            for slot in self._abandoned:
+                if self._wait_done(slot, 0):
+                    self._release(slot)
+                else:
+                    waiting.append(slot)
+            self._abandoned = waiting
+
+    def _release(self, slot):
+        """Return a slot to the free-slot pipe."""
+        # Cleared first: the slot's next client sets its own pid
+        self._holders[slot] = 0
+        os.write(self._free[1], bytes([slot]))
+
+
+def _running(pid):
+    """Whether process `pid` exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# -----------------------------
+# Model process
+# -----------------------------
+def _serve(config):
+    """Entry point of a model process: load the engine, then embed queued frames."""
+    import django
+    django.setup()
+    if config['threads']:
+        import cv2
+        cv2.setNumThreads(config['threads'])
+
+    engine_name, number, slot_bytes = config['engine'], config['number'], config['slot_bytes']
+    memory = mmap.mmap(config['memory'], 0)
+    states = np.ndarray(number + 1, dtype=np.uint8, buffer=memory, offset=STATES_OFFSET)
+    owners = np.ndarray(config['slots'], dtype=np.int8, buffer=memory, offset=OWNERS_OFFSET)
+    queued = np.ndarray(config['slots'], dtype=np.uint8, buffer=memory, offset=QUEUED_OFFSET)
+    requests, lifeline, done = config['requests'], config['lifeline'], config['done']
+
+    try:
+        engine = ENGINES[engine_name]()
+        engine.warm_up()
+    except Exception as e:
+        logger.error(f"Inference process {os.getpid()} could not load {engine_name}: {str(e)}")
+        sys.exit(1)
+    states[number] = PROCESS_READY
+    logger.info(f"Inference process {os.getpid()} ready ({engine_name})")
+
+    while True:
+        if lifeline in select.select([requests, lifeline], [], [])[0]:
+            logger.info(f"Inference process {os.getpid()} exiting: no clients left")
+            return
+        try:
+            data = os.read(requests, REQUEST.size * config['max_batch'])
+        except BlockingIOError:
+            continue  # another model process took them first
+        batch = [REQUEST.unpack_from(data, offset) for offset in range(0, len(data), REQUEST.size)]
+        for slot, *_ in batch:
+            # Owned before it stops counting as queued, so it is never seen idle in between
+            owners[slot] = number
+            queued[slot] = 0
+
+        frames = [
+            np.ndarray((height, width, channels), dtype=np.uint8, buffer=memory,
+                       offset=_slot_offset(slot, slot_bytes) + RESULT_BYTES)
+            for slot, height, width, channels, _ in batch
+        ]
+        single = [position for position, request in enumerate(batch) if request[4] < 0]
+        results = [None] * len(batch)
+        try:
+            embeddings = engine.represent_batch([frames[position] for position in single], batch_size=len(single))
+        except Exception as e:
+            logger.error(f"Error embedding a batch of {len(single)} frames: {str(e)}")
+            embeddings = [None] * len(single)
+        for position, embedding in zip(single, embeddings):
+            results[position] = embedding
+        for position, (*_, max_faces) in enumerate(batch):
+            if max_faces >= 0:
+                try:
+                    results[position] = engine.represent_faces(frames[position], max_faces=max_faces)
+                except Exception as e:
+                    logger.error(f"Error embedding the faces of {_describe(frames[position])}: {str(e)}")
+        del frames
+
+        for (slot, *_, max_faces), result in zip(batch, results):
+            offset = _slot_offset(slot, slot_bytes)
+            head = np.ndarray(2, dtype=np.int32, buffer=memory, offset=offset)
+            if max_faces >= 0 and result is not None:
+                values = _face_rows(result)
+                np.ndarray(len(values), dtype=np.float32, buffer=memory, offset=offset + 8)[:] = values
+                head[:] = (STATUS_FACES, len(values))
+            elif max_faces < 0 and result is not None and len(result) <= RESULT_FLOATS:
+                np.ndarray(len(result), dtype=np.float32, buffer=memory, offset=offset + 8)[:] = result
+                head[:] = (STATUS_EMBEDDING, len(result))
+            else:
+                head[:] = (STATUS_NO_FACE, 0)
+            del head
+            owners[slot] = -1
+            os.write(done[slot], b'\0')
+
+
+def _face_rows(faces):
+    """STATUS_FACES values for represent_faces() output, as many faces as fit."""
+    if not faces:
+        return np.zeros(0, dtype=np.float32)
+    rows = np.asarray([[*box, *embedding] for box, embedding in faces], dtype=np.float32)
+    fit = (RESULT_FLOATS - 1) // rows.shape[1]
+    if len(rows) > fit:
+        logger.warning(f"Only {fit} of {len(rows)} faces fit in a result slot")
+    return np.concatenate([[rows.shape[1]], rows[:fit].ravel()]).astype(np.float32)
+
+
+# -----------------------------
+# Process-wide pool
+# -----------------------------
+_pool = None
+
+
+def active_pool():
+    """The pool this process started or inherited from the gunicorn master, if any."""
+    return _pool
+
+
+def start_pool():
+    """
+    Start FACE_INFERENCE_POOL_PROCESSES model processes, once, in this
+    process. Call it in the gunicorn master before workers fork.
+
+    Returns:
+        InferencePool or None: None when the pool is disabled
+    """
+    global _pool
+    processes = getattr(settings, 'FACE_INFERENCE_POOL_PROCESSES', 0)
+    if _pool is not None or processes <= 0:
+        return _pool
+    _pool = InferencePool(
+        getattr(settings, 'FACE_ENGINE', 'deepface'),
+        processes,
+        slots=getattr(settings, 'FACE_INFERENCE_POOL_SLOTS', 32),
+        slot_bytes=getattr(settings, 'FACE_INFERENCE_POOL_SLOT_BYTES', 1920 * 1080 * 3),
+        threads=getattr(settings, 'FACE_INFERENCE_POOL_THREADS', 0),
+        max_batch=getattr(settings, 'FACE_INFERENCE_POOL_MAX_BATCH', 8),
+        timeout=getattr(settings, 'FACE_INFERENCE_TIMEOUT', 30.0),
+        startup_timeout=getattr(settings, 'FACE_INFERENCE_POOL_STARTUP_TIMEOUT', 120.0),
+    )
+    _pool.start()
+    return _pool
+
+
+def stop_pool():
+    global _pool
+    if _pool is not None:
+        _pool.stop()
+        _pool = None
+
+
+if __name__ == '__main__':
+    # A model process started by InferencePool._spawn()
+    _serve(json.loads(sys.argv[1]))
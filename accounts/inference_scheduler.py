@@ -0,0 +1,190 @@
+"""
+Micro-batching scheduler for recognition requests.
+
+At shift change dozens of kiosks post frames within the same second. Rather
+than every request thread running its own model invocation, requests hand
+their frame to the scheduler and wait on a Future. One worker thread per
+process gathers queued frames into a batch (at most
+FACE_INFERENCE_MAX_BATCH frames), embeds them with one
+compute_face_embeddings() call, matches all embeddings against the gallery
+with one EmbeddingGallery.match() call and resolves each caller's Future.
+
+A single request at low load is dispatched immediately. The worker only
+holds a batch open for up to FACE_INFERENCE_MAX_WAIT_MS when the previous
+batch had more than one frame, i.e. while a burst is in progress.
+
+Batching needs concurrent requests in one process: threaded gunicorn
+workers (GUNICORN_THREADS, see gunicorn.conf.py) or the ASGI profile. With
+the default sync workers every batch holds one frame.
+"""
+from collections import Counter
+from concurrent.futures import Future
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceScheduler:
+    """Queue of pending frames drained in batches by a background thread."""
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._last_batch_size = 0
+        self._submitted = 0
+        self._completed = 0
+        self._batches = 0
+        self._batch_sizes = Counter()
+        self._queue_seconds = 0.0
+        self._batch_seconds = 0.0
+
+    # -----------------------------
+    # Submitting work
+    # -----------------------------
+    def submit(self, frame, threshold, top_k=1, candidate=None):
+        """
+        Queue one decoded BGR frame for embedding and matching.
+
+        Args:
+            candidate: recognition_cache.CacheEntry of a near-identical face;
+                its match is reused when the frame's embedding confirms it
+
+        Returns:
+            Future: Resolves to (embedding, MatchResult); both are None when
+            no face was found in the frame
+        """
+        self._ensure_worker()
+        future = Future()
+        with self._lock:
+            self._submitted += 1
+        self._queue.put((frame, threshold, top_k, candidate, future, time.monotonic()))
+        return future
+
+    def recognize(self, frame, threshold, top_k=1, timeout=None, candidate=None):
+        """Blocking submit(): returns (embedding, MatchResult) or (None, None)."""
+        if timeout is None:
+            timeout = getattr(settings, 'FACE_INFERENCE_TIMEOUT', 30.0)
+        return self.submit(frame, threshold, top_k, candidate).result(timeout=timeout)
+
+    def _ensure_worker(self):
+        # Threads do not survive fork: a preloaded gunicorn worker starts its own
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='face-inference', daemon=True)
+            self._thread.start()
+
+    # -----------------------------
+    # Worker thread
+    # -----------------------------
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            try:
+                self._process(batch)
+            except Exception as e:
+                logger.error(f"Error running inference batch of {len(batch)}: {str(e)}")
+                for *_, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            finally:
+                from django.db import close_old_connections
+                close_old_connections()
+
+            with self._lock:
+                self._completed += len(batch)
+                self._batches += 1
+                self._batch_sizes[len(batch)] += 1
+                self._batch_seconds += time.monotonic() - started
+                self._queue_seconds += sum(started - queued_at for *_, queued_at in batch)
+            self._last_batch_size = len(batch)
+
+    def _collect(self):
+        """Block for the first frame, then gather more up to the size and wait limits."""
+        max_batch = getattr(settings, 'FACE_INFERENCE_MAX_BATCH', 8)
+        max_wait = getattr(settings, 'FACE_INFERENCE_MAX_WAIT_MS', 5) / 1000.0
+
+        batch = [self._queue.get()]
+        # Only hold the batch open during a burst, so a lone scan never waits
+        deadline = time.monotonic() + (max_wait if self._last_batch_size > 1 else 0.0)
+        while len(batch) < max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _process(self, batch):
+        from .face_gallery import embedding_gallery
+        from .utils import compute_face_embeddings
+
+        from .recognition_cache import recognition_cache
+
+        embeddings = compute_face_embeddings([frame for frame, *_ in batch], model_name="SFace")
+        results = [None] * len(batch)
+        cached = recognition_cache.enabled()
+
+        # One gallery match per (threshold, top_k) group; normally just one.
+        # A confirmed cache candidate, or an embedding close to a recent
+        # decision, reuses that decision instead.
+        groups = {}
+        for position, ((_, threshold, top_k, candidate, _, _), embedding) in enumerate(zip(batch, embeddings)):
+            if embedding is None:
+                continue
+            if candidate is not None and recognition_cache.confirm(candidate, embedding):
+                logger.info("Recognition cache hit: near-identical face confirmed by its embedding")
+                results[position] = candidate.result
+            elif cached:
+                results[position] = recognition_cache.lookup_embedding(embedding, threshold)
+            if results[position] is None:
+                groups.setdefault((threshold, top_k), []).append(position)
+
+        for (threshold, top_k), positions in groups.items():
+            matches = embedding_gallery.match(
+                [embeddings[position] for position in positions], threshold=threshold, top_k=top_k
+            )
+            for position, match in zip(positions, matches):
+                results[position] = match
+
+        for (*_, future, _), embedding, result in zip(batch, embeddings, results):
+            future.set_result((embedding, result))
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+    def stats(self):
+        with self._lock:
+            batches = self._batches
+            return {
+                'queue_depth': self._queue.qsize(),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'batches': batches,
+                'mean_batch_size': self._completed / batches if batches else 0.0,
+                'max_batch_size': max(self._batch_sizes) if self._batch_sizes else 0,
+                'batch_sizes': dict(sorted(self._batch_sizes.items())),
+                'mean_queue_ms': self._queue_seconds / self._completed * 1000 if self._completed else 0.0,
+                'mean_batch_ms': self._batch_seconds / batches * 1000 if batches else 0.0,
+            }
+
+
+# Shared by every request thread of this process
+inference_scheduler = InferenceScheduler()
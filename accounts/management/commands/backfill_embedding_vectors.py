@@ -0,0 +1,70 @@
+"""
+Management command to convert legacy JSON face embeddings to binary vectors.
+Run this once after upgrading to the binary UserFaceEmbedding.vector column.
+Rows that are not converted yet keep working (they are read from JSON).
+
+Usage: python manage.py backfill_embedding_vectors [--batch-size 500]
+"""
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.gallery_snapshot import publish_now
+from accounts.models import UserFaceEmbedding
+
+
+class Command(BaseCommand):
+    help = 'Convert JSON face embeddings to compact binary float32 vectors'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rows converted per transaction',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        pending = UserFaceEmbedding.objects.filter(vector__isnull=True, embedding__isnull=False)
+        total = pending.count()
+        self.stdout.write(self.style.SUCCESS(f'Converting {total} embedding(s)...'))
+
+        converted = 0
+        skipped = 0
+        last_id = 0
+
+        while True:
+            batch = list(pending.filter(id__gt=last_id).order_by('id')[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+
+            updated = []
+            for row in batch:
+                if not row.embedding:
+                    skipped += 1
+                    continue
+                row.set_vector(row.embedding)
+                updated.append(row)
+
+            # bulk_update skips save() and signals: the vectors are unchanged,
+            # so the in-memory gallery does not need to hear about it
+            with transaction.atomic():
+                UserFaceEmbedding.objects.bulk_update(
+                    updated, ['vector', 'norm', 'dimension', 'embedding']
+                )
+
+            converted += len(updated)
+            self.stdout.write(f'  {converted}/{total} converted')
+
+        # Summary
+        self.stdout.write(self.style.SUCCESS(f'\n{"="*60}'))
+        self.stdout.write(self.style.SUCCESS('SUMMARY:'))
+        self.stdout.write(self.style.SUCCESS(f'  Embeddings converted: {converted}'))
+        if skipped > 0:
+            self.stdout.write(self.style.WARNING(f'  Empty embeddings skipped: {skipped}'))
+        self.stdout.write(self.style.SUCCESS(f'{"="*60}'))
+
+        # Same vectors, but a fresh snapshot reads them from the binary column
+        if converted and publish_now():
+            self.stdout.write(self.style.SUCCESS('Gallery snapshot published for the running workers'))
@@ -0,0 +1,84 @@
+"""
+Management command to compare the IVF index against exact matching.
+Builds synthetic galleries shaped like ours (many users, ~25 near-identical
+embeddings each) and reports recall and per-query latency for each nprobe.
+
+Usage: python manage.py benchmark_face_index --users 8000 --per-user 25 --nprobe 4 8 16 32
+"""
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from accounts.face_gallery import normalize_rows, user_segments
+from accounts.face_index import IVFIndex
+from accounts.face_matcher import match_embeddings
+
+
+class Command(BaseCommand):
+    help = 'Benchmark recall and latency of the IVF face index against exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=8000, help='Number of synthetic users')
+        parser.add_argument('--per-user', type=int, default=25, help='Embeddings per user')
+        parser.add_argument('--dim', type=int, default=128, help='Embedding dimensions')
+        parser.add_argument('--queries', type=int, default=200, help='Number of probe queries')
+        parser.add_argument('--noise', type=float, default=0.35, help='Per-embedding noise around each user')
+        parser.add_argument('--lists', type=int, default=None, help='IVF lists (default: sqrt(N))')
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32], help='nprobe values to try')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options['seed'])
+        users, per_user, dim = options['users'], options['per_user'], options['dim']
+        noise = options['noise']
+
+        # Synthetic gallery: one identity vector per user plus noisy captures
+        identities = normalize_rows(rng.normal(size=(users, dim)))
+        matrix = normalize_rows(
+            np.repeat(identities, per_user, axis=0)
+            + rng.normal(scale=noise / np.sqrt(dim), size=(users * per_user, dim))
+        )
+        user_ids = np.repeat(np.arange(1, users + 1), per_user).astype(np.int64)
+        embedding_ids = np.arange(1, len(matrix) + 1, dtype=np.int64)
+        starts = user_segments(user_ids)
+
+        probe_users = rng.choice(users, options['queries'])
+        queries = normalize_rows(
+            identities[probe_users] + rng.normal(scale=noise / np.sqrt(dim), size=(len(probe_users), dim))
+        )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Gallery: {users} users x {per_user} = {len(matrix)} embeddings, {dim}D'
+        ))
+
+        # Exact baseline
+        exact, exact_ms = self._time(
+            lambda q: match_embeddings(q, matrix, user_ids, threshold=1.0, starts=starts)[0], queries
+        )
+        self.stdout.write(f'  Exact:      p50 {np.percentile(exact_ms, 50):7.3f} ms   p95 {np.percentile(exact_ms, 95):7.3f} ms')
+
+        started = time.perf_counter()
+        index = IVFIndex(n_lists=options['lists'])
+        index.build(matrix, user_ids, embedding_ids)
+        build_seconds = time.perf_counter() - started
+        self.stdout.write(f'  IVF build:  {build_seconds:.2f} s ({len(index.lists)} lists)')
+
+        for nprobe in options['nprobe']:
+            approximate, approximate_ms = self._time(
+                lambda q: index.search(q, threshold=1.0, nprobe=nprobe)[0], queries
+            )
+            recall = np.mean([a.user_id == e.user_id for a, e in zip(approximate, exact)])
+            self.stdout.write(
+                f'  IVF nprobe={nprobe:<4} p50 {np.percentile(approximate_ms, 50):7.3f} ms   '
+                f'p95 {np.percentile(approximate_ms, 95):7.3f} ms   recall@1 {recall * 100:6.2f}%'
+            )
+
+    @staticmethod
+    def _time(search, queries):
+        results, elapsed = [], []
+        for query in queries:
+            started = time.perf_counter()
+            results.append(search(query))
+            elapsed.append((time.perf_counter() - started) * 1000)
+        return results, np.asarray(elapsed)
@@ -1,13 +1,17 @@
 """
 Management command to pre-compute face embeddings for existing users.
-Run this after upgrading to the optimized face recognition system.
+Run this after upgrading to the optimized face recognition system, and
+with --stale after changing FACE_ENGINE to re-embed every image whose stored
+embedding came from another engine.
 
-Usage: python manage.py compute_embeddings
+Usage: python manage.py compute_embeddings [--stale] [--engine opencv]
 """
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from accounts.models import CustomUser, UserFaceEmbedding
-from accounts.utils import compute_face_embedding
+from accounts.utils import compute_face_embeddings
+from accounts.face_engine import ENGINES, get_engine
+from accounts.gallery_snapshot import publish_now
 import os
 import logging
 
@@ -28,10 +32,29 @@ class Command(BaseCommand):
             action='store_true',
             help='Re-compute embeddings even if they already exist',
         )
+        parser.add_argument(
+            '--stale',
+            action='store_true',
+            help='Re-compute embeddings that were made by a different engine',
+        )
+        parser.add_argument(
+            '--engine',
+            choices=sorted(ENGINES),
+            help='Engine to use instead of FACE_ENGINE',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Faces per recognition forward pass (default: FACE_EMBEDDING_BATCH_SIZE)',
+        )
 
     def handle(self, *args, **options):
         username = options.get('user')
         force = options.get('force', False)
+        stale = options.get('stale', False)
+        engine_name = options.get('engine')
+        model_tag = get_engine(engine_name).model_tag
         
         # Get users to process
         if username:
@@ -43,7 +66,7 @@ class Command(BaseCommand):
             users = CustomUser.objects.filter(has_face_data=True)
         
         total_users = users.count()
-        self.stdout.write(self.style.SUCCESS(f'Processing {total_users} user(s)...'))
+        self.stdout.write(self.style.SUCCESS(f'Processing {total_users} user(s) with {model_tag}...'))
         
         face_db = os.path.join(settings.MEDIA_ROOT, "faces")
         total_embeddings = 0
@@ -64,31 +87,44 @@ class Command(BaseCommand):
             
             self.stdout.write(f'  Found {len(image_files)} image(s)')
             
+            existing_rows = {
+                row.image_path: row
+                for row in UserFaceEmbedding.objects.filter(user=user).only('id', 'image_path', 'model_name')
+            }
+            pending = []
             for img_file in image_files:
-                img_path = os.path.join(user_folder, img_file)
                 relative_path = os.path.join("faces", user.username, img_file)
                 
                 # Check if embedding already exists
-                if not force and UserFaceEmbedding.objects.filter(user=user, image_path=relative_path).exists():
+                existing = existing_rows.get(relative_path)
+                if existing and not force and not (stale and existing.model_name != model_tag):
                     skipped_embeddings += 1
                     self.stdout.write(f'    ⏭️  Skipping {img_file} (already exists)')
                     continue
-                
-                # Compute embedding
-                self.stdout.write(f'    🔄 Computing embedding for {img_file}...')
-                embedding = compute_face_embedding(img_path, model_name="SFace")
-                
+                pending.append((img_file, relative_path, existing))
+            
+            if not pending:
+                continue
+            
+            # Compute all of this user's embeddings in batches
+            self.stdout.write(f'    🔄 Computing {len(pending)} embedding(s)...')
+            embeddings = compute_face_embeddings(
+                [os.path.join(user_folder, img_file) for img_file, _, _ in pending],
+                model_name="SFace", engine=engine_name, batch_size=options.get('batch_size'),
+            )
+            
+            for (img_file, relative_path, existing), embedding in zip(pending, embeddings):
                 if embedding:
-                    # Delete old embedding if force mode
-                    if force:
-                        UserFaceEmbedding.objects.filter(user=user, image_path=relative_path).delete()
+                    # Delete old embedding if re-computing
+                    if existing:
+                        existing.delete()
                     
                     # Save new embedding
                     UserFaceEmbedding.objects.create(
                         user=user,
                         image_path=relative_path,
                         embedding=embedding,
-                        model_name="SFace"
+                        model_name=model_tag
                     )
                     total_embeddings += 1
                     self.stdout.write(self.style.SUCCESS(f'    ✅ Saved embedding for {img_file}'))
@@ -108,6 +144,8 @@ class Command(BaseCommand):
         self.stdout.write(self.style.SUCCESS(f'{"="*60}'))
         
         if total_embeddings > 0:
+            if publish_now():
+                self.stdout.write(self.style.SUCCESS('   Gallery snapshot published for the running workers'))
             self.stdout.write(self.style.SUCCESS('\n✅ Face recognition system is now optimized for fast attendance marking!'))
             self.stdout.write(self.style.SUCCESS('   Recognition speed: < 1 second for 50 users'))
         else:
@@ -0,0 +1,164 @@
+"""
+Management command to check faster matching modes against exact matching
+on the embeddings actually stored in the database.
+
+Every sampled embedding is used as a probe with its own row left out of the
+gallery (leave-one-out), so it has to be recognised from the user's other
+captures, just like a live scan. For each centroid prefilter depth the
+command reports how often the match decision (matched user, or no match at
+the threshold) differs from exact matching, and the per-query latency. For
+each reduced gallery precision it reports the largest distance error and
+the decision changes with and without the float32 re-rank.
+
+Usage: python manage.py evaluate_face_matching --prefilter-users 25 50 100 --precision float16 int8
+"""
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.face_gallery import EmbeddingGallery, normalize_rows
+from accounts.face_matcher import match_embeddings
+from accounts.face_quantization import quantize_rows, quantized_similarities
+
+
+class Command(BaseCommand):
+    help = 'Compare prefiltered and quantized matching against exact matching on stored embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prefilter-users', type=int, nargs='+', default=[25, 50, 100],
+            help='Prefilter depths to evaluate'
+        )
+        parser.add_argument(
+            '--precision', nargs='+', choices=['float16', 'int8'], default=['float16', 'int8'],
+            help='Reduced gallery precisions to evaluate'
+        )
+        parser.add_argument(
+            '--rerank-users', type=int, default=getattr(settings, 'FACE_MATCH_RERANK_USERS', 10),
+            help='Users re-scored in float32 after a quantized scan'
+        )
+        parser.add_argument('--sample', type=int, default=2000, help='Number of probe embeddings')
+        parser.add_argument(
+            '--threshold', type=float, default=getattr(settings, 'FACE_MATCH_THRESHOLD', 0.30),
+            help='Maximum cosine distance for a match'
+        )
+        parser.add_argument('--batch-size', type=int, default=256)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        gallery = EmbeddingGallery()
+        gallery.load()
+        matrix = np.asarray(gallery.matrix)
+        user_ids, starts = gallery.user_ids, gallery.starts
+        threshold = options['threshold']
+
+        if len(starts) < 2:
+            self.stdout.write(self.style.WARNING('Need embeddings of at least two users to evaluate matching'))
+            return
+
+        rng = np.random.default_rng(options['seed'])
+        probes = np.sort(rng.choice(len(matrix), min(options['sample'], len(matrix)), replace=False))
+        segment_of_row = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(matrix)]))
+        segment_users = user_ids[starts]
+        sums = np.add.reduceat(matrix, starts, axis=0)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Gallery: {len(starts)} users, {len(matrix)} embeddings; '
+            f'{len(probes)} leave-one-out probes at threshold {threshold}'
+        ))
+
+        depths = [depth for depth in options['prefilter_users'] if 0 < depth < len(starts)]
+        flips = {depth: 0 for depth in depths}
+        exact_matches = 0
+
+        rerank = min(max(options['rerank_users'], 1), len(starts))
+        quantized = {precision: quantize_rows(matrix, precision) for precision in options['precision']}
+        errors = {precision: 0.0 for precision in quantized}
+        quantized_flips = {precision: [0, 0] for precision in quantized}  # [no re-rank, re-ranked]
+
+        for first in range(0, len(probes), options['batch_size']):
+            rows = probes[first:first + options['batch_size']]
+            own = segment_of_row[rows]
+            queries = matrix[rows]
+
+            # Exact per-user best similarity with each probe's own row removed
+            similarities = queries @ matrix.T
+            similarities[np.arange(len(rows)), rows] = -np.inf
+            user_similarities = np.maximum.reduceat(similarities, starts, axis=1)
+            exact = self._decisions(user_similarities, segment_users, threshold)
+            exact_matches += int((exact != 0).sum())
+
+            # Centroid ranking, with the probe also taken out of its own centroid
+            centroid_similarities = queries @ normalize_rows(sums).T
+            own_centroids = normalize_rows(sums[own] - queries)
+            centroid_similarities[np.arange(len(rows)), own] = np.einsum('ij,ij->i', queries, own_centroids)
+
+            for depth in depths:
+                flips[depth] += int((self._decisions(
+                    self._shortlisted(user_similarities, centroid_similarities, depth),
+                    segment_users, threshold,
+                ) != exact).sum())
+
+            for precision, (codes, scales) in quantized.items():
+                approximate = quantized_similarities(queries, codes, scales)
+                approximate[np.arange(len(rows)), rows] = -np.inf
+                approximate_users = np.maximum.reduceat(approximate, starts, axis=1)
+                finite = np.isfinite(user_similarities)
+                errors[precision] = max(
+                    errors[precision],
+                    float(np.abs(approximate_users[finite] - user_similarities[finite]).max()),
+                )
+                quantized_flips[precision][0] += int(
+                    (self._decisions(approximate_users, segment_users, threshold) != exact).sum()
+                )
+                quantized_flips[precision][1] += int((self._decisions(
+                    self._shortlisted(user_similarities, approximate_users, rerank),
+                    segment_users, threshold,
+                ) != exact).sum())
+
+        self.stdout.write(f'  Exact matches: {exact_matches}/{len(probes)}')
+        exact_ms = self._time(matrix, user_ids, starts, gallery.centroids, probes, 0, threshold)
+        self.stdout.write(f'  Exact:               p50 {np.percentile(exact_ms, 50):7.3f} ms')
+        for depth in depths:
+            elapsed = self._time(matrix, user_ids, starts, gallery.centroids, probes, depth, threshold)
+            self.stdout.write(
+                f'  Prefilter {depth:<5} users p50 {np.percentile(elapsed, 50):7.3f} ms   '
+                f'decision changes {flips[depth]}/{len(probes)} ({flips[depth] / len(probes) * 100:.3f}%)'
+            )
+
+        for precision, (codes, scales) in quantized.items():
+            plain, reranked = quantized_flips[precision]
+            self.stdout.write(
+                f'  {precision:<7} {codes.nbytes / max(matrix.nbytes, 1) * 100:3.0f}% of float32 size   '
+                f'max distance error {errors[precision]:.5f}   '
+                f'decision changes {plain}/{len(probes)}, {reranked}/{len(probes)} with {rerank}-user re-rank'
+            )
+
+    @staticmethod
+    def _shortlisted(user_similarities, scores, depth):
+        """Exact user similarities, kept only for each probe's `depth` best users by `scores`."""
+        shortlist = np.argpartition(-scores, depth - 1, axis=1)[:, :depth]
+        masked = np.full_like(user_similarities, -np.inf)
+        np.put_along_axis(masked, shortlist, np.take_along_axis(user_similarities, shortlist, axis=1), axis=1)
+        return masked
+
+    @staticmethod
+    def _decisions(user_similarities, segment_users, threshold):
+        """Matched user id per probe, or 0 when the best distance exceeds the threshold."""
+        best = np.argmax(user_similarities, axis=1)
+        best_similarity = user_similarities[np.arange(len(best)), best]
+        return np.where(1.0 - best_similarity <= threshold, segment_users[best], 0)
+
+    @staticmethod
+    def _time(matrix, user_ids, starts, centroids, probes, depth, threshold):
+        elapsed = []
+        for row in probes[:200]:
+            started = time.perf_counter()
+            match_embeddings(
+                matrix[row], matrix, user_ids, threshold=threshold, starts=starts,
+                centroids=centroids, prefilter_users=depth,
+            )
+            elapsed.append((time.perf_counter() - started) * 1000)
+        return np.asarray(elapsed)
@@ -62,7 +62,7 @@ class Command(BaseCommand):
                 user.email = email
                 user.first_name = name.split()[0] if ' ' in name else name
                 user.last_name = ' '.join(name.split()[1:]) if ' ' in name else ''
-                user.save()
+                user.save(update_fields=['username', 'email', 'first_name', 'last_name'])
                 
                 self.stdout.write(self.style.WARNING(f'  Updated: {name} ({email})'))
                 updated_count += 1
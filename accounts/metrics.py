@@ -0,0 +1,197 @@
+"""
+Stage timing for the recognition and registration views.
+
+Views decorated with @timed collect how long each stage of the request
+takes: code inside the request wraps its work in `with stage('embed'):`
+and the durations end up
+
+- in a Server-Timing response header (visible in the browser's network
+  panel), one entry per stage plus the total;
+- in this process's registry: a Prometheus histogram per (view, stage)
+  and a rolling window of the last FACE_METRICS_WINDOW samples for the
+  p50/p95/p99 gauges, rendered by the metrics/ endpoint.
+
+Stages run in other threads (the async views' inference pool,
+sync_to_async) are still attributed to the request, because the request's
+timings travel in a context variable. Outside a timed request, or with
+FACE_METRICS_ENABLED off, stage() is a context-variable lookup returning a
+shared no-op context manager.
+
+Like the other stats endpoints, each gunicorn worker reports its own
+numbers; scrape every worker, or aggregate the histograms.
+"""
+import asyncio
+from collections import deque
+from contextlib import nullcontext
+import contextvars
+from functools import wraps
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# [(stage, seconds)] of the request being handled, None outside a timed request
+_timings = contextvars.ContextVar('face_stage_timings', default=None)
+_NOOP = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('name', 'timings', 'started')
+
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings.append((self.name, time.perf_counter() - self.started))
+        return False
+
+
+def stage(name):
+    """Context manager timing one stage of the current request."""
+    timings = _timings.get()
+    if timings is None:
+        return _NOOP
+    return _Stage(name, timings)
+
+
+def enabled():
+    return getattr(settings, 'FACE_METRICS_ENABLED', True)
+
+
+# -----------------------------
+# Registry
+# -----------------------------
+class StageStats:
+    """Histogram buckets, sum and count since start, plus a rolling window of samples."""
+
+    def __init__(self, window):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.samples.append(seconds)
+        for position, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[position] += 1
+                break
+
+    def quantiles(self):
+        samples = sorted(self.samples)
+        if not samples:
+            return {quantile: 0.0 for quantile in QUANTILES}
+        return {
+            quantile: samples[min(int(quantile * len(samples)), len(samples) - 1)]
+            for quantile in QUANTILES
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}  # (view, stage) -> StageStats
+
+    def observe(self, view, stage_name, seconds):
+        with self._lock:
+            stats = self._stages.get((view, stage_name))
+            if stats is None:
+                stats = self._stages[(view, stage_name)] = StageStats(getattr(settings, 'FACE_METRICS_WINDOW', 1024))
+            stats.observe(seconds)
+
+    def snapshot(self):
+        """{(view, stage): (bucket counts, count, sum, quantiles)}"""
+        with self._lock:
+            return {
+                key: (list(stats.buckets), stats.count, stats.sum, stats.quantiles())
+                for key, stats in sorted(self._stages.items())
+            }
+
+    def render_prometheus(self):
+        """The registry in the Prometheus text exposition format (0.0.4)."""
+        snapshot = self.snapshot()
+        lines = [
+            '# HELP attendease_stage_duration_seconds Time spent in each stage of the face recognition and registration views.',
+            '# TYPE attendease_stage_duration_seconds histogram',
+        ]
+        for (view, stage_name), (buckets, count, total, _) in snapshot.items():
+            labels = f'view="{view}",stage="{stage_name}"'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, buckets):
+                cumulative += bucket
+                lines.append(f'attendease_stage_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'attendease_stage_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'attendease_stage_duration_seconds_sum{{{labels}}} {total:.6f}')
+            lines.append(f'attendease_stage_duration_seconds_count{{{labels}}} {count}')
+
+        lines += [
+            '# HELP attendease_stage_duration_quantile_seconds Stage duration percentiles over the most recent requests.',
+            '# TYPE attendease_stage_duration_quantile_seconds gauge',
+        ]
+        for (view, stage_name), (_, _, _, quantiles) in snapshot.items():
+            for quantile, seconds in quantiles.items():
+                lines.append(
+                    f'attendease_stage_duration_quantile_seconds{{view="{view}",stage="{stage_name}",quantile="{quantile}"}} {seconds:.6f}'
+                )
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+# -----------------------------
+# View decorator
+# -----------------------------
+def _finish(view_name, timings, total, response):
+    durations = {}
+    for name, seconds in timings:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    for name, seconds in durations.items():
+        registry.observe(view_name, name, seconds)
+    response['Server-Timing'] = ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in durations.items())
+
+
+def timed(view):
+    """Time the stages of a sync or async view (see the module docstring)."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not enabled():
+                return await view(request, *args, **kwargs)
+            timings = []
+            token = _timings.set(timings)
+            started = time.perf_counter()
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                _timings.reset(token)
+            _finish(view.__name__, timings, time.perf_counter() - started, response)
+            return response
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not enabled():
+            return view(request, *args, **kwargs)
+        timings = []
+        token = _timings.set(timings)
+        started = time.perf_counter()
+        try:
+            response = view(request, *args, **kwargs)
+        finally:
+            _timings.reset(token)
+        _finish(view.__name__, timings, time.perf_counter() - started, response)
+        return response
+    return wrapper
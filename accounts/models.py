@@ -1,3 +1,4 @@
+import numpy as np
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.conf import settings  
@@ -174,10 +175,19 @@ class UserFaceEmbedding(models.Model):
     Store pre-computed face embeddings for fast recognition.
     Each face image gets a 512D vector computed by SFace model.
     This eliminates the need to run DeepFace.verify() on every attendance scan.
+    
+    Vectors are stored as raw float32 bytes in `vector` (with their norm and
+    dimension) so they load with np.frombuffer instead of a JSON parse.
+    Rows created before that still only have the legacy JSON `embedding`;
+    get_vector() reads either until `manage.py backfill_embedding_vectors`
+    has converted them.
     """
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='face_embeddings')
     image_path = models.CharField(max_length=500, help_text="Relative path to the face image")
-    embedding = models.JSONField(help_text="512D face embedding vector as JSON array")
+    embedding = models.JSONField(null=True, blank=True, help_text="Legacy 512D face embedding vector as JSON array")
+    vector = models.BinaryField(null=True, blank=True, help_text="Face embedding vector as raw float32 bytes")
+    norm = models.FloatField(null=True, blank=True, help_text="L2 norm of the embedding vector")
+    dimension = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Number of values in the embedding vector")
     model_name = models.CharField(max_length=50, default="SFace", help_text="DeepFace model used")
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -189,4 +199,26 @@ class UserFaceEmbedding(models.Model):
         ]
     
     def __str__(self):
-        return f"{self.user.username} - Embedding {self.id}"
\ No newline at end of file
+        return f"{self.user.username} - Embedding {self.id}"
+    
+    def set_vector(self, embedding):
+        """Store an embedding in the binary columns and drop the legacy JSON copy."""
+        values = np.asarray(embedding, dtype=np.float32)
+        self.vector = values.tobytes()
+        self.norm = float(np.linalg.norm(values))
+        self.dimension = values.size
+        self.embedding = None
+    
+    def get_vector(self):
+        """Return the embedding as a float32 array (None if the row has none)."""
+        if self.vector is not None:
+            return np.frombuffer(self.vector, dtype=np.float32)
+        if self.embedding:
+            return np.asarray(self.embedding, dtype=np.float32)
+        return None
+    
+    def save(self, *args, **kwargs):
+        # create(embedding=[...]) keeps working: new rows are written in binary form
+        if self.vector is None and self.embedding:
+            self.set_vector(self.embedding)
+        super().save(*args, **kwargs)
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""
+Recognition pipeline shared by the scanner endpoints: decoded frame in,
+embedding and gallery match out.
+
+Clients that already know where the face is (the scanner runs face-api.js)
+may send its box. The frame is then decoded at a reduced resolution where
+the face stays large enough, and only a padded crop around the box reaches
+the detector and the recognition model.
+
+Group scans (recognize_faces) embed every face in the frame instead of the
+most prominent one and match them all in one gallery search. Streams
+(recognize_tracked) skip the embedding for faces a tracker already knows.
+"""
+from collections import namedtuple
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from .face_gallery import embedding_gallery
+from .utils import compute_face_embedding, compute_frame_embeddings, match_top_k, report_match
+
+logger = logging.getLogger(__name__)
+
+NO_MATCH = (None, None, None)
+
+# One face of a group scan; user_id, distance and confidence are None without a match
+FaceMatch = namedtuple('FaceMatch', 'box embedding user_id distance confidence')
+
+# JPEG decode reductions cv2.imdecode can apply while decoding
+DECODE_FACTORS = (8, 4, 2)
+
+
+def parse_face_box(value):
+    """
+    Parse a client-supplied face box in full-frame pixels: a dict with
+    x, y, width and height, or an "x,y,width,height" string.
+    
+    Returns:
+        tuple: (x, y, width, height) floats, or None if no box was given
+    
+    Raises:
+        ValueError: The box is malformed or empty
+    """
+    if value in (None, ''):
+        return None
+    if isinstance(value, dict):
+        parts = [value.get(key) for key in ('x', 'y', 'width', 'height')]
+    else:
+        parts = str(value).split(',')
+    if len(parts) != 4 or any(part is None for part in parts):
+        raise ValueError(f"face box must be x,y,width,height, got {value!r}")
+    x, y, width, height = (float(part) for part in parts)
+    if width <= 0 or height <= 0:
+        raise ValueError(f"face box has no area: {value!r}")
+    return x, y, width, height
+
+
+def roi_decode_factor(box):
+    """
+    Largest JPEG decode reduction that keeps the boxed face at least
+    FACE_ROI_MIN_FACE_SIZE pixels on its shorter side (1 without a box).
+    """
+    if box is None:
+        return 1
+    min_face = getattr(settings, 'FACE_ROI_MIN_FACE_SIZE', 100)
+    for factor in DECODE_FACTORS:
+        if min(box[2], box[3]) / factor >= min_face:
+            return factor
+    return 1
+
+
+def decode_flags(factor):
+    """cv2.imdecode flags for a roi_decode_factor()."""
+    import cv2
+
+    return {
+        1: cv2.IMREAD_COLOR,
+        2: cv2.IMREAD_REDUCED_COLOR_2,
+        4: cv2.IMREAD_REDUCED_COLOR_4,
+        8: cv2.IMREAD_REDUCED_COLOR_8,
+    }[factor]
+
+
+def crop_face_roi(frame, box, factor=1):
+    """
+    Crop the face box, padded by FACE_ROI_PADDING of its size on every side
+    so the detector still sees the whole head, from a frame decoded at
+    1/factor resolution.
+    
+    Returns:
+        ndarray: The padded crop, or the whole frame if the box misses it
+    """
+    padding = getattr(settings, 'FACE_ROI_PADDING', 0.4)
+    x, y, width, height = (value / factor for value in box)
+    frame_height, frame_width = frame.shape[:2]
+    left = max(int(x - width * padding), 0)
+    top = max(int(y - height * padding), 0)
+    right = min(int(x + width * (1 + padding)), frame_width)
+    bottom = min(int(y + height * (1 + padding)), frame_height)
+    if right <= left or bottom <= top:
+        logger.warning(f"Face box {box} is outside the {frame_width}x{frame_height} frame, using the whole frame")
+        return frame
+    return np.ascontiguousarray(frame[top:bottom, left:right])
+
+
+def recognize_frame(frame, threshold, check_quality=True, client=None, face_box=None):
+    """
+    Embed the face in a decoded BGR frame and match it against the gallery.
+
+    Frames that fail the quality gate (face_quality.py) never reach the
+    model. Repeated, near-identical frames are answered from the recognition cache
+    (recognition_cache.py). With FACE_INFERENCE_BATCHING on, the frame goes
+    through the process's micro-batching scheduler (inference_scheduler.py)
+    so concurrent scans share model invocations; otherwise it is embedded
+    and matched inline.
+
+    Args:
+        client: Key of the scanner the frame comes from; the cache's frame
+            lookups only reuse that scanner's decisions
+        face_box: The face in frame pixels as found by the quality gate,
+            when the caller ran it (check_quality=False); the cache hashes
+            this crop
+
+    Returns:
+        tuple: (embedding, (user_id, distance, confidence)); embedding is
+        None when no face was found, and the match part is (None, None, None)
+        when there is no match
+
+    Raises:
+        FrameQualityError: The frame is too dark, blurred, or its face too
+            small or turned away (unless check_quality is False because
+            the caller ran the gate already)
+    """
+    from . import face_quality
+    from .metrics import stage
+    from .recognition_cache import face_hash, recognition_cache
+
+    if check_quality and face_quality.enabled():
+        with stage('quality'):
+            face_box = face_quality.check_frame(frame).box
+
+    cache = recognition_cache if recognition_cache.enabled() else None
+    hash_value = candidate = None
+    if cache is not None and face_box is not None:
+        with stage('cache'):
+            hash_value = face_hash(frame, face_box)
+            candidate = cache.lookup_frame(hash_value, threshold, client) if hash_value is not None else None
+        if candidate is not None:
+            decision = _unpack(candidate.result, threshold)
+            if candidate.embedding is None or decision[0] is None:
+                logger.info("Recognition cache hit: reusing the no-match decision of a near-identical face")
+                return candidate.embedding, decision
+
+    if getattr(settings, 'FACE_INFERENCE_BATCHING', True):
+        from .inference_scheduler import inference_scheduler
+
+        # Queueing, detection, embedding, confirming a cache candidate and
+        # matching happen in the scheduler's batch
+        with stage('inference'):
+            embedding, result = inference_scheduler.recognize(
+                frame, threshold, top_k=match_top_k(), candidate=candidate
+            )
+    else:
+        with stage('embed'):
+            embedding = compute_face_embedding(frame, model_name="SFace")
+        result = None
+        if embedding is not None and candidate is not None and cache.confirm(candidate, embedding):
+            # The same face as the cached match: skip the gallery search
+            logger.info("Recognition cache hit: near-identical face confirmed by its embedding")
+            result = candidate.result
+        elif embedding is not None and cache is not None:
+            with stage('cache'):
+                result = cache.lookup_embedding(embedding, threshold)
+        if embedding is not None and result is None:
+            with stage('gallery'):
+                embedding_gallery.ensure_loaded()
+            # Match against the in-memory gallery (loaded once per process, kept current by signals)
+            with stage('match'):
+                result = embedding_gallery.match(embedding, threshold=threshold, top_k=match_top_k())[0]
+
+    if cache is not None:
+        cache.store(hash_value, embedding, threshold, result, client)
+    if embedding is None:
+        return None, NO_MATCH
+    return embedding, _unpack(result, threshold)
+
+
+def recognize_tracked(frame, threshold, tracker, box=None, roi=None):
+    """
+    recognize_frame() for one frame of a camera stream: the face is assigned
+    to a track of `tracker` (face_tracker.py), and frames of a track that is
+    already identified reuse its match instead of being embedded.
+
+    Tracks follow boxes in full-frame coordinates only. A scanner that
+    uploads a crop of its video sends the crop's place in the frame as
+    `roi`, and the quality gate's box is moved back into the frame with it;
+    boxes measured inside a crop are otherwise about the same for everyone
+    in front of the camera, so frames without full-frame coordinates are
+    embedded as usual and never tracked.
+
+    Args:
+        box: The client's face box for this frame, in full-frame pixels
+        roi: (x, y, width, height) of the uploaded crop in the client's
+            video frame, if the frame is a crop
+
+    Returns:
+        tuple: (query_embedding, match, reused) where the first two are as
+        recognize_frame(); reused is True for a skipped frame, whose
+        embedding is the one its track was last verified with
+
+    Raises:
+        FrameQualityError: As recognize_frame()
+    """
+    from . import face_quality
+
+    from .metrics import stage
+
+    report = None
+    if face_quality.enabled():
+        with stage('quality'):
+            report = face_quality.check_frame(frame)
+    face_box = report.box if report is not None else None
+    if box is None and face_box is not None and roi is not None:
+        box = _frame_box(face_box, roi, frame.shape)
+    if box is None:
+        embedding, match = recognize_frame(frame, threshold, check_quality=False, client=tracker.name, face_box=face_box)
+        return embedding, match, False
+
+    track = tracker.update(box)
+    reused = tracker.reusable_match(track)
+    if reused is not None:
+        embedding, match = reused
+        logger.info(f"Track {track.id}: reusing the match of user_id={match[0]} without embedding")
+        return embedding, match, True
+
+    embedding, match = recognize_frame(frame, threshold, check_quality=False, client=tracker.name, face_box=face_box)
+    if embedding is not None:
+        tracker.record(track, embedding, match)
+    return embedding, match, False
+
+
+def _frame_box(box, roi, shape):
+    """Move a box found in an uploaded crop back into the client's video frame."""
+    scale_x = roi[2] / shape[1]
+    scale_y = roi[3] / shape[0]
+    return (
+        roi[0] + box[0] * scale_x,
+        roi[1] + box[1] * scale_y,
+        box[2] * scale_x,
+        box[3] * scale_y,
+    )
+
+
+def _unpack(result, threshold):
+    """Log a MatchResult and turn it into (user_id, distance, confidence)."""
+    if result is None:
+        return NO_MATCH
+    _, user_ids, starts = embedding_gallery.arrays()
+    return report_match(result, threshold, user_ids, starts)
+
+
+def recognize_faces(frame, threshold):
+    """
+    Embed every face in a decoded BGR frame (at most FACE_MULTI_FACE_MAX_FACES,
+    largest first) and match them against the gallery in one batched search.
+
+    The recognition cache and the micro-batching scheduler are not used:
+    they hold single-face decisions, and the faces of one frame are a batch
+    already. When two faces match the same user only the closer one keeps
+    the match.
+
+    Returns:
+        list: One FaceMatch per detected face, empty when none was found
+    """
+    from .metrics import stage
+
+    with stage('embed'):
+        faces = compute_frame_embeddings(
+            frame, model_name="SFace", max_faces=getattr(settings, 'FACE_MULTI_FACE_MAX_FACES', 10)
+        )
+    if not faces:
+        return []
+
+    queries = np.asarray([embedding for _, embedding in faces], dtype=np.float32)
+    with stage('gallery'):
+        embedding_gallery.ensure_loaded()
+    with stage('match'):
+        results = embedding_gallery.match(queries, threshold=threshold, top_k=match_top_k())
+    _, user_ids, starts = embedding_gallery.arrays()
+    matches = [
+        FaceMatch(box, embedding, *report_match(result, threshold, user_ids, starts))
+        for (box, embedding), result in zip(faces, results)
+    ]
+
+    closest = {}
+    for position, match in enumerate(matches):
+        if match.user_id is not None:
+            best = closest.get(match.user_id)
+            if best is None or match.distance < matches[best].distance:
+                closest[match.user_id] = position
+    for position, match in enumerate(matches):
+        if match.user_id is not None and closest[match.user_id] != position:
+            logger.warning(f"Two faces matched user_id={match.user_id}, keeping the closer one")
+            matches[position] = FaceMatch(match.box, match.embedding, *NO_MATCH)
+    return matches
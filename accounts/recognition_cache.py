@@ -0,0 +1,224 @@
+"""
+Short-lived cache of recognition decisions.
+
+Users double-tap the check-in button and kiosks resubmit nearly identical
+frames within seconds; each resubmission used to run detection, embedding
+and matching again. recognize_frame() consults two lookups first:
+
+- by frame: a difference hash (dHash) of the face crop found by the quality
+  gate (face_quality.py), so a static kiosk background does not dominate
+  it. Frame entries only answer the scanner (client) that stored them. A
+  crop within FACE_CACHE_HASH_DISTANCE bits of a recent one is a candidate:
+  "no face" and "not recognized" decisions are reused as they are, but a
+  match is only reused once the new frame's embedding is confirmed within
+  FACE_CACHE_EMBEDDING_DISTANCE of the cached one, so a different person in
+  a similar frame is never marked as the previous one. Without a detected
+  face box (quality gate off, no detector) frames are not hashed;
+- by embedding: a frame that missed is embedded as usual, and an embedding
+  within FACE_CACHE_EMBEDDING_DISTANCE (cosine) of a recent one reuses that
+  match instead of searching the gallery.
+
+Entries live FACE_CACHE_TTL seconds (a hit does not extend them), at most
+FACE_CACHE_MAX_ENTRIES are kept with the least recently used evicted first,
+and everything is dropped when the gallery changes. Each process has its
+own cache; stats() feeds the api/stats/recognition-cache/ endpoint.
+"""
+from collections import Counter, OrderedDict, namedtuple
+import logging
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# dHash grid: HASH_SIZE x HASH_SIZE brightness gradients, i.e. a 256-bit hash
+HASH_SIZE = 16
+
+CacheEntry = namedtuple('CacheEntry', 'frame_hash client embedding unit threshold result expires')
+
+
+def face_hash(frame, box):
+    """
+    Difference hash of the face crop of a frame.
+
+    Args:
+        box: (x, y, width, height) of the face in frame pixels
+
+    Returns:
+        int or None: None when the box leaves too little of the frame to hash
+    """
+    x, y, width, height = (int(round(value)) for value in box)
+    crop = frame[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)]
+    if crop.shape[0] < HASH_SIZE or crop.shape[1] < HASH_SIZE:
+        return None
+    return frame_hash(crop)
+
+
+def frame_hash(frame):
+    """Difference hash of a BGR (or grayscale) frame as a Python int."""
+    import cv2
+
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (HASH_SIZE + 1, HASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+class RecognitionCache:
+    """TTL + LRU cache of (embedding, MatchResult) decisions."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # insertion number -> CacheEntry, least recently used first
+        self._next_key = 0
+        self._generation = None
+        self._counters = Counter()
+
+    @staticmethod
+    def enabled():
+        return getattr(settings, 'FACE_CACHE_TTL', 3.0) > 0
+
+    # -----------------------------
+    # Lookups
+    # -----------------------------
+    def lookup_frame(self, hash_value, threshold, client):
+        """
+        Returns:
+            CacheEntry or None: A recent decision of the same client for a
+            near-identical face crop; a match still needs confirm()
+        """
+        max_distance = getattr(settings, 'FACE_CACHE_HASH_DISTANCE', 8)
+        with self._lock:
+            self._prune()
+            for key in reversed(self._entries):
+                entry = self._entries[key]
+                if (
+                    entry.frame_hash is not None
+                    and entry.client == client
+                    and entry.threshold == threshold
+                    and (entry.frame_hash ^ hash_value).bit_count() <= max_distance
+                ):
+                    self._entries.move_to_end(key)
+                    self._counters['frame_hits'] += 1
+                    return entry
+            self._counters['frame_misses'] += 1
+            return None
+
+    def confirm(self, entry, embedding):
+        """Whether a frame hit's embedding agrees with the new frame's, so its match can be reused."""
+        max_distance = getattr(settings, 'FACE_CACHE_EMBEDDING_DISTANCE', 0.05)
+        confirmed = (
+            entry.unit is not None
+            and len(entry.unit) == len(embedding)
+            and 1.0 - float(entry.unit @ _unit(embedding)) <= max_distance
+        )
+        with self._lock:
+            self._counters['frame_confirmations' if confirmed else 'frame_rejections'] += 1
+        return confirmed
+
+    def lookup_embedding(self, embedding, threshold):
+        """
+        Returns:
+            MatchResult or None: The match of a recent, nearly identical embedding
+        """
+        max_distance = getattr(settings, 'FACE_CACHE_EMBEDDING_DISTANCE', 0.05)
+        unit = _unit(embedding)
+        with self._lock:
+            self._prune()
+            keys = [
+                key for key, entry in self._entries.items()
+                if entry.unit is not None and entry.threshold == threshold and len(entry.unit) == len(unit)
+            ]
+            if keys:
+                similarities = np.stack([self._entries[key].unit for key in keys]) @ unit
+                best = int(np.argmax(similarities))
+                if 1.0 - similarities[best] <= max_distance:
+                    self._entries.move_to_end(keys[best])
+                    self._counters['embedding_hits'] += 1
+                    return self._entries[keys[best]].result
+            self._counters['embedding_misses'] += 1
+            return None
+
+    # -----------------------------
+    # Updates
+    # -----------------------------
+    def store(self, hash_value, embedding, threshold, result, client=None):
+        """Remember a decision; embedding and result are None when no face was found."""
+        entry = CacheEntry(
+            hash_value,
+            client,
+            embedding,
+            _unit(embedding) if embedding is not None else None,
+            threshold,
+            result,
+            time.monotonic() + getattr(settings, 'FACE_CACHE_TTL', 3.0),
+        )
+        with self._lock:
+            self._prune()
+            self._entries[self._next_key] = entry
+            self._next_key += 1
+            max_entries = getattr(settings, 'FACE_CACHE_MAX_ENTRIES', 64)
+            while len(self._entries) > max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _prune(self):
+        """Drop expired entries, and everything once the gallery has changed."""
+        from .face_gallery import embedding_gallery
+
+        if embedding_gallery.generation != self._generation:
+            if self._entries:
+                self._counters['invalidations'] += 1
+            self._entries.clear()
+            self._generation = embedding_gallery.generation
+            return
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            del self._entries[key]
+            self._counters['expirations'] += 1
+
+    # -----------------------------
+    # Stats
+    # -----------------------------
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        frame_lookups = counters.get('frame_hits', 0) + counters.get('frame_misses', 0)
+        embedding_lookups = counters.get('embedding_hits', 0) + counters.get('embedding_misses', 0)
+        return {
+            'size': size,
+            'ttl_seconds': getattr(settings, 'FACE_CACHE_TTL', 3.0),
+            'max_entries': getattr(settings, 'FACE_CACHE_MAX_ENTRIES', 64),
+            'frame_hits': counters.get('frame_hits', 0),
+            'frame_misses': counters.get('frame_misses', 0),
+            'frame_confirmations': counters.get('frame_confirmations', 0),
+            'frame_rejections': counters.get('frame_rejections', 0),
+            'embedding_hits': counters.get('embedding_hits', 0),
+            'embedding_misses': counters.get('embedding_misses', 0),
+            # Each tier over its own lookups; frame hits include the
+            # candidates later rejected by their embedding
+            'frame_hit_rate': counters.get('frame_hits', 0) / frame_lookups if frame_lookups else 0.0,
+            'embedding_hit_rate': (
+                counters.get('embedding_hits', 0) / embedding_lookups if embedding_lookups else 0.0
+            ),
+            'expirations': counters.get('expirations', 0),
+            'evictions': counters.get('evictions', 0),
+            'invalidations': counters.get('invalidations', 0),
+        }
+
+
+def _unit(embedding):
+    values = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(values)
+    return values / norm if norm else values
+
+
+# Shared by every request thread of this process
+recognition_cache = RecognitionCache()
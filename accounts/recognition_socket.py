@@ -0,0 +1,226 @@
+"""
+Streaming recognition channel for kiosks: a raw ASGI WebSocket app, routed
+by attendease/asgi.py at /ws/recognize/.
+
+A scanner connects once and pushes JPEG frames as binary messages instead
+of opening an HTTP request per scan. Each connection keeps only its newest
+frame: a frame that arrives while the previous one is still being
+recognized replaces any frame waiting behind it, so a client that sends
+faster than inference keeps up gets answers for fresh frames rather than a
+growing backlog.
+
+Protocol:
+- connect with optional ?action=check_in|check_out&face_box=x,y,w,h
+  &roi=x,y,w,h&multi_face=1;
+- text message: JSON {"action": ..., "face_box": ..., "roi": ...,
+  "multi_face": ...} changes the settings for the frames that follow;
+  face_box is the face in the frame as sent, roi the place of a cropped
+  frame in the client's video (both in video pixels);
+- binary message: a JPEG frame;
+- every processed frame is answered with a text message: JSON
+  {"type": "result", "frame": n, "dropped": k, ...}, where the remaining
+  keys are the api/recognize/frame/ response (a group scan response with
+  multi_face), n counts the frames received
+  on this connection and k is the number of stale frames skipped since the
+  previous result. Invalid settings are answered with {"type": "error"}.
+
+Recognition and marking go through async_views.recognize_and_mark(), so the
+inference pool limits and the responses are those of the async endpoints.
+With FACE_TRACKING each connection has a face_tracker.FaceTracker, so frames
+of a face that is already identified are not embedded again. Tracking needs
+full-frame coordinates, a face_box or the roi of a cropped frame; a frame
+answered from its track is reported with "tracked" and marks nothing.
+"""
+import asyncio
+from contextlib import suppress
+from functools import partial
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .async_views import BUSY_ERROR, InferenceBusy, recognize_and_mark, recognize_and_mark_faces
+from . import face_tracker
+from .recognition import parse_face_box
+from . import simple_views
+
+logger = logging.getLogger(__name__)
+
+# Close codes (RFC 6455)
+CLOSE_POLICY_VIOLATION = 1008
+CLOSE_MESSAGE_TOO_BIG = 1009
+
+
+class RecognitionSocket:
+    """One scanner connection: a receive loop and a worker for the newest frame."""
+
+    def __init__(self, scope, receive, send):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.action = 'check_in'
+        self.face_box = None
+        self.roi = None
+        self.multi_face = False
+        self._frame = None  # (number, bytes, action, face_box, roi, multi_face) waiting for the worker
+        self._ready = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._received = 0
+        self._processed = 0
+        self._dropped = 0
+        self._dropped_total = 0
+        client = scope.get('client') or ('?', 0)
+        self.name = f"socket {client[0]}:{client[1]}"  # also scopes the recognition cache
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        try:
+            self._configure(
+                action=query.get('action', [self.action])[0],
+                face_box=query.get('face_box', [None])[0],
+                roi=query.get('roi', [None])[0],
+                multi_face=simple_views.multi_face_flag(query.get('multi_face', [''])[0]),
+            )
+        except ValueError as e:
+            logger.warning(f"Rejected recognition socket: {str(e)}")
+            await self.send({'type': 'websocket.close', 'code': CLOSE_POLICY_VIOLATION})
+            return
+
+        await self.send({'type': 'websocket.accept'})
+        client = self.scope.get('client') or ('?', 0)
+        logger.info(f"Recognition socket opened from {client[0]}")
+        tracker = face_tracker.FaceTracker(self.name) if face_tracker.enabled() else None
+
+        worker = asyncio.create_task(self._process_frames(tracker))
+        try:
+            await self._receive_frames()
+        finally:
+            worker.cancel()
+            # OSError: the client went away while a result was being sent
+            with suppress(asyncio.CancelledError, OSError):
+                await worker
+            if tracker is not None:
+                tracker.close()
+            logger.info(
+                f"Recognition socket from {client[0]} closed: {self._received} frames received, "
+                f"{self._processed} processed, {self._dropped_total} dropped as stale"
+            )
+
+    # -----------------------------
+    # Receiving
+    # -----------------------------
+    async def _receive_frames(self):
+        max_bytes = getattr(settings, 'FACE_SOCKET_MAX_FRAME_BYTES', 2 * 1024 * 1024)
+        while True:
+            message = await self.receive()
+            if message['type'] == 'websocket.disconnect':
+                return
+            if message['type'] != 'websocket.receive':
+                continue
+
+            if message.get('bytes') is not None:
+                if len(message['bytes']) > max_bytes:
+                    logger.warning(f"Closing recognition socket: {len(message['bytes'])} byte frame exceeds {max_bytes}")
+                    await self._close(CLOSE_MESSAGE_TOO_BIG)
+                    return
+                self._push(message['bytes'])
+            elif message.get('text') is not None:
+                try:
+                    data = json.loads(message['text'])
+                    if not isinstance(data, dict):
+                        raise ValueError('Settings must be a JSON object')
+                    self._configure(
+                        data.get('action', self.action),
+                        data.get('face_box', self.face_box),
+                        data.get('roi', self.roi),
+                        simple_views.multi_face_flag(data.get('multi_face', self.multi_face)),
+                    )
+                except ValueError as e:
+                    await self._send_json({'type': 'error', 'error': str(e)})
+
+    def _configure(self, action, face_box, roi, multi_face):
+        """
+        Raises:
+            ValueError: With the error message for the client
+        """
+        if action not in ('check_in', 'check_out'):
+            raise ValueError(f'Invalid action: {action}')
+        if not isinstance(face_box, tuple):
+            try:
+                face_box = parse_face_box(face_box)
+            except ValueError as e:
+                raise ValueError(f'Invalid face box: {str(e)}')
+        if not isinstance(roi, tuple):
+            try:
+                roi = parse_face_box(roi)
+            except ValueError as e:
+                raise ValueError(f'Invalid roi: {str(e)}')
+        self.action = action
+        self.face_box = face_box
+        self.roi = roi
+        self.multi_face = multi_face
+
+    def _push(self, data):
+        """Make a frame the newest one, dropping the frame still waiting, if any."""
+        self._received += 1
+        if self._frame is not None:
+            self._dropped += 1
+            self._dropped_total += 1
+        self._frame = (self._received, data, self.action, self.face_box, self.roi, self.multi_face)
+        self._ready.set()
+
+    # -----------------------------
+    # Processing
+    # -----------------------------
+    async def _process_frames(self, tracker):
+        from django.db import close_old_connections
+
+        while True:
+            await self._ready.wait()
+            self._ready.clear()
+            number, data, action, face_box, roi, multi_face = self._frame
+            self._frame = None
+
+            try:
+                if multi_face:
+                    decode = partial(simple_views.decode_image_bytes, data)
+                    payload = await recognize_and_mark_faces(decode, action)
+                else:
+                    decode = partial(simple_views.decode_face_frame, simple_views.decode_image_bytes, data, face_box)
+                    payload = await recognize_and_mark(decode, action, tracker, face_box, self.name, roi)
+            except InferenceBusy:
+                payload = {'success': False, 'error': BUSY_ERROR}
+            except Exception as e:
+                logger.error(f"Error in face recognition: {str(e)}")
+                import traceback
+                logger.error(traceback.format_exc())
+                payload = {'success': False, 'error': f'Recognition error: {str(e)}'}
+            finally:
+                # There is no request/response cycle to close connections for us
+                await sync_to_async(close_old_connections)()
+
+            self._processed += 1
+            dropped, self._dropped = self._dropped, 0
+            await self._send_json({'type': 'result', 'frame': number, 'dropped': dropped, **payload})
+
+    # -----------------------------
+    # Sending
+    # -----------------------------
+    async def _send_json(self, data):
+        async with self._send_lock:
+            await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def _close(self, code):
+        async with self._send_lock:
+            await self.send({'type': 'websocket.close', 'code': code})
+
+
+async def recognition_socket(scope, receive, send):
+    """ASGI application for /ws/recognize/."""
+    await RecognitionSocket(scope, receive, send).run()
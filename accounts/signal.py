@@ -14,4 +14,92 @@ def send_approval_email(sender, instance, created, **kwargs):
             "tushyparmar@gmail.com.com",
             [instance.email],
             fail_silently=True,
-        )
\ No newline at end of file
+        )
+
+
+# -----------------------------
+# Keep the in-memory embedding gallery current
+# -----------------------------
+from django.db import transaction
+from django.db.models.signals import post_delete
+from .face_gallery import embedding_gallery
+from .gallery_snapshot import snapshot_publisher, snapshots_enabled
+from .models import UserFaceEmbedding
+
+
+def _apply_to_gallery(update):
+    """
+    Run a gallery update once the transaction commits. With snapshots on, the
+    gallery is mapped first (cheap) so the update is seen even by a worker
+    that has not served a scan yet, and a changed gallery is republished for
+    the other workers.
+    """
+    def apply():
+        if not snapshots_enabled():
+            update()
+            return
+        embedding_gallery.ensure_loaded()
+        if update():
+            snapshot_publisher.schedule()
+
+    transaction.on_commit(apply)
+
+
+def _drop_from_gallery(remove):
+    """
+    Run a gallery update that only removes rows once the transaction commits.
+    Unlike _apply_to_gallery it does not load or map the gallery first: a
+    gallery this process has not loaded holds nothing to drop. With
+    snapshots on, other workers get a new snapshot, rebuilt only if the
+    current one no longer matches the database when nothing was dropped here.
+    """
+    def apply():
+        removed = remove()
+        if snapshots_enabled():
+            snapshot_publisher.schedule(if_stale=not removed)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_save, sender=UserFaceEmbedding)
+def add_embedding_to_gallery(sender, instance, **kwargs):
+    if not embedding_gallery.is_user_eligible(instance.user):
+        return
+    embedding_id, user_id, embedding = instance.id, instance.user_id, instance.get_vector()
+    if not embedding_gallery.is_embedding_current(instance):
+        # Re-tagged by another engine: its vector is not comparable any more
+        _drop_from_gallery(lambda: embedding_gallery.remove_embedding(embedding_id))
+        return
+    if embedding is None:
+        return
+    _apply_to_gallery(lambda: embedding_gallery.add_embedding(embedding_id, user_id, embedding))
+
+
+@receiver(post_delete, sender=UserFaceEmbedding)
+def remove_embedding_from_gallery(sender, instance, **kwargs):
+    # Deletion clears instance.id before the commit callback runs
+    embedding_id = instance.id
+    _drop_from_gallery(lambda: embedding_gallery.remove_embedding(embedding_id))
+
+
+# The CustomUser fields that decide whether a user is in the gallery
+GALLERY_USER_FIELDS = frozenset({'has_face_data', 'api_user_id'})
+
+
+@receiver(post_save, sender=CustomUser)
+def sync_user_in_gallery(sender, instance, created, update_fields=None, **kwargs):
+    # A new user has no embeddings yet, and a save naming its fields (last_login
+    # on every login, sync_users) matters only if it names an eligibility field
+    if created or (update_fields is not None and GALLERY_USER_FIELDS.isdisjoint(update_fields)):
+        return
+    user_id = instance.id
+    if embedding_gallery.is_user_eligible(instance):
+        _apply_to_gallery(lambda: embedding_gallery.sync_user(user_id, True))
+    else:
+        _drop_from_gallery(lambda: embedding_gallery.remove_user(user_id))
+
+
+@receiver(post_delete, sender=CustomUser)
+def remove_user_from_gallery(sender, instance, **kwargs):
+    user_id = instance.id
+    _drop_from_gallery(lambda: embedding_gallery.remove_user(user_id))
@@ -5,18 +5,33 @@ No login required - direct face registration and attendance marking
 import os
 import cv2
 import base64
+import hmac
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from django.shortcuts import render, redirect
+from django.urls import reverse
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from deepface import DeepFace
-from datetime import datetime, timedelta
+from datetime import datetime
+from functools import wraps
 import logging
 
-from .models import CustomUser, Attendance, UserFaceEmbedding
+from .models import CustomUser, UserFaceEmbedding
 from .api_service import check_in_user, check_out_user
-from .utils import compute_face_embedding, find_best_match
+from .attendance_service import (
+    attendance_date_for, mark_check_in, mark_check_ins, mark_check_out, mark_check_outs,
+    release_check_in, release_check_out, summary_refresher
+)
+from .utils import compute_face_embeddings
+from .recognition import (
+    crop_face_roi, decode_flags, parse_face_box, recognize_faces, recognize_frame, recognize_tracked,
+    roi_decode_factor
+)
+from .face_engine import get_engine
+from .face_quality import FrameQualityError
+from .metrics import stage, timed
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +40,7 @@ FACE_DB = os.path.join(settings.MEDIA_ROOT, "faces")
 os.makedirs(FACE_DB, exist_ok=True)
 
 
-def decode_base64_image(base64_string):
+def decode_base64_image(base64_string, flags=cv2.IMREAD_COLOR):
     """Decode base64 image string to OpenCV format"""
     try:
         if ',' in base64_string:
@@ -33,13 +48,38 @@ def decode_base64_image(base64_string):
         
         img_data = base64.b64decode(base64_string)
         nparr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        img = cv2.imdecode(nparr, flags)
         return img
     except Exception as e:
         logger.error(f"Error decoding base64 image: {str(e)}")
         return None
 
 
+def decode_image_bytes(buffer, flags=cv2.IMREAD_COLOR):
+    """Decode encoded image bytes (JPEG/PNG) to OpenCV format without copying them"""
+    try:
+        nparr = np.frombuffer(buffer, np.uint8)
+        return cv2.imdecode(nparr, flags)
+    except Exception as e:
+        logger.error(f"Error decoding image bytes: {str(e)}")
+        return None
+
+
+def decode_face_frame(decode, source, face_box):
+    """
+    Decode a scanner frame with `decode` (decode_base64_image or
+    decode_image_bytes). With a face box the frame is decoded at reduced
+    resolution and cropped to the padded box.
+    """
+    factor = roi_decode_factor(face_box)
+    img = decode(source, flags=decode_flags(factor))
+    if img is None or face_box is None:
+        return img
+    roi = crop_face_roi(img, face_box, factor)
+    logger.info(f"Face ROI: decoded at 1/{factor}, {img.shape[1]}x{img.shape[0]} -> {roi.shape[1]}x{roi.shape[0]}")
+    return roi
+
+
 def home(request):
     """Main landing page with options"""
     return render(request, 'simple_home.html')
@@ -87,6 +127,7 @@ def register_face(request, user_id):
         'current_count': current_count,
         'required_count': 25,
         'has_existing_face': has_existing_face,
+        'save_face_url': reverse('save_face_image_async' if getattr(settings, 'FACE_ASYNC_ENDPOINTS', False) else 'save_face_image'),
         'title': f'Register Face for {user.username}'
     }
     return render(request, 'register_face.html', context)
@@ -132,47 +173,83 @@ def delete_face_data(request, user_id):
 
 
 @csrf_exempt
+@timed
 def save_face_image(request):
     """
-    Save captured face image for a user and compute embedding
+    Save captured face images for a user and compute their embeddings.
+    Accepts one frame as 'image' or several as 'images'; a batch is embedded
+    in one compute_face_embeddings() call.
     """
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
     
     try:
         import json
-        from .models import UserFaceEmbedding
         
         data = json.loads(request.body)
         user_id = data.get('user_id')
-        image_data = data.get('image')
+        images_data = data.get('images') or ([data['image']] if data.get('image') else [])
         
-        if not user_id or not image_data:
+        if not user_id or not images_data:
             return JsonResponse({'success': False, 'error': 'Missing user_id or image data'})
         
         # Get user
         user = CustomUser.objects.get(id=user_id)
         
-        # Decode image
-        img = decode_base64_image(image_data)
-        if img is None:
+        # Decode images
+        with stage('decode'):
+            images = [decode_base64_image(image_data) for image_data in images_data]
+            images = [img for img in images if img is not None]
+        if not images:
             return JsonResponse({'success': False, 'error': 'Failed to decode image'})
         
-        # Create user folder
-        user_folder = os.path.join(FACE_DB, user.username)
-        os.makedirs(user_folder, exist_ok=True)
-        
-        # Count existing images
-        img_count = len(os.listdir(user_folder))
-        
-        # Save image
-        img_filename = f"{user.username}_{img_count + 1}.jpg"
-        img_path = os.path.join(user_folder, img_filename)
-        cv2.imwrite(img_path, img)
-        
-        # Compute face embedding for fast recognition
-        embedding = compute_face_embedding(img_path, model_name="SFace")
+        saved = save_face_frames(user, images)
+        with stage('db'):
+            stored = store_face_embeddings(user, *saved)
+        return JsonResponse(stored)
         
+    except CustomUser.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'User not found'})
+    except Exception as e:
+        logger.error(f"Error saving face image: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+def save_face_frames(user, images):
+    """
+    Embed decoded face frames and write them to the user's folder.
+    
+    Returns:
+        tuple: (existing image count, saved filenames, embeddings, model tag)
+    """
+    # Compute face embeddings for fast recognition (from the decoded
+    # frames, not by reading the JPEGs back). First, so an engine error
+    # leaves no images behind
+    with stage('embed'):
+        embeddings = compute_face_embeddings(images, model_name="SFace")
+    
+    # Create user folder
+    user_folder = os.path.join(FACE_DB, user.username)
+    os.makedirs(user_folder, exist_ok=True)
+    
+    # Count existing images
+    img_count = len(os.listdir(user_folder))
+    
+    # Save images
+    img_filenames = []
+    with stage('write'):
+        for offset, img in enumerate(images, 1):
+            img_filename = f"{user.username}_{img_count + offset}.jpg"
+            cv2.imwrite(os.path.join(user_folder, img_filename), img)
+            img_filenames.append(img_filename)
+    return img_count, img_filenames, embeddings, get_engine().model_tag
+
+
+def store_face_embeddings(user, img_count, img_filenames, embeddings, model_tag):
+    """Store the embeddings of saved frames and update the user's face count"""
+    from .models import UserFaceEmbedding
+    
+    for img_filename, embedding in zip(img_filenames, embeddings):
         if embedding:
             # Store embedding in database
             # Use relative path for portability
@@ -182,32 +259,28 @@ def save_face_image(request):
                 user=user,
                 image_path=relative_path,
                 embedding=embedding,
-                model_name="SFace"
+                model_name=model_tag
             )
             logger.info(f"Saved embedding for {img_filename}")
         else:
             logger.warning(f"Could not compute embedding for {img_filename}, but image saved")
-        
-        # Update user face count
-        user.face_images_count = img_count + 1
-        if not user.has_face_data:
-            user.has_face_data = True
-        user.save()
-        
-        logger.info(f"Saved face image {img_count + 1} for user {user.get_display_name()}")
-        
-        return JsonResponse({
-            'success': True,
-            'message': f'Image {img_count + 1} saved successfully',
-            'count': img_count + 1,
-            'has_embedding': embedding is not None
-        })
-        
-    except CustomUser.DoesNotExist:
-        return JsonResponse({'success': False, 'error': 'User not found'})
-    except Exception as e:
-        logger.error(f"Error saving face image: {str(e)}")
-        return JsonResponse({'success': False, 'error': str(e)})
+    
+    # Update user face count
+    new_count = img_count + len(img_filenames)
+    user.face_images_count = new_count
+    if not user.has_face_data:
+        user.has_face_data = True
+    user.save()
+    
+    logger.info(f"Saved face images {img_count + 1}-{new_count} for user {user.get_display_name()}")
+    
+    return {
+        'success': True,
+        'message': f'Image {new_count} saved successfully',
+        'count': new_count,
+        'has_embedding': all(embedding is not None for embedding in embeddings),
+        'embedded': sum(embedding is not None for embedding in embeddings),
+    }
 
 
 def attendance_scanner(request):
@@ -215,17 +288,25 @@ def attendance_scanner(request):
     Main attendance scanner interface - no login required
     """
     context = {
+        'recognize_url': reverse('recognize_frame_upload_async' if getattr(settings, 'FACE_ASYNC_ENDPOINTS', False) else 'recognize_frame_upload'),
+        # Streaming socket, only served by the ASGI application
+        'recognize_socket_path': '/ws/recognize/' if getattr(settings, 'FACE_ASYNC_ENDPOINTS', False) else '',
         'title': 'Face Attendance Scanner'
     }
     return render(request, 'attendance_scanner.html', context)
 
 
 @csrf_exempt
+@timed
 def recognize_and_mark_attendance(request):
     """
     Recognize face and mark attendance using fast embedding comparison.
     OPTIMIZED: Uses pre-computed embeddings instead of DeepFace.verify()
     Speed: < 1 second for 50 users (vs 60-120 seconds with old method)
+    
+    With 'multi_face': true every face in the frame is recognized and
+    marked (group check-in, see _recognize_and_mark_faces); 'face_box' is
+    ignored then.
     """
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
@@ -239,171 +320,317 @@ def recognize_and_mark_attendance(request):
         if not image_data:
             return JsonResponse({'success': False, 'error': 'No image data provided'})
         
+        if multi_face_flag(data.get('multi_face')):
+            with stage('decode'):
+                img = decode_base64_image(image_data)
+            if img is None:
+                return JsonResponse({'success': False, 'error': 'Failed to decode image'})
+            return _recognize_and_mark_faces(img, action)
+        
+        try:
+            face_box = parse_face_box(data.get('face_box'))
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': f'Invalid face box: {str(e)}'})
+        
         # Decode image
-        img = decode_base64_image(image_data)
+        with stage('decode'):
+            img = decode_face_frame(decode_base64_image, image_data, face_box)
         if img is None:
             return JsonResponse({'success': False, 'error': 'Failed to decode image'})
         
-        # Save temporary image
-        temp_image = os.path.join(settings.MEDIA_ROOT, "temp_scan.jpg")
-        cv2.imwrite(temp_image, img)
-        
-        # Compute embedding for the captured face
-        logger.info("Computing embedding for captured face...")
-        query_embedding = compute_face_embedding(temp_image, model_name="SFace")
+        return _recognize_and_mark(img, action, scan_client(request))
         
-        if query_embedding is None:
-            # Clean up temp file
-            if os.path.exists(temp_image):
-                os.remove(temp_image)
-            return JsonResponse({
-                'success': False,
-                'error': 'Could not detect face in the image. Please try again with better lighting.'
-            })
-        
-        # Load all user embeddings from database (FAST: just database queries)
-        logger.info("Loading user embeddings from database...")
-        user_embeddings = {}
-        
-        # Only get users with face data
-        users_with_faces = CustomUser.objects.filter(has_face_data=True, api_user_id__isnull=False)
-        
-        for user in users_with_faces:
-            # Get all embeddings for this user
-            embeddings = UserFaceEmbedding.objects.filter(user=user).values_list('embedding', flat=True)
-            if embeddings:
-                user_embeddings[user.id] = list(embeddings)
+    except Exception as e:
+        logger.error(f"Error in face recognition: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return JsonResponse({
+            'success': False,
+            'error': f'Recognition error: {str(e)}'
+        })
+
+
+def frame_upload_params(request):
+    """
+    Action and face box of a binary frame upload.
+    
+    Raises:
+        ValueError: With the error message for the client
+    """
+    action = request.headers.get('X-Attendance-Action') or request.GET.get('action', 'check_in')
+    if action not in ('check_in', 'check_out'):
+        raise ValueError(f'Invalid action: {action}')
+    try:
+        face_box = parse_face_box(request.headers.get('X-Face-Box') or request.GET.get('face_box'))
+    except ValueError as e:
+        raise ValueError(f'Invalid face box: {str(e)}')
+    return action, face_box
+
+
+def multi_face_flag(value):
+    """Whether a request flag ('multi_face', X-Multi-Face) asks for a group scan"""
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def frame_upload_multi_face(request):
+    return multi_face_flag(request.headers.get('X-Multi-Face') or request.GET.get('multi_face'))
+
+
+def has_frame_upload(request):
+    if request.content_type == 'multipart/form-data':
+        return request.FILES.get('image') is not None
+    return bool(request.body)
+
+
+def decode_frame_upload(request, face_box):
+    """Decode the uploaded frame: the request body or the multipart 'image' file"""
+    if request.content_type != 'multipart/form-data':
+        return decode_face_frame(decode_image_bytes, request.body, face_box)
+    
+    upload = request.FILES['image']
+    # Small uploads are held in a BytesIO: decode from its buffer
+    if hasattr(upload.file, 'getbuffer'):
+        with upload.file.getbuffer() as buffer:
+            return decode_face_frame(decode_image_bytes, buffer, face_box) if len(buffer) else None
+    buffer = upload.read()
+    return decode_face_frame(decode_image_bytes, buffer, face_box) if buffer else None
+
+
+@csrf_exempt
+@timed
+def recognize_frame_upload(request):
+    """
+    Binary variant of recognize_and_mark_attendance used by the scanner.
+    
+    The frame is the raw JPEG: either the whole body
+    (Content-Type: application/octet-stream or image/jpeg) or the 'image'
+    file of a multipart form. The action comes from the X-Attendance-Action
+    header or the ?action= query parameter. This skips the base64 data URL
+    (a third more bytes per frame) and the JSON and base64 decoding copies.
+    
+    An optional face box ("x,y,width,height" in frame pixels) in the
+    X-Face-Box header or ?face_box= limits decoding and detection to the
+    face (see recognition.py); the JSON endpoint takes it as 'face_box'.
+    
+    X-Multi-Face: 1 (or ?multi_face=1) recognizes and marks every face in
+    the frame instead, ignoring the face box.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Invalid request method'})
+    
+    try:
+        try:
+            action, face_box = frame_upload_params(request)
+        except ValueError as e:
+            return JsonResponse({'success': False, 'error': str(e)})
         
-        logger.info(f"Loaded embeddings for {len(user_embeddings)} users")
+        if not has_frame_upload(request):
+            return JsonResponse({'success': False, 'error': 'No image data provided'})
         
-        # Find best match using cosine similarity (VERY FAST: vector math)
-        DISTANCE_THRESHOLD = 0.30  # Maximum cosine distance allowed (lower = stricter, 0.30 = ~70% confidence minimum)
+        multi_face = frame_upload_multi_face(request)
+        with stage('decode'):
+            img = decode_frame_upload(request, None if multi_face else face_box)
+        if img is None:
+            return JsonResponse({'success': False, 'error': 'Failed to decode image'})
         
-        logger.info("\n" + "#"*80)
-        logger.info(f"# FACE RECOGNITION REQUEST - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        logger.info(f"# Action: {action.upper()}")
-        logger.info("#"*80)
+        if multi_face:
+            return _recognize_and_mark_faces(img, action)
+        return _recognize_and_mark(img, action, scan_client(request))
         
-        user_id, distance, confidence = find_best_match(
-            query_embedding, 
-            user_embeddings, 
-            threshold=DISTANCE_THRESHOLD
+    except Exception as e:
+        logger.error(f"Error in face recognition: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return JsonResponse({
+            'success': False,
+            'error': f'Recognition error: {str(e)}'
+        })
+
+
+NO_FACE_ERROR = 'Could not detect face in the image. Please try again with better lighting.'
+NOT_RECOGNIZED_ERROR = 'Face not recognized. Please register first or try again with better lighting.'
+
+
+def scan_client(request):
+    """
+    Key of the scanner a request comes from, which scopes the recognition
+    cache's frame lookups: the scanner page's X-Scanner-Id (one per page
+    load) and the client address.
+    """
+    return f"{request.META.get('REMOTE_ADDR', '')}/{request.headers.get('X-Scanner-Id', '')}"
+
+
+def match_scan(img, action, tracker=None, face_box=None, client=None, roi=None):
+    """
+    Log the request banner and recognize the face in a decoded frame.
+    Streams pass their face_tracker.FaceTracker (with the client's face box,
+    or the place of an uploaded crop in the video as roi) so frames of an
+    identified face skip the embedding; requests pass their scan_client().
+    
+    Returns:
+        tuple: (query_embedding, user_id, distance, confidence, tracked);
+        tracked is True when the match was reused from a track without
+        embedding the frame, and such a match must not mark attendance
+    """
+    DISTANCE_THRESHOLD = getattr(settings, 'FACE_MATCH_THRESHOLD', 0.30)  # Maximum cosine distance allowed (lower = stricter)
+    
+    logger.info("\n" + "#"*80)
+    logger.info(f"# FACE RECOGNITION REQUEST - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"# Action: {action.upper()}")
+    logger.info("#"*80)
+    
+    # Embed the captured face straight from memory and match it
+    tracked = False
+    if tracker is not None:
+        query_embedding, (user_id, distance, confidence), tracked = recognize_tracked(
+            img, DISTANCE_THRESHOLD, tracker, face_box, roi
         )
+    else:
+        query_embedding, (user_id, distance, confidence) = recognize_frame(img, DISTANCE_THRESHOLD, client=client)
+    
+    if query_embedding is not None and user_id is None:
+        logger.warning("RECOGNITION FAILED - No matching face found above threshold")
+        logger.info("#"*80 + "\n")
+    return query_embedding, user_id, distance, confidence, tracked
+
+
+def quality_payload(error):
+    """Response for a frame rejected by the quality gate: the retry hint and the measurements"""
+    report = error.report
+    return {
+        'success': False,
+        'error': error.hint,
+        'quality': {
+            'reason': error.reason,
+            'brightness': round(report.brightness, 1),
+            'sharpness': round(report.sharpness, 1),
+            'face_size': None if report.face_size is None else round(report.face_size),
+        },
+    }
+
+
+def log_recognized(recognized_user, distance, confidence):
+    logger.info(f"\n>>> FINAL RESULT: Successfully recognized {recognized_user.get_display_name()} ({recognized_user.username})")
+    logger.info(f">>> Confidence: {confidence:.2f}% | Distance: {distance:.4f} | Threshold: {getattr(settings, 'FACE_MATCH_THRESHOLD', 0.30)}")
+
+
+def unapplied_payload(recognized_user, action, write):
+    """Response for a mark that did not apply: already done, or check-out before check-in"""
+    if write.time is None:
+        return {
+            'success': False,
+            'error': f'{recognized_user.get_display_name()} has not checked in yet today. Please check in first before checking out.'
+        }
+    done = 'checked in' if action == 'check_in' else 'checked out'
+    return {
+        'success': True,
+        'already_done': True,
+        'message': f'{recognized_user.get_display_name()} has already {done} today at {write.time.strftime("%H:%M:%S")}.',
+        'user': {
+            'username': recognized_user.username,
+            'display_name': recognized_user.get_display_name(),
+            'email': recognized_user.email,
+        },
+        'action': action,
+        'time': write.time.strftime('%H:%M:%S')
+    }
+
+
+def tracked_payload(recognized_user, action):
+    """Response for a frame answered from its face track: the face is known, but nothing is marked"""
+    return {
+        'success': False,
+        'tracked': True,
+        'error': f'{recognized_user.get_display_name()} already identified from the stream; nothing was marked for this frame.',
+        'user': {
+            'username': recognized_user.username,
+            'display_name': recognized_user.get_display_name(),
+            'email': recognized_user.email,
+        },
+        'action': action,
+    }
+
+
+def marked_payload(recognized_user, action, current_time, distance, confidence):
+    logger.info(f">>> Attendance marked: {action.upper()} at {current_time.strftime('%H:%M:%S')}")
+    logger.info(f">>> Status updated to: {'Checked In' if action == 'check_in' else 'Present'}")
+    logger.info("#"*80 + "\n")
+    
+    return {
+        'success': True,
+        'message': f'{recognized_user.get_display_name()} {action.replace("_", " ")} successful!',
+        'user': {
+            'username': recognized_user.username,
+            'display_name': recognized_user.get_display_name(),
+            'email': recognized_user.email,
+            'api_id': recognized_user.api_user_id
+        },
+        'action': action,
+        'time': current_time.strftime('%H:%M:%S'),
+        'confidence': f"{confidence:.2f}%",
+        'distance': f"{distance:.4f}"
+    }
+
+
+def _recognize_and_mark(img, action, client=None):
+    """Recognize the face in a decoded frame and record the check-in/check-out"""
+    try:
+        query_embedding, user_id, distance, confidence, _ = match_scan(img, action, client=client)
         
-        # Clean up temp file
-        if os.path.exists(temp_image):
-            os.remove(temp_image)
-        
+        if query_embedding is None:
+            return JsonResponse({'success': False, 'error': NO_FACE_ERROR})
         if user_id is None:
-            logger.warning("RECOGNITION FAILED - No matching face found above threshold")
-            logger.info("#"*80 + "\n")
-            return JsonResponse({
-                'success': False,
-                'error': 'Face not recognized. Please register first or try again with better lighting.'
-            })
+            return JsonResponse({'success': False, 'error': NOT_RECOGNIZED_ERROR})
         
         # Get the recognized user
-        recognized_user = CustomUser.objects.get(id=user_id)
-        
-        logger.info(f"\n>>> FINAL RESULT: Successfully recognized {recognized_user.get_display_name()} ({recognized_user.username})")
-        logger.info(f">>> Confidence: {confidence:.2f}% | Distance: {distance:.4f} | Threshold: {DISTANCE_THRESHOLD}")
+        with stage('db'):
+            recognized_user = CustomUser.objects.get(id=user_id)
+        log_recognized(recognized_user, distance, confidence)
         
         # Check existing attendance for today (based on system time)
         # LOGIC: Day starts at 8:00 AM and ends at 8:00 AM next day.
         # If current time < 8:00 AM, it belongs to the previous day's attendance cycle.
         now = datetime.now()
         current_time = now.time()
-        
-        if now.hour < 8:
-            attendance_date = (now - timedelta(days=1)).date()
-        else:
-            attendance_date = now.date()
+        attendance_date = attendance_date_for(now)
             
         logger.info(f"Attendance Date calculated as: {attendance_date} (Current time: {now})")
         
-        # Get or create attendance record for the calculated date
-        attendance, created = Attendance.objects.get_or_create(
-            user=recognized_user,
-            date=attendance_date
-        )
+        # Claim the mark with a conditional write; duplicates and racing scans do not apply
+        with stage('db'):
+            if action == 'check_in':
+                write = mark_check_in(recognized_user, attendance_date, current_time)
+            else:  # check_out
+                write = mark_check_out(recognized_user, attendance_date, current_time)
         
-        # Prevent duplicate check-ins and check-outs
-        if action == 'check_in':
-            if attendance.check_in is not None:
-                return JsonResponse({
-                    'success': True,
-                    'already_done': True,
-                    'message': f'{recognized_user.get_display_name()} has already checked in today at {attendance.check_in.strftime("%H:%M:%S")}.',
-                    'user': {
-                        'username': recognized_user.username,
-                        'display_name': recognized_user.get_display_name(),
-                        'email': recognized_user.email,
-                    },
-                    'action': action,
-                    'time': attendance.check_in.strftime('%H:%M:%S')
-                })
-        else:  # check_out
-            if attendance.check_out is not None:
-                return JsonResponse({
-                    'success': True,
-                    'already_done': True,
-                    'message': f'{recognized_user.get_display_name()} has already checked out today at {attendance.check_out.strftime("%H:%M:%S")}.',
-                    'user': {
-                        'username': recognized_user.username,
-                        'display_name': recognized_user.get_display_name(),
-                        'email': recognized_user.email,
-                    },
-                    'action': action,
-                    'time': attendance.check_out.strftime('%H:%M:%S')
-                })
-            if attendance.check_in is None:
-                return JsonResponse({
-                    'success': False,
-                    'error': f'{recognized_user.get_display_name()} has not checked in yet today. Please check in first before checking out.'
-                })
+        if not write.applied:
+            return JsonResponse(unapplied_payload(recognized_user, action, write))
         
         # Post attendance to external API
-        if action == 'check_in':
-            api_response = check_in_user(recognized_user.api_user_id)
-        else:
-            api_response = check_out_user(recognized_user.api_user_id)
+        with stage('api'):
+            if action == 'check_in':
+                api_response = check_in_user(recognized_user.api_user_id)
+            else:
+                api_response = check_out_user(recognized_user.api_user_id)
         
         if not api_response['success']:
+            # Release the claim so the next scan can try again
+            with stage('db'):
+                if action == 'check_in':
+                    release_check_in(write)
+                else:
+                    release_check_out(write)
             return JsonResponse({
                 'success': False,
                 'error': f"API Error: {api_response['message']}"
             })
         
-        # Update local attendance record
-        if action == 'check_in':
-            attendance.check_in = current_time
-            attendance.status = 'Checked In'
-        else:
-            attendance.check_out = current_time
-            if attendance.check_in:
-                attendance.status = 'Present'
-        
-        attendance.save()
-        
-        logger.info(f">>> Attendance marked: {action.upper()} at {current_time.strftime('%H:%M:%S')}")
-        logger.info(f">>> Status updated to: {attendance.status}")
-        logger.info("#"*80 + "\n")
+        summary_refresher.schedule(recognized_user.id, attendance_date)
         
-        return JsonResponse({
-            'success': True,
-            'message': f'{recognized_user.get_display_name()} {action.replace("_", " ")} successful!',
-            'user': {
-                'username': recognized_user.username,
-                'display_name': recognized_user.get_display_name(),
-                'email': recognized_user.email,
-                'api_id': recognized_user.api_user_id
-            },
-            'action': action,
-            'time': current_time.strftime('%H:%M:%S'),
-            'confidence': f"{confidence:.2f}%",
-            'distance': f"{distance:.4f}"
-        })
+        return JsonResponse(marked_payload(recognized_user, action, current_time, distance, confidence))
         
+    except FrameQualityError as e:
+        return JsonResponse(quality_payload(e))
     except CustomUser.DoesNotExist:
         return JsonResponse({'success': False, 'error': 'User data error'})
     except Exception as e:
@@ -416,6 +643,200 @@ def recognize_and_mark_attendance(request):
         })
 
 
+# -----------------------------
+# Group scans (multi-face mode)
+# -----------------------------
+# Marks claimed for the recognized faces of one group scan
+FaceClaim = namedtuple('FaceClaim', 'action attendance_date time users writes')
+
+
+def match_faces_scan(img, action):
+    """
+    Log the request banner and recognize every face in a decoded frame.
+    
+    Returns:
+        list: recognition.FaceMatch per detected face
+    """
+    DISTANCE_THRESHOLD = getattr(settings, 'FACE_MATCH_THRESHOLD', 0.30)
+    
+    logger.info("\n" + "#"*80)
+    logger.info(f"# GROUP FACE RECOGNITION REQUEST - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info(f"# Action: {action.upper()}")
+    logger.info("#"*80)
+    
+    matches = recognize_faces(img, DISTANCE_THRESHOLD)
+    recognized = sum(match.user_id is not None for match in matches)
+    logger.info(f"Group scan: {recognized} of {len(matches)} faces recognized")
+    return matches
+
+
+def claim_faces(matches, action):
+    """
+    Claim the check-in/check-out of every recognized face in one bulk write.
+    
+    Returns:
+        FaceClaim: users maps user id to CustomUser, writes user id to AttendanceWrite
+    """
+    with stage('db'):
+        users = CustomUser.objects.in_bulk({match.user_id for match in matches if match.user_id is not None})
+    for match in matches:
+        if match.user_id in users:
+            log_recognized(users[match.user_id], match.distance, match.confidence)
+    
+    now = datetime.now()
+    current_time = now.time()
+    attendance_date = attendance_date_for(now)
+    mark = mark_check_ins if action == 'check_in' else mark_check_outs
+    with stage('db'):
+        writes = mark(list(users.values()), attendance_date, current_time) if users else {}
+    return FaceClaim(action, attendance_date, current_time, users, writes)
+
+
+def claimed_users(claim):
+    """Users whose mark the claim applied; these are posted to the external API"""
+    return [claim.users[user_id] for user_id, write in claim.writes.items() if write.applied]
+
+
+def settle_faces(claim, api_responses):
+    """Release the claims the external API rejected; refresh the summaries of the rest"""
+    release = release_check_in if claim.action == 'check_in' else release_check_out
+    with stage('db'):
+        for user_id, api_response in api_responses.items():
+            if api_response['success']:
+                summary_refresher.schedule(user_id, claim.attendance_date)
+            else:
+                release(claim.writes[user_id])
+
+
+def faces_payload(matches, claim, api_responses):
+    """Group scan response: one entry per face with its box, in frame pixels"""
+    faces = []
+    for match in matches:
+        user = claim.users.get(match.user_id)
+        write = claim.writes.get(match.user_id)
+        if user is None:
+            face = {'success': False, 'error': NOT_RECOGNIZED_ERROR}
+        elif not write.applied:
+            face = unapplied_payload(user, claim.action, write)
+        elif not api_responses[user.id]['success']:
+            face = {'success': False, 'error': f"API Error: {api_responses[user.id]['message']}"}
+        else:
+            face = marked_payload(user, claim.action, claim.time, match.distance, match.confidence)
+        x, y, width, height = match.box
+        faces.append({'box': {'x': round(x), 'y': round(y), 'width': round(width), 'height': round(height)}, **face})
+    
+    marked = sum(face['success'] and not face.get('already_done') for face in faces)
+    return {
+        'success': any(face['success'] for face in faces),
+        'multi_face': True,
+        'action': claim.action,
+        'message': f'{marked} of {len(faces)} faces marked',
+        'faces': faces,
+    }
+
+
+def _recognize_and_mark_faces(img, action):
+    """Recognize every face in a decoded frame and record their check-ins/check-outs"""
+    try:
+        matches = match_faces_scan(img, action)
+        if not matches:
+            return JsonResponse({'success': False, 'error': NO_FACE_ERROR, 'multi_face': True, 'faces': []})
+        
+        claim = claim_faces(matches, action)
+        
+        # Post the applied marks to the external API concurrently
+        users = claimed_users(claim)
+        post = check_in_user if action == 'check_in' else check_out_user
+        api_responses = {}
+        if users:
+            with stage('api'), ThreadPoolExecutor(max_workers=len(users)) as executor:
+                responses = executor.map(post, [user.api_user_id for user in users])
+                api_responses = dict(zip([user.id for user in users], responses))
+        settle_faces(claim, api_responses)
+        
+        return JsonResponse(faces_payload(matches, claim, api_responses))
+        
+    except Exception as e:
+        logger.error(f"Error in group face recognition: {str(e)}")
+        import traceback
+        logger.error(traceback.format_exc())
+        return JsonResponse({
+            'success': False,
+            'error': f'Recognition error: {str(e)}'
+        })
+
+
+def stats_access_required(view):
+    """
+    Restrict a stats view to staff sessions, or to requests carrying
+    `Authorization: Bearer <FACE_STATS_TOKEN>` when that setting is set.
+    Everyone else gets a 403.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = getattr(settings, 'FACE_STATS_TOKEN', None)
+        authorization = request.headers.get('Authorization', '')
+        if token and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode()):
+            return view(request, *args, **kwargs)
+        if request.user.is_authenticated and request.user.is_staff:
+            return view(request, *args, **kwargs)
+        return JsonResponse({'success': False, 'error': 'Forbidden'}, status=403)
+    return wrapper
+
+
+@stats_access_required
+def inference_stats(request):
+    """Queue depth and batch size stats of this worker's inference scheduler"""
+    from .inference_scheduler import inference_scheduler
+    
+    return JsonResponse(inference_scheduler.stats())
+
+
+@stats_access_required
+def face_quality_stats(request):
+    """Accepted/rejected frame counters of this worker's quality gate"""
+    from . import face_quality
+    
+    return JsonResponse(face_quality.stats())
+
+
+@stats_access_required
+def face_tracker_stats(request):
+    """Per-track stats of this worker's streaming connections"""
+    from . import face_tracker
+    
+    return JsonResponse(face_tracker.stats())
+
+
+@stats_access_required
+def metrics(request):
+    """Stage timings of this worker's recognition and registration views, in Prometheus text format"""
+    from django.http import HttpResponse
+    from .metrics import registry
+    
+    return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@stats_access_required
+def recognition_cache_stats(request):
+    """Hit/miss counters of this worker's recognition cache"""
+    from .recognition_cache import recognition_cache
+    
+    return JsonResponse(recognition_cache.stats())
+
+
+def readiness_check(request):
+    """
+    Readiness probe: 200 once this worker has warmed up its models, 503 before.
+    Point the load balancer health check here so scans only reach warm workers.
+    Unlike the stats views it is public: it only reports warm-up state.
+    """
+    from .warmup import readiness
+
+    state = readiness()
+    return JsonResponse(state, status=200 if state['ready'] else 503)
+
+
 def view_users(request):
     """View all registered users and their face registration status"""
     users = CustomUser.objects.filter(api_user_id__isnull=False).order_by('username')
@@ -1,3 +1,831 @@
-from django.test import TestCase
+import os
+import subprocess
+import sys
 
-# Create your tests here.
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+
+class ImportTimeTests(SimpleTestCase):
+    """
+    Booting the project must not import the face recognition stack: it is
+    loaded on the first embedding, so manage.py commands, migrations and
+    worker boot skip the TensorFlow import.
+    """
+
+    # Modules that may only be imported once a face is embedded or verified
+    HEAVY_MODULES = ('tensorflow', 'tf_keras', 'keras', 'deepface')
+
+    def test_setup_and_urlconf_do_not_import_tensorflow(self):
+        # A fresh interpreter: this test process may have loaded them already
+        script = (
+            "import sys, django\n"
+            "django.setup()\n"
+            "from django.urls import get_resolver\n"
+            "get_resolver().url_patterns\n"
+            "import accounts.views, accounts.simple_views, accounts.face_system, accounts.face_scan_bulk\n"
+            f"print('IMPORTED:' + ','.join(name for name in {self.HEAVY_MODULES!r} if name in sys.modules))\n"
+        )
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'attendease.settings'))
+        result = subprocess.run(
+            [sys.executable, '-c', script],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, timeout=120,
+        )
+
+        self.assertEqual(result.returncode, 0, result.stderr)
+        imported = [line for line in result.stdout.splitlines() if line.startswith('IMPORTED:')]
+        self.assertEqual(imported, ['IMPORTED:'])
+
+
+class GunicornHookTests(SimpleTestCase):
+    """Models are built in each worker, never in the master, even with GUNICORN_PRELOAD."""
+
+    def test_models_warm_up_only_after_fork(self):
+        import runpy
+        from unittest import mock
+
+        environ = {'GUNICORN_PRELOAD': '1', 'FACE_INFERENCE_POOL_PROCESSES': '0'}
+        with mock.patch.dict(os.environ, environ), \
+                mock.patch('accounts.warmup.warm_up', return_value=True) as warm_up:
+            config = runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+            self.assertTrue(config['preload_app'])
+            for hook in ('on_starting', 'when_ready'):
+                if hook in config:
+                    config[hook](mock.Mock())
+            warm_up.assert_not_called()
+            config['post_worker_init'](mock.Mock())
+            warm_up.assert_called_once()
+
+
+@override_settings(FACE_ENGINE='deepface', FACE_GALLERY_REFRESH_INTERVAL=None, FACE_GALLERY_PRECISION='float32')
+class EmbeddingGalleryTests(TestCase):
+    """
+    In-place gallery updates must leave the same arrays as a reload, and
+    workers following snapshots must see what another process published,
+    or republish a snapshot the database has moved past.
+    """
+
+    def setUp(self):
+        import numpy as np
+        from .models import CustomUser
+
+        self.rng = np.random.default_rng(1)
+        self.users = [
+            CustomUser.objects.create(username=f'user{number}', api_user_id=number, has_face_data=True)
+            for number in range(1, 4)
+        ]
+        for user in self.users:
+            for _ in range(2):
+                self.add_row(user)
+
+    def add_row(self, user, model_name='SFace'):
+        from .models import UserFaceEmbedding
+
+        row = UserFaceEmbedding(user=user, image_path=f'faces/{self.rng.integers(1 << 30)}.jpg', model_name=model_name)
+        row.set_vector(self.rng.normal(size=16))
+        row.save()
+        return row
+
+    def assertSameGallery(self, gallery, reference):
+        import numpy as np
+
+        np.testing.assert_array_equal(gallery.embedding_ids, reference.embedding_ids)
+        np.testing.assert_array_equal(gallery.user_ids, reference.user_ids)
+        np.testing.assert_array_equal(gallery.starts, reference.starts)
+        np.testing.assert_allclose(gallery.matrix, reference.matrix, atol=1e-6)
+        np.testing.assert_allclose(gallery.centroids, reference.centroids, atol=1e-6)
+
+    def loaded_gallery(self):
+        from .face_gallery import EmbeddingGallery
+
+        gallery = EmbeddingGallery()
+        gallery.load()
+        return gallery
+
+    @override_settings(FACE_GALLERY_SNAPSHOTS=False)
+    def test_legacy_json_rows_load_like_binary_rows(self):
+        import numpy as np
+        from .models import UserFaceEmbedding
+
+        binary = self.loaded_gallery()
+        for row in UserFaceEmbedding.objects.all():
+            UserFaceEmbedding.objects.filter(id=row.id).update(
+                embedding=row.get_vector().tolist(), vector=None, norm=None, dimension=None,
+            )
+        legacy = self.loaded_gallery()
+        np.testing.assert_array_equal(legacy.embedding_ids, binary.embedding_ids)
+        np.testing.assert_allclose(legacy.matrix, binary.matrix, atol=1e-6)
+
+    @override_settings(FACE_GALLERY_SNAPSHOTS=False)
+    def test_incremental_updates_match_reload(self):
+        gallery = self.loaded_gallery()
+        self.assertEqual(len(gallery), 6)
+
+        row = self.add_row(self.users[0])
+        gallery.add_embedding(row.id, row.user_id, row.get_vector())
+        removed = self.users[1].face_embeddings.first()
+        gallery.remove_embedding(removed.id)
+        removed.delete()
+        self.assertSameGallery(gallery, self.loaded_gallery())
+
+        self.users[2].has_face_data = False
+        self.users[2].save()
+        gallery.remove_user(self.users[2].id)
+        self.assertFalse(gallery.has_user(self.users[2].id))
+        self.assertSameGallery(gallery, self.loaded_gallery())
+
+        self.users[2].has_face_data = True
+        self.users[2].save()
+        gallery.load_user(self.users[2].id)
+        self.assertSameGallery(gallery, self.loaded_gallery())
+
+    @override_settings(FACE_GALLERY_SNAPSHOTS=False)
+    def test_other_engine_rows_are_left_out(self):
+        self.add_row(self.users[0], model_name='SFace-OpenCV')
+        self.assertEqual(len(self.loaded_gallery()), 6)
+
+    def test_user_saves_only_touch_the_gallery_when_eligibility_can_change(self):
+        from unittest import mock
+        from . import signal
+        from .face_gallery import EmbeddingGallery
+
+        user = self.users[0]
+        with mock.patch.object(signal, 'embedding_gallery') as gallery, \
+                mock.patch.object(signal, 'snapshot_publisher') as publisher, \
+                override_settings(FACE_GALLERY_SNAPSHOTS=True):
+            gallery.is_user_eligible.side_effect = EmbeddingGallery.is_user_eligible
+            gallery.remove_user.return_value = False
+            with self.captureOnCommitCallbacks(execute=True):
+                user.save(update_fields=['last_login'])
+            self.assertEqual(gallery.method_calls, [])
+
+            # Dropping a user neither loads nor maps the gallery
+            user.has_face_data = False
+            with self.captureOnCommitCallbacks(execute=True):
+                user.save(update_fields=['has_face_data'])
+        gallery.ensure_loaded.assert_not_called()
+        gallery.remove_user.assert_called_once_with(user.id)
+        publisher.schedule.assert_called_once_with(if_stale=True)
+
+    def test_snapshot_publish_and_follow(self):
+        import shutil
+        import tempfile
+        from .face_gallery import EmbeddingGallery
+        from .gallery_snapshot import current_version, publish_from_database
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        with override_settings(FACE_GALLERY_SNAPSHOTS=True, FACE_GALLERY_SNAPSHOT_DIR=directory):
+            # The first reader publishes the first snapshot and maps it
+            reader = EmbeddingGallery()
+            reader.ensure_loaded()
+            first = current_version()
+            self.assertEqual((reader.version, len(reader)), (first, 6))
+
+            # Another process publishes after a change: the reader follows
+            self.add_row(self.users[0])
+            second = publish_from_database()
+            self.assertNotEqual(second, first)
+            reader.ensure_loaded()
+            self.assertEqual((reader.version, len(reader)), (second, 7))
+            self.assertSameGallery(reader, self.loaded_gallery())
+
+            # A change whose publisher died: the fingerprint check republishes
+            self.add_row(self.users[1])
+            with override_settings(FACE_GALLERY_REFRESH_INTERVAL=0):
+                reader.ensure_loaded()
+            self.assertNotEqual(current_version(), second)
+            self.assertEqual((reader.version, len(reader)), (current_version(), 8))
+
+            # Nothing changed: no new snapshot
+            version = current_version()
+            self.assertEqual(publish_from_database(if_stale=True), version)
+
+
+def _random_gallery(users=60, rows_per_user=3, dimension=64, seed=0):
+    """Normalized rows grouped by user, with noisy copies of some users' faces as queries."""
+    import numpy as np
+    from .face_gallery import normalize_rows
+
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(users, dimension))
+    matrix = normalize_rows(np.repeat(centres, rows_per_user, axis=0) + rng.normal(size=(users * rows_per_user, dimension)) * 0.2)
+    user_ids = np.repeat(np.arange(1, users + 1), rows_per_user).astype(np.int64)
+    queries = normalize_rows(centres[::5] + rng.normal(size=centres[::5].shape) * 0.2)
+    return matrix, user_ids, queries
+
+
+class MatchParityTests(SimpleTestCase):
+    """
+    The vectorized matcher must agree with a per-user loop over the
+    gallery, and the matching shortcuts with the exact matcher: on a well
+    separated gallery they pick the same users at (nearly) the same
+    distances.
+    """
+
+    THRESHOLD = 0.6
+
+    def setUp(self):
+        from .face_gallery import user_centroids, user_segments
+        from .face_matcher import match_embeddings
+
+        self.matrix, self.user_ids, self.queries = _random_gallery()
+        self.starts = user_segments(self.user_ids)
+        self.centroids = user_centroids(self.matrix, self.starts)
+        self.exact = match_embeddings(self.queries, self.matrix, self.user_ids, threshold=self.THRESHOLD, starts=self.starts)
+        # The queries are near users 1, 6, 11, ...
+        self.assertEqual([result.user_id for result in self.exact], list(range(1, 61, 5)))
+
+    def assertSameMatches(self, results, places=6):
+        self.assertEqual([result.user_id for result in results], [result.user_id for result in self.exact])
+        for result, exact in zip(results, self.exact):
+            self.assertAlmostEqual(result.distance, exact.distance, places=places)
+
+    def test_exact_match_agrees_with_per_user_loop(self):
+        import numpy as np
+        from .face_matcher import match_embeddings
+
+        results = match_embeddings(self.queries, self.matrix, self.user_ids, threshold=self.THRESHOLD, top_k=3)
+        for query, result in zip(self.queries, results):
+            distances = {
+                int(user_id): 1.0 - float(np.max(self.matrix[self.user_ids == user_id] @ query))
+                for user_id in np.unique(self.user_ids)
+            }
+            ranking = sorted(distances, key=distances.get)[:3]
+            self.assertEqual([user_id for user_id, _ in result.candidates], ranking)
+            for user_id, distance in result.candidates:
+                self.assertAlmostEqual(distance, distances[user_id], places=5)
+            self.assertAlmostEqual(result.confidence, (1.0 - result.distance) * 100, places=4)
+
+    def test_prefilter_matches_exact(self):
+        from .face_matcher import match_embeddings
+
+        results = match_embeddings(
+            self.queries, self.matrix, self.user_ids, threshold=self.THRESHOLD,
+            starts=self.starts, centroids=self.centroids, prefilter_users=5,
+        )
+        self.assertSameMatches(results)
+
+    def test_quantized_scan_matches_exact(self):
+        from .face_matcher import match_embeddings
+        from .face_quantization import quantize_rows
+
+        for precision, places in (('float16', 3), ('int8', 2)):
+            with self.subTest(precision=precision):
+                quantized = quantize_rows(self.matrix, precision)
+                self.assertSameMatches(match_embeddings(
+                    self.queries, self.matrix, self.user_ids, threshold=self.THRESHOLD,
+                    starts=self.starts, quantized=quantized,
+                ), places=places)
+                # Re-ranked users are re-scored from the float32 rows
+                self.assertSameMatches(match_embeddings(
+                    self.queries, self.matrix, self.user_ids, threshold=self.THRESHOLD,
+                    starts=self.starts, quantized=quantized, rerank_users=5,
+                ))
+
+    def test_no_match_above_threshold(self):
+        from .face_matcher import match_embeddings
+
+        result, = match_embeddings(-self.matrix[0], self.matrix, self.user_ids, threshold=0.3, starts=self.starts)
+        self.assertIsNone(result.user_id)
+        self.assertEqual(len(result.candidates), 1)
+
+    def test_ivf_index_matches_exact(self):
+        import numpy as np
+        from .face_index import IVFIndex
+
+        index = IVFIndex(n_lists=8, nprobe=8)
+        index.build(self.matrix, self.user_ids, np.arange(1, len(self.user_ids) + 1))
+        self.assertSameMatches(index.search(self.queries, threshold=self.THRESHOLD))
+
+    def test_ivf_index_updates_match_exact(self):
+        import numpy as np
+        from .face_index import IVFIndex
+        from .face_matcher import match_embeddings
+
+        embedding_ids = np.arange(1, len(self.user_ids) + 1)
+        index = IVFIndex(n_lists=8, nprobe=8)
+        index.build(self.matrix[3:], self.user_ids[3:], embedding_ids[3:])
+        index.add(embedding_ids[:3], self.user_ids[:3], self.matrix[:3])
+        self.assertSameMatches(index.search(self.queries, threshold=self.THRESHOLD))
+
+        # Without user 6 the second query matches someone else, or no one
+        index.remove(embedding_ids[self.user_ids == 6])
+        kept = self.user_ids != 6
+        expected = match_embeddings(self.queries, self.matrix[kept], self.user_ids[kept], threshold=self.THRESHOLD)
+        self.assertEqual(
+            [result.user_id for result in index.search(self.queries, threshold=self.THRESHOLD)],
+            [result.user_id for result in expected],
+        )
+
+    def test_ivf_search_during_updates(self):
+        import threading
+        import numpy as np
+        from .face_index import IVFIndex
+
+        embedding_ids = np.arange(1, len(self.user_ids) + 1)
+        index = IVFIndex(n_lists=8, nprobe=8)
+        index.build(self.matrix, self.user_ids, embedding_ids)
+        moving = self.user_ids == 6
+        done = threading.Event()
+
+        def churn():
+            while not done.is_set():
+                index.remove(embedding_ids[moving])
+                index.add(embedding_ids[moving], self.user_ids[moving], self.matrix[moving])
+
+        thread = threading.Thread(target=churn)
+        thread.start()
+        try:
+            # Queries near other users keep matching them while user 6 comes and goes
+            for _ in range(200):
+                results = index.search(self.queries, threshold=self.THRESHOLD)
+                self.assertEqual(
+                    [result.user_id for i, result in enumerate(results) if i != 1],
+                    [result.user_id for i, result in enumerate(self.exact) if i != 1],
+                )
+        finally:
+            done.set()
+            thread.join()
+
+
+class FaceEmbeddingTests(SimpleTestCase):
+    """A frame without a face embeds to None; an engine failure is raised, not reported as no face."""
+
+    def test_no_face_is_none(self):
+        from unittest import mock
+        from .utils import compute_face_embeddings
+
+        engine = mock.Mock()
+        engine.represent_batch.return_value = [[0.1, 0.2], None]
+        with mock.patch('accounts.face_engine.get_engine', return_value=engine):
+            self.assertEqual(compute_face_embeddings(['a.jpg', 'b.jpg']), [[0.1, 0.2], None])
+
+    @override_settings(FACE_INFERENCE_BATCHING=True)
+    def test_engine_error_reaches_the_scan(self):
+        from unittest import mock
+        import numpy as np
+        from .inference_scheduler import InferenceScheduler
+        from .utils import compute_face_embeddings
+
+        engine = mock.Mock()
+        engine.represent_batch.side_effect = RuntimeError('SFace weights missing')
+        with mock.patch('accounts.face_engine.get_engine', return_value=engine):
+            with self.assertRaisesMessage(RuntimeError, 'SFace weights missing'):
+                compute_face_embeddings(['a.jpg'])
+            with self.assertRaisesMessage(RuntimeError, 'SFace weights missing'):
+                InferenceScheduler().recognize(np.zeros((8, 8, 3), dtype=np.uint8), 0.3, timeout=5)
+
+
+class StatsAccessTests(TestCase):
+    """The per-worker stats endpoints answer staff sessions and the stats token only."""
+
+    STATS_URLS = ('/api/stats/inference/', '/api/stats/recognition-cache/', '/api/stats/face-quality/',
+                  '/api/stats/face-tracks/', '/metrics/')
+
+    def test_anonymous_requests_are_refused(self):
+        for url in self.STATS_URLS:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_staff_sessions_are_served(self):
+        from .models import CustomUser
+
+        self.client.force_login(CustomUser.objects.create(username='admin', is_staff=True))
+        for url in self.STATS_URLS:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    @override_settings(FACE_STATS_TOKEN='secret')
+    def test_stats_token_is_served(self):
+        for url in self.STATS_URLS:
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+                self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+
+
+@override_settings(FACE_CACHE_TTL=3.0, FACE_CACHE_MAX_ENTRIES=2, FACE_CACHE_HASH_DISTANCE=8,
+                   FACE_CACHE_EMBEDDING_DISTANCE=0.05)
+class RecognitionCacheTests(SimpleTestCase):
+    """
+    Frame hits are per scanner and within the hash tolerance, a cached match
+    is only reused for the same face, and entries expire and are evicted LRU.
+    """
+
+    def setUp(self):
+        import numpy as np
+        from .face_matcher import MatchResult
+        from .recognition_cache import RecognitionCache
+
+        self.cache = RecognitionCache()
+        self.embedding = np.ones(8, dtype=np.float32)
+        self.result = MatchResult(7, 0.1, 90.0, [(7, 0.1)])
+
+    def test_hash_tolerance_and_scanner_scope(self):
+        self.cache.store(0b1111, self.embedding, 0.3, self.result, client='kiosk-1')
+        self.assertIsNotNone(self.cache.lookup_frame(0b1111 ^ 0xff, 0.3, 'kiosk-1'))  # 8 bits apart
+        self.assertIsNone(self.cache.lookup_frame(0b1111 ^ 0x1ff, 0.3, 'kiosk-1'))  # 9 bits apart
+        self.assertIsNone(self.cache.lookup_frame(0b1111, 0.3, 'kiosk-2'))
+        self.assertIsNone(self.cache.lookup_frame(0b1111, 0.4, 'kiosk-1'))
+
+    def test_frame_hit_needs_a_confirming_embedding(self):
+        import numpy as np
+
+        self.cache.store(1, self.embedding, 0.3, self.result, client='kiosk')
+        entry = self.cache.lookup_frame(1, 0.3, 'kiosk')
+        self.assertTrue(self.cache.confirm(entry, self.embedding * 2))
+        other = np.r_[np.ones(4), -np.ones(4)]
+        self.assertFalse(self.cache.confirm(entry, other))
+        stats = self.cache.stats()
+        self.assertEqual((stats['frame_confirmations'], stats['frame_rejections']), (1, 1))
+
+    @override_settings(FACE_INFERENCE_BATCHING=False)
+    def test_another_face_in_a_similar_frame_is_not_marked(self):
+        from unittest import mock
+        import numpy as np
+        from . import face_quality, recognition
+        from .face_matcher import MatchResult
+
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+        report = mock.Mock(box=(8, 8, 48, 48))
+        other = np.r_[np.ones(4), -np.ones(4)].astype(np.float32)
+        gallery = mock.Mock(generation=0, arrays=mock.Mock(return_value=(None, None, None)))
+        gallery.match.side_effect = [[self.result], [MatchResult(None, None, None, [(7, 0.9)])]]
+        with mock.patch('accounts.recognition_cache.recognition_cache', self.cache), \
+                mock.patch.object(face_quality, 'check_frame', return_value=report), \
+                mock.patch.object(recognition, 'embedding_gallery', gallery), \
+                mock.patch.object(recognition, 'report_match', side_effect=lambda result, *_: result[:3]), \
+                mock.patch.object(recognition, 'compute_face_embedding', side_effect=[self.embedding, other]):
+            self.assertEqual(recognition.recognize_frame(frame, 0.3, client='kiosk')[1], (7, 0.1, 90.0))
+            self.assertEqual(recognition.recognize_frame(frame, 0.3, client='kiosk')[1], (None, None, None))
+        self.assertEqual(gallery.match.call_count, 2)
+
+    @override_settings(FACE_INFERENCE_BATCHING=True)
+    def test_frame_candidate_is_confirmed_in_the_scheduler(self):
+        from unittest import mock
+        import numpy as np
+        from . import face_quality, recognition
+
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+        report = mock.Mock(box=(8, 8, 48, 48))
+        gallery = mock.Mock(generation=0, arrays=mock.Mock(return_value=(None, None, None)))
+        gallery.match.return_value = [self.result]
+        with mock.patch('accounts.recognition_cache.recognition_cache', self.cache), \
+                mock.patch('accounts.face_gallery.embedding_gallery', gallery), \
+                mock.patch('accounts.utils.compute_face_embeddings', return_value=[self.embedding]), \
+                mock.patch.object(face_quality, 'check_frame', return_value=report), \
+                mock.patch.object(recognition, 'embedding_gallery', gallery), \
+                mock.patch.object(recognition, 'report_match', side_effect=lambda result, *_: result[:3]), \
+                mock.patch.object(recognition, 'compute_face_embedding') as inline:
+            for _ in range(2):
+                self.assertEqual(recognition.recognize_frame(frame, 0.3, client='kiosk')[1], (7, 0.1, 90.0))
+        inline.assert_not_called()
+        self.assertEqual(gallery.match.call_count, 1)
+        self.assertEqual(self.cache.stats()['frame_confirmations'], 1)
+
+    def test_hit_rates_are_per_tier(self):
+        self.cache.store(1, self.embedding, 0.3, self.result, client='kiosk')
+        self.cache.lookup_frame(1, 0.3, 'kiosk')
+        self.cache.lookup_frame(1, 0.3, 'kiosk-2')
+        for _ in range(3):
+            self.cache.lookup_embedding(self.embedding, 0.3)
+        stats = self.cache.stats()
+        self.assertEqual((stats['frame_hit_rate'], stats['embedding_hit_rate']), (0.5, 1.0))
+
+    def test_entries_expire(self):
+        from unittest import mock
+
+        with mock.patch('accounts.recognition_cache.time.monotonic', return_value=100.0):
+            self.cache.store(1, self.embedding, 0.3, self.result, client='kiosk')
+        with mock.patch('accounts.recognition_cache.time.monotonic', return_value=102.9):
+            self.assertIsNotNone(self.cache.lookup_embedding(self.embedding, 0.3))
+        with mock.patch('accounts.recognition_cache.time.monotonic', return_value=103.0):
+            self.assertIsNone(self.cache.lookup_embedding(self.embedding, 0.3))
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_least_recently_used_is_evicted(self):
+        first, second, third = 0xffff, 0xffff << 16, 0xffff << 32
+        self.cache.store(first, None, 0.3, None, client='kiosk')
+        self.cache.store(second, None, 0.3, None, client='kiosk')
+        self.assertIsNotNone(self.cache.lookup_frame(first, 0.3, 'kiosk'))
+        self.cache.store(third, None, 0.3, None, client='kiosk')
+        self.assertIsNone(self.cache.lookup_frame(second, 0.3, 'kiosk'))
+        self.assertIsNotNone(self.cache.lookup_frame(first, 0.3, 'kiosk'))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
+
+    def test_face_hash_tolerates_noise_but_not_other_faces(self):
+        import numpy as np
+        from .recognition_cache import face_hash
+
+        rng = np.random.default_rng(2)
+        face = (rng.random((12, 12, 3)) * 255).astype(np.uint8).repeat(8, axis=0).repeat(8, axis=1)
+        frame = np.zeros((200, 200, 3), dtype=np.uint8)
+        frame[50:146, 50:146] = face
+        noisy = np.clip(frame.astype(np.int16) + rng.integers(-3, 4, frame.shape), 0, 255).astype(np.uint8)
+        other = frame.copy()
+        other[50:146, 50:146] = np.flip(face, axis=1)
+
+        box = (50, 50, 96, 96)
+        self.assertLessEqual((face_hash(frame, box) ^ face_hash(noisy, box)).bit_count(), 8)
+        self.assertGreater((face_hash(frame, box) ^ face_hash(other, box)).bit_count(), 8)
+        self.assertIsNone(face_hash(frame, (0, 0, 10, 10)))
+
+
+class AttendanceWriteTests(TestCase):
+    """
+    Check-ins and check-outs are claimed with conditional writes: a mark
+    applies once, duplicates report the stored time and claims can be
+    released when the external API rejects them.
+    """
+
+    def setUp(self):
+        from datetime import date, time
+        from .models import CustomUser
+
+        self.day = date(2026, 3, 2)
+        self.morning, self.later, self.evening = time(9, 0), time(9, 5), time(18, 0)
+        self.user = CustomUser.objects.create(username='worker', api_user_id=10)
+        self.others = [CustomUser.objects.create(username=f'other{n}', api_user_id=20 + n) for n in range(3)]
+
+    def row(self):
+        from .models import Attendance
+        return Attendance.objects.get(user=self.user, date=self.day)
+
+    def test_check_in_applies_once(self):
+        from .attendance_service import AttendanceWrite, mark_check_in
+
+        write = mark_check_in(self.user, self.day, self.morning)
+        row = self.row()
+        self.assertEqual(write, AttendanceWrite(True, self.morning, row.id))
+        self.assertEqual(mark_check_in(self.user, self.day, self.later), AttendanceWrite(False, self.morning))
+        self.assertEqual((row.check_in, row.status), (self.morning, 'Checked In'))
+
+    def test_check_out_needs_check_in_and_applies_once(self):
+        from .attendance_service import AttendanceWrite, mark_check_in, mark_check_out
+
+        self.assertEqual(mark_check_out(self.user, self.day, self.evening), AttendanceWrite(False, None))
+        mark_check_in(self.user, self.day, self.morning)
+        self.assertEqual(mark_check_out(self.user, self.day, self.evening), AttendanceWrite(True, self.evening, self.row().id))
+        self.assertEqual(mark_check_out(self.user, self.day, self.later), AttendanceWrite(False, self.evening))
+        row = self.row()
+        self.assertEqual((row.check_out, row.status), (self.evening, 'Present'))
+
+    def test_released_claim_can_be_marked_again(self):
+        from .attendance_service import mark_check_in, release_check_in
+
+        write = mark_check_in(self.user, self.day, self.morning)
+        self.assertTrue(release_check_in(write))
+        self.assertFalse(release_check_in(write))
+        self.assertEqual((self.row().check_in, self.row().status), (None, 'Absent'))
+        self.assertTrue(mark_check_in(self.user, self.day, self.later).applied)
+
+    def test_duplicate_check_in_costs_one_query(self):
+        from .attendance_service import mark_check_in
+
+        mark_check_in(self.user, self.day, self.morning)
+        with self.assertNumQueries(1):
+            self.assertFalse(mark_check_in(self.user, self.day, self.later).applied)
+
+    def test_claim_at_the_same_time_is_not_owned(self):
+        from .attendance_service import mark_check_in, mark_check_ins
+
+        mark_check_in(self.others[0], self.day, self.later)
+        writes = mark_check_ins([self.user, self.others[0]], self.day, self.later)
+        self.assertEqual((writes[self.user.id].applied, writes[self.others[0].id].applied), (True, False))
+
+    def test_group_check_in_claims_with_three_queries(self):
+        from .attendance_service import AttendanceWrite, mark_check_in, mark_check_ins
+
+        mark_check_in(self.others[0], self.day, self.morning)
+        with self.assertNumQueries(3):
+            writes = mark_check_ins([self.user, *self.others], self.day, self.later)
+        self.assertEqual(writes[self.others[0].id], AttendanceWrite(False, self.morning))
+        for user in (self.user, *self.others[1:]):
+            self.assertEqual(writes[user.id][:2], (True, self.later))
+
+    def test_group_check_out(self):
+        from .attendance_service import AttendanceWrite, mark_check_in, mark_check_outs
+
+        mark_check_in(self.user, self.day, self.morning)
+        writes = mark_check_outs([self.user, self.others[0]], self.day, self.evening)
+        self.assertEqual(writes, {
+            self.user.id: AttendanceWrite(True, self.evening, self.row().id),
+            self.others[0].id: AttendanceWrite(False, None),
+        })
+
+
+@override_settings(FACE_QUALITY_ANALYSIS_SIZE=160, FACE_QUALITY_MIN_FACE_SIZE=60, FACE_QUALITY_MIN_SHARPNESS=40.0)
+class FaceQualityTests(SimpleTestCase):
+    """
+    Faces are measured in frame pixels: the Haar cascade runs on a copy
+    where faces near the minimum size fit its window, and sharpness is
+    measured on the face cropped from the full-resolution frame.
+    """
+
+    def setUp(self):
+        import numpy as np
+
+        # Fine texture: sharp at full resolution, averaged away on the analysis copy
+        self.frame = np.random.default_rng(0).integers(0, 256, (720, 1280, 1)).repeat(3, axis=2).astype(np.uint8)
+
+    def detect(self, face):
+        from unittest import mock
+        from . import face_quality
+
+        cascade = mock.Mock()
+        cascade.detectMultiScale.return_value = face
+        return cascade, mock.patch.object(face_quality, '_detector', return_value=('haar', cascade))
+
+    def test_small_face_is_too_small_not_missing(self):
+        import numpy as np
+        from . import face_quality
+
+        cascade, detector = self.detect(np.array([[100, 100, 26, 26]]))
+        with detector, self.assertRaises(face_quality.FrameQualityError) as raised:
+            face_quality.check_frame(self.frame)
+        self.assertEqual(raised.exception.reason, 'face_too_small')
+        self.assertEqual(raised.exception.report.box, (200.0, 200.0, 52.0, 52.0))
+        gray = cascade.detectMultiScale.call_args.args[0]
+        self.assertEqual((gray.shape, cascade.detectMultiScale.call_args.kwargs['minSize']), ((360, 640), (24, 24)))
+
+    def test_sharpness_of_the_full_resolution_face(self):
+        import numpy as np
+        from . import face_quality
+
+        _, detector = self.detect(np.array([[100, 100, 120, 120]]))
+        with detector:
+            report = face_quality.check_frame(self.frame)
+        self.assertEqual(report.face_size, 240.0)
+        self.assertGreater(report.sharpness, 1000)
+
+
+@override_settings(FACE_TRACK_MIN_IOU=0.3, FACE_TRACK_MAX_AGE=1.0, FACE_TRACK_CONFIRM_MATCHES=2,
+                   FACE_TRACK_REVERIFY_SECONDS=3.0)
+class FaceTrackerTests(SimpleTestCase):
+    """
+    Tracks follow overlapping boxes, are lost after FACE_TRACK_MAX_AGE,
+    reuse a match only once confirmed and until re-verification is due, and
+    a reused match never marks attendance.
+    """
+
+    MATCH = (7, 0.1, 90.0)
+
+    def setUp(self):
+        from .face_tracker import FaceTracker
+
+        self.tracker = FaceTracker('test')
+        self.addCleanup(self.tracker.close)
+
+    def test_box_iou(self):
+        from .face_tracker import box_iou
+
+        self.assertEqual(box_iou((0, 0, 10, 10), (0, 0, 10, 10)), 1.0)
+        self.assertAlmostEqual(box_iou((0, 0, 10, 10), (5, 0, 10, 10)), 50 / 150)
+        self.assertEqual(box_iou((0, 0, 10, 10), (20, 20, 10, 10)), 0.0)
+
+    def test_overlapping_boxes_continue_a_track_until_it_expires(self):
+        track = self.tracker.update((100, 100, 80, 80), now=0.0)
+        self.assertIs(self.tracker.update((110, 105, 80, 80), now=0.5), track)
+        self.assertIsNot(self.tracker.update((400, 100, 80, 80), now=0.6), track)
+        self.assertIsNot(self.tracker.update((110, 105, 80, 80), now=1.6), track)
+        self.assertEqual(self.tracker.stats()['tracks_started'], 3)
+
+    def test_match_is_reused_after_confirmation_until_reverification(self):
+        track = self.tracker.update((100, 100, 80, 80), now=0.0)
+        self.tracker.record(track, [1.0], self.MATCH, now=0.0)
+        self.assertIsNone(self.tracker.reusable_match(track, now=0.1))
+        self.tracker.record(track, [1.0], self.MATCH, now=0.2)
+        self.assertEqual(self.tracker.reusable_match(track, now=0.3), ([1.0], self.MATCH))
+        self.assertIsNone(self.tracker.reusable_match(track, now=3.2))
+
+        # A disagreeing re-verification starts the vote over
+        self.tracker.record(track, [2.0], (8, 0.1, 90.0), now=3.2)
+        self.assertIsNone(self.tracker.reusable_match(track, now=3.3))
+
+    @override_settings(FACE_QUALITY_CHECKS=False, FACE_CACHE_TTL=0)
+    def test_recognize_tracked_needs_full_frame_boxes(self):
+        from unittest import mock
+        import numpy as np
+        from . import recognition
+
+        frame = np.zeros((120, 120, 3), dtype=np.uint8)
+        with mock.patch.object(recognition, 'recognize_frame', return_value=([1.0], self.MATCH)) as recognize:
+            # No face box and no crop position: every frame is embedded
+            for _ in range(3):
+                self.assertFalse(recognition.recognize_tracked(frame, 0.3, self.tracker)[2])
+            self.assertEqual(recognize.call_count, 3)
+            self.assertEqual(self.tracker.stats()['frames'], 0)
+
+            box = (100, 100, 80, 80)
+            reused = [recognition.recognize_tracked(frame, 0.3, self.tracker, box)[2] for _ in range(3)]
+            self.assertEqual(reused, [False, False, True])
+            self.assertEqual(recognize.call_count, 5)
+
+    def test_crop_boxes_are_moved_into_the_frame(self):
+        from .recognition import _frame_box
+
+        # A 100x100 crop taken at (300, 40) and uploaded at half size
+        self.assertEqual(_frame_box((10, 20, 30, 30), (300, 40, 100, 100), (50, 50, 3)), (320, 80, 60, 60))
+
+    def test_reused_match_does_not_mark_attendance(self):
+        import asyncio
+        from unittest import mock
+        from . import async_views
+
+        user = mock.Mock(get_display_name=mock.Mock(return_value='Worker'), username='worker', email='w@example.com')
+        match = ([1.0], 7, 0.1, 90.0, True)
+        with mock.patch.object(async_views, 'run_inference', mock.AsyncMock(return_value=match)), \
+                mock.patch.object(async_views.CustomUser.objects, 'aget', mock.AsyncMock(return_value=user)), \
+                mock.patch.object(async_views, 'mark_check_in') as mark:
+            payload = asyncio.run(async_views.recognize_and_mark(lambda: None, 'check_in', self.tracker))
+        mark.assert_not_called()
+        self.assertEqual((payload['success'], payload['tracked']), (False, True))
+
+
+@override_settings(FACE_QUALITY_CHECKS=False, FACE_INFERENCE_BATCHING=False, FACE_CACHE_TTL=0)
+class ServerTimingTests(TestCase):
+    """Timed views report their stages in a Server-Timing header."""
+
+    def upload(self):
+        import cv2
+        import numpy as np
+
+        frame = cv2.imencode('.jpg', np.full((64, 64, 3), 128, dtype=np.uint8))[1].tobytes()
+        return self.client.post(
+            '/api/recognize/frame/', data=frame, content_type='application/octet-stream',
+            HTTP_X_ATTENDANCE_ACTION='check_in',
+        )
+
+    def test_stages_are_reported(self):
+        from unittest import mock
+        from . import recognition
+
+        with mock.patch.object(recognition, 'compute_face_embedding', return_value=None):
+            response = self.upload()
+        self.assertFalse(response.json()['success'])
+        stages = dict(part.split(';dur=') for part in response['Server-Timing'].split(', '))
+        self.assertIn('decode', stages)
+        self.assertIn('embed', stages)
+        self.assertIn('total', stages)
+        self.assertGreaterEqual(float(stages['total']), float(stages['decode']))
+
+    @override_settings(FACE_METRICS_ENABLED=False)
+    def test_no_header_when_disabled(self):
+        from unittest import mock
+        from . import recognition
+
+        with mock.patch.object(recognition, 'compute_face_embedding', return_value=None):
+            response = self.upload()
+        self.assertNotIn('Server-Timing', response)
+
+
+class InferencePoolSlotTests(SimpleTestCase):
+    """Slots of clients that died are returned to the pool once no model process can still answer them."""
+
+    def setUp(self):
+        from .inference_pool import InferencePool
+
+        self.pool = InferencePool('deepface', 1, slots=2, slot_bytes=64 * 64 * 3)
+        self.addCleanup(self.pool.stop)
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        return process.pid
+
+    def free_slots(self):
+        import select
+
+        free = []
+        while select.select([self.pool._free[0]], [], [], 0)[0]:
+            free.extend(os.read(self.pool._free[0], 16))
+        return sorted(free)
+
+    def test_slots_of_dead_clients_are_recovered(self):
+        self.assertEqual(self.free_slots(), [0, 1])
+        pid = self.dead_pid()
+        self.pool._holders[:] = pid
+        self.pool._queued[1] = 1  # still waiting for a model process
+
+        idle = set()
+        self.pool._recover_slots(idle)
+        self.assertEqual(self.free_slots(), [])
+        self.pool._recover_slots(idle)
+        self.assertEqual(self.free_slots(), [0])
+        self.assertEqual(self.pool.status()['recovered_slots'], 1)
+
+        # Once answered, the queued slot follows; the answer does not leak to its next client
+        self.pool._queued[1] = 0
+        os.write(self.pool._done[1][1], b'\0')
+        self.pool._recover_slots(idle)
+        self.pool._recover_slots(idle)
+        self.assertEqual(self.free_slots(), [1])
+        self.assertFalse(self.pool._wait_done(1, 0))
+
+    def test_slots_of_live_clients_are_kept(self):
+        self.free_slots()
+        self.pool._holders[:] = os.getpid()
+        idle = set()
+        for _ in range(3):
+            self.pool._recover_slots(idle)
+        self.assertEqual(self.free_slots(), [])
@@ -2,6 +2,7 @@ from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
 from . import simple_views
+from . import async_views
 from django.contrib import admin
 from django.conf import settings
 from django.conf.urls.static import static
@@ -17,11 +18,21 @@ urlpatterns = [
     path('register/select/', simple_views.select_user_for_registration, name='select_user_registration'),
     path('register/face/<int:user_id>/', simple_views.register_face, name='register_face'),
     path('api/save-face/', simple_views.save_face_image, name='save_face_image'),
+    path('api/async/save-face/', async_views.save_face_image_async, name='save_face_image_async'),
     path('delete-face-data/<int:user_id>/', simple_views.delete_face_data, name='delete_face_data'),
     
     # Attendance Scanning
     path('attendance/scanner/', simple_views.attendance_scanner, name='attendance_scanner'),
     path('api/recognize/', simple_views.recognize_and_mark_attendance, name='recognize_and_mark'),
+    path('api/recognize/frame/', simple_views.recognize_frame_upload, name='recognize_frame_upload'),
+    path('api/async/recognize/', async_views.recognize_and_mark_attendance_async, name='recognize_and_mark_async'),
+    path('api/async/recognize/frame/', async_views.recognize_frame_upload_async, name='recognize_frame_upload_async'),
+    path('api/ready/', simple_views.readiness_check, name='readiness_check'),
+    path('api/stats/inference/', simple_views.inference_stats, name='inference_stats'),
+    path('api/stats/recognition-cache/', simple_views.recognition_cache_stats, name='recognition_cache_stats'),
+    path('api/stats/face-quality/', simple_views.face_quality_stats, name='face_quality_stats'),
+    path('api/stats/face-tracks/', simple_views.face_tracker_stats, name='face_tracker_stats'),
+    path('metrics/', simple_views.metrics, name='metrics'),
     
     # User Management
     path('users/view/', simple_views.view_users, name='view_users'),
@@ -8,43 +8,101 @@ import numpy as np
 logger = logging.getLogger(__name__)
 
 
-def compute_face_embedding(image_path, model_name="SFace"):
+def compute_face_embedding(image, model_name="SFace", engine=None):
     """
-    Compute face embedding for a given image using DeepFace.
+    Compute face embedding for a given image with the configured engine
+    (FACE_ENGINE, see face_engine.py).
     
     Args:
-        image_path: Absolute path to the face image
+        image: Absolute path to the face image, or an already decoded
+            OpenCV BGR frame (numpy array) so scans never touch disk
         model_name: DeepFace model to use (default: SFace)
+        engine: Engine name overriding FACE_ENGINE
     
     Returns:
-        list: 512D embedding vector as list, or None if failed
+        list: Embedding vector as list, or None if failed
     """
+    if isinstance(image, np.ndarray):
+        label = f"frame {image.shape[1]}x{image.shape[0]}"
+    else:
+        label = image
+
     try:
-        from deepface import DeepFace
+        from .face_engine import get_engine
         
-        # Use DeepFace.represent() to extract embeddings
-        # This is much faster than DeepFace.verify() during recognition
-        result = DeepFace.represent(
-            img_path=image_path,
-            model_name=model_name,
-            detector_backend="opencv",
-            enforce_detection=False
-        )
+        embedding = get_engine(engine).represent(image, model_name=model_name)
         
-        # DeepFace.represent returns a list of dicts (one per detected face)
-        if result and len(result) > 0:
-            embedding = result[0]["embedding"]
-            logger.info(f"Computed embedding for {image_path}: {len(embedding)}D vector")
+        if embedding is not None:
+            logger.info(f"Computed embedding for {label}: {len(embedding)}D vector")
             return embedding
         else:
-            logger.warning(f"No face detected in {image_path}")
+            logger.warning(f"No face detected in {label}")
             return None
             
     except Exception as e:
-        logger.error(f"Error computing embedding for {image_path}: {str(e)}")
+        logger.error(f"Error computing embedding for {label}: {str(e)}")
         return None
 
 
+def compute_face_embeddings(images, model_name="SFace", engine=None, batch_size=None):
+    """
+    Compute embeddings for many images at once. The OpenCV engine detects
+    and aligns every face first and runs the recognition model once per
+    batch of FACE_EMBEDDING_BATCH_SIZE crops; the DeepFace engine loops.
+    
+    Args:
+        images: List of absolute image paths and/or decoded BGR frames
+        model_name: DeepFace model to use (default: SFace)
+        engine: Engine name overriding FACE_ENGINE
+        batch_size: Crops per forward pass (default: FACE_EMBEDDING_BATCH_SIZE)
+    
+    Returns:
+        list: One embedding (list) per image, None where no face was found
+
+    Raises:
+        Exception: Whatever the engine raised (missing weights, a failed
+            forward pass), so a broken engine is not mistaken for images
+            without a face
+    """
+    from .face_engine import get_engine
+
+    images = list(images)
+    batch_size = batch_size or getattr(settings, 'FACE_EMBEDDING_BATCH_SIZE', 32)
+    embeddings = get_engine(engine).represent_batch(images, model_name=model_name, batch_size=batch_size)
+
+    missing = sum(embedding is None for embedding in embeddings)
+    logger.info(f"Computed {len(images) - missing}/{len(images)} embeddings ({missing} without a face)")
+    return embeddings
+
+
+def compute_frame_embeddings(image, model_name="SFace", engine=None, max_faces=None):
+    """
+    Embed every face detected in one image, for group scans.
+    
+    Args:
+        image: Absolute image path or decoded BGR frame
+        model_name: DeepFace model to use (default: SFace)
+        engine: Engine name overriding FACE_ENGINE
+        max_faces: Keep only the largest max_faces faces
+    
+    Returns:
+        list: (box, embedding) per face, largest first, with box as
+        (x, y, width, height) in image pixels; empty if none was found
+    """
+    label = f"frame {image.shape[1]}x{image.shape[0]}" if isinstance(image, np.ndarray) else image
+
+    try:
+        from .face_engine import get_engine
+        
+        faces = get_engine(engine).represent_faces(image, model_name=model_name, max_faces=max_faces)
+    except Exception as e:
+        logger.error(f"Error computing face embeddings for {label}: {str(e)}")
+        return []
+
+    logger.info(f"Computed {len(faces)} face embeddings for {label}")
+    return faces
+
+
 def cosine_similarity(embedding1, embedding2):
     """
     Calculate cosine similarity between two embeddings.
@@ -99,93 +157,105 @@ def find_best_match(query_embedding, user_embeddings, threshold=0.45):
     """
     Find the best matching user for a query face embedding.
     
+    The per-candidate ranking table is only built when the accounts.utils
+    logger is at DEBUG level; it covers the FACE_MATCH_DIAGNOSTICS_TOP_K best
+    users and resolves their names with a single query.
+    
     Args:
         query_embedding: The face embedding to match (512D vector)
-        user_embeddings: Dict of {user_id: [embeddings_list]} from database
+        user_embeddings: EmbeddingGallery, or dict of {user_id: [embeddings_list]}
         threshold: Maximum cosine distance for a valid match (default: 0.45)
     
     Returns:
         tuple: (user_id, distance, confidence) or (None, None, None) if no match
     """
-    from .models import CustomUser
-    
-    best_user_id = None
-    best_distance = float('inf')
-    all_matches = []  # Store all matches for logging
+    from .face_gallery import EmbeddingGallery, normalize_rows, user_segments
+    from .face_matcher import match_embeddings
     
-    logger.info("="*80)
-    logger.info(f"FACE MATCHING ANALYSIS - Threshold: {threshold}")
-    logger.info(f"Comparing against {len(user_embeddings)} users with registered faces")
-    logger.info("="*80)
+    if isinstance(user_embeddings, EmbeddingGallery):
+        # The gallery picks exact, prefiltered, quantized or IVF matching
+        result = user_embeddings.match(query_embedding, threshold=threshold, top_k=match_top_k())[0]
+        _, user_ids, starts = user_embeddings.arrays()
+        return report_match(result, threshold, user_ids, starts)
     
-    for user_id, embeddings_list in user_embeddings.items():
-        user_best_distance = float('inf')
-        
-        for idx, stored_embedding in enumerate(embeddings_list):
-            distance = cosine_distance(query_embedding, stored_embedding)
-            
-            if distance < user_best_distance:
-                user_best_distance = distance
-            
-            if distance < best_distance:
-                best_distance = distance
-                best_user_id = user_id
-        
-        # Calculate confidence for this user
-        user_confidence = (1.0 - user_best_distance) * 100
-        
-        # Get username for logging
-        try:
-            user = CustomUser.objects.get(id=user_id)
-            username = user.username
-            display_name = user.get_display_name()
-        except:
-            username = f"User_{user_id}"
-            display_name = username
-        
-        all_matches.append({
-            'user_id': user_id,
-            'username': username,
-            'display_name': display_name,
-            'distance': user_best_distance,
-            'confidence': user_confidence,
-            'embeddings_count': len(embeddings_list)
-        })
+    # Build the (N, D) gallery matrix, grouped by user
+    rows = [
+        (user_id, embedding)
+        for user_id, embeddings_list in user_embeddings.items()
+        for embedding in embeddings_list
+    ]
+    user_ids = np.asarray([user_id for user_id, _ in rows], dtype=np.int64)
+    matrix = normalize_rows([embedding for _, embedding in rows]) if rows else np.zeros((0, 0), dtype=np.float32)
+    starts = user_segments(user_ids)
     
-    # Sort matches by confidence (descending)
-    all_matches.sort(key=lambda x: x['confidence'], reverse=True)
+    # One matrix product for all stored embeddings, ranked per user
+    result = match_embeddings(
+        query_embedding, matrix, user_ids,
+        threshold=threshold, top_k=match_top_k(), starts=starts
+    )[0]
+    return report_match(result, threshold, user_ids, starts)
+
+
+def match_top_k():
+    """Candidates to rank per match: the diagnostics table size at DEBUG, else 1."""
+    if logger.isEnabledFor(logging.DEBUG):
+        return getattr(settings, 'FACE_MATCH_DIAGNOSTICS_TOP_K', 10)
+    return 1
+
+
+def report_match(result, threshold, user_ids, starts):
+    """
+    Log a MatchResult (plus the ranking table at DEBUG) and unpack it.
     
-    # Log top 10 matches
-    logger.info("\nTOP 10 MATCHING RESULTS:")
-    logger.info("-" * 80)
-    logger.info(f"{'Rank':<6} {'Username':<20} {'Display Name':<25} {'Distance':<10} {'Confidence':<12} {'Pass?'}")
-    logger.info("-" * 80)
+    Returns:
+        tuple: (user_id, distance, confidence) or (None, None, None) if no match
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        _log_match_diagnostics(result, threshold, user_ids, starts)
     
-    for rank, match in enumerate(all_matches[:10], 1):
-        passed = "[PASS]" if match['distance'] <= threshold else "[FAIL]"
+    if result.user_id is not None:
         logger.info(
-            f"{rank:<6} {match['username']:<20} {match['display_name']:<25} "
-            f"{match['distance']:<10.4f} {match['confidence']:>6.2f}%     {passed}"
+            f"[MATCH FOUND] user_id={result.user_id} distance={result.distance:.4f} "
+            f"confidence={result.confidence:.2f}% threshold={threshold} users={len(starts)}"
         )
+        return result.user_id, result.distance, result.confidence
     
-    # Check if best match meets threshold
-    if best_distance <= threshold:
-        confidence = (1.0 - best_distance) * 100  # Convert to percentage
-        logger.info("\n" + "="*80)
-        logger.info(f"[MATCH FOUND]")
-        logger.info(f"  User: {all_matches[0]['display_name']} ({all_matches[0]['username']})")
-        logger.info(f"  Distance: {best_distance:.4f} (threshold: {threshold})")
-        logger.info(f"  Confidence: {confidence:.2f}%")
-        logger.info(f"  Embeddings checked: {all_matches[0]['embeddings_count']}")
-        logger.info("="*80 + "\n")
-        return best_user_id, best_distance, confidence
+    if result.candidates:
+        closest_user_id, closest_distance = result.candidates[0]
+        logger.info(
+            f"[NO MATCH] best distance {closest_distance:.4f} (user_id={closest_user_id}) "
+            f"exceeds threshold {threshold} users={len(starts)}"
+        )
     else:
-        logger.info("\n" + "="*80)
-        logger.info(f"[NO MATCH] - Best distance {best_distance:.4f} exceeds threshold {threshold}")
-        if all_matches:
-            logger.info(f"  Closest was: {all_matches[0]['display_name']} with {all_matches[0]['confidence']:.2f}% confidence")
-        logger.info("="*80 + "\n")
-        return None, None, None
+        logger.info("[NO MATCH] No registered faces to compare against")
+    return None, None, None
+
+
+def _log_match_diagnostics(result, threshold, user_ids, starts):
+    """Log the ranking table for the top-k candidates of one match."""
+    from .models import CustomUser
+    
+    users = CustomUser.objects.in_bulk([user_id for user_id, _ in result.candidates])
+    embeddings_count = dict(zip(user_ids[starts].tolist(), np.diff(np.r_[starts, len(user_ids)]).tolist()))
+    
+    logger.debug("="*80)
+    logger.debug(f"FACE MATCHING ANALYSIS - Threshold: {threshold}")
+    logger.debug(f"Compared against {len(starts)} users with registered faces")
+    logger.debug(f"TOP {len(result.candidates)} MATCHING RESULTS:")
+    logger.debug("-" * 80)
+    logger.debug(f"{'Rank':<6} {'Username':<20} {'Display Name':<25} {'Distance':<10} {'Confidence':<12} {'Embeddings':<11} {'Pass?'}")
+    logger.debug("-" * 80)
+    
+    for rank, (user_id, distance) in enumerate(result.candidates, 1):
+        user = users.get(user_id)
+        username = user.username if user else f"User_{user_id}"
+        display_name = user.get_display_name() if user else username
+        passed = "[PASS]" if distance <= threshold else "[FAIL]"
+        logger.debug(
+            f"{rank:<6} {username:<20} {display_name:<25} "
+            f"{distance:<10.4f} {(1.0 - distance) * 100:>6.2f}%      {embeddings_count.get(user_id, 0):<11} {passed}"
+        )
+    logger.debug("="*80)
 
 
 def mark_user_attendance(user):
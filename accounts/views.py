@@ -51,7 +51,6 @@ from .utils import mark_user_attendance
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from .face_system import add_face_image, decode_base64_image, recognize_logged_in_user
-from deepface import DeepFace
 
 @login_required
 @csrf_exempt
@@ -390,6 +389,7 @@ def help_support(request):
 @csrf_exempt
 def face_add(request):
     import cv2
+    from deepface import DeepFace  # imported on use: pulls in TensorFlow
     user = request.user
     user_face = UserFace.objects.filter(user=user).first()
     has_face = bool(user_face and user_face.face_image)
@@ -676,12 +676,10 @@ def upload_master_data_view(self, request):
     return render(request, "admin/upload_master_data.html", context)
 
 import json
-import google.generativeai as genai
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 
 GEMINI_API_KEY = ""
-genai.configure(api_key=GEMINI_API_KEY)
 
 @csrf_exempt
 def chatbot_api(request):
@@ -714,6 +712,9 @@ def chatbot_api(request):
         )
 
         try:
+            # Imported on use so the SDK never loads with the rest of the app
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
             model = genai.GenerativeModel("gemini-2.5-flash")
 
             response = model.generate_content(
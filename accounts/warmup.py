@@ -0,0 +1,86 @@
+"""
+Model warm-up for recognition workers.
+
+The face engine (face_engine.py) builds its recognition and detection
+models lazily on the first embedding, which made the first kiosk scan after
+every deploy or worker recycle take several seconds. warm_up() builds both
+models, runs one dummy inference through the same code path as a real scan
+and loads the embedding gallery, then marks the process ready.
+
+It is called from the post_worker_init hook in gunicorn.conf.py, in each
+worker after the app is loaded. It never runs in the gunicorn master, even
+with GUNICORN_PRELOAD: TensorFlow's threads do not survive fork. With the
+inference pool (inference_pool.py) the engine is the pool, and warming up
+means waiting for its model processes. The api/ready/ endpoint reports the
+state so a load balancer only routes scans to warm workers.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state = {
+    'ready': False,
+    'error': None,
+    'seconds': None,
+    'pid': None,
+}
+
+
+def warm_up():
+    """
+    Build the recognition and detection models and run one dummy inference.
+    Safe to call more than once; only the first successful call in each
+    process does work.
+
+    Returns:
+        bool: Whether the process is ready to serve scans
+    """
+    with _lock:
+        if _state['ready'] and _state['pid'] == os.getpid():
+            return True
+
+        started = time.perf_counter()
+        try:
+            from .face_engine import get_engine
+            from .face_gallery import embedding_gallery
+
+            get_engine().warm_up()
+            embedding_gallery.ensure_loaded()
+        except Exception as e:
+            _state.update(ready=False, error=str(e), seconds=None, pid=os.getpid())
+            logger.error(f"Model warm-up failed: {str(e)}")
+            return False
+
+        seconds = time.perf_counter() - started
+        _state.update(ready=True, error=None, seconds=seconds, pid=os.getpid())
+        logger.info(f"Models warmed up in {seconds:.2f}s (pid {os.getpid()})")
+        return True
+
+
+def is_ready():
+    # State inherited across a fork does not count until this process has
+    # run its own warm-up
+    return _state['ready'] and _state['pid'] == os.getpid()
+
+
+def readiness():
+    """Readiness details for the api/ready/ endpoint."""
+    from .inference_pool import active_pool
+
+    state = {
+        'ready': is_ready(),
+        'error': _state['error'],
+        'warmup_seconds': _state['seconds'],
+        'pid': os.getpid(),
+    }
+    pool = active_pool()
+    if pool is not None:
+        status = pool.status()
+        state['inference_pool'] = status
+        # Not ready until every model process has loaded its models
+        state['ready'] = state['ready'] and status['ready_processes'] == status['processes']
+    return state
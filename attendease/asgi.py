@@ -2,6 +2,8 @@
 ASGI config for attendease project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSocket connections are routed by path to the raw
+ASGI apps in ``websocket_routes``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,24 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendease.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up
+from accounts.recognition_socket import recognition_socket  # noqa: E402
+
+websocket_routes = {
+    '/ws/recognize/': recognition_socket,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] != 'websocket':
+        return await django_application(scope, receive, send)
+
+    route = websocket_routes.get(scope['path'])
+    if route is None:
+        # Reject the handshake (the server answers 403)
+        await receive()
+        await send({'type': 'websocket.close'})
+        return
+    await route(scope, receive, send)
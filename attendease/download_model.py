@@ -12,3 +12,24 @@ def download_sface():
         with open(MODEL_PATH, "wb") as f:
             f.write(response.content)
         print("Download complete!")
+
+
+YUNET_PATH = "media/deepface_models/.deepface/weights/face_detection_yunet_2023mar.onnx"
+YUNET_URL = "https://github.com/opencv/opencv_zoo/raw/main/models/face_detection_yunet/face_detection_yunet_2023mar.onnx"
+
+def download_yunet():
+    """YuNet face detector used by the OpenCV engine (FACE_ENGINE = 'opencv')."""
+    if not os.path.exists(YUNET_PATH):
+        print("Downloading YuNet model...")
+        response = requests.get(YUNET_URL)
+        response.raise_for_status()
+        os.makedirs(os.path.dirname(YUNET_PATH), exist_ok=True)
+        with open(YUNET_PATH, "wb") as f:
+            f.write(response.content)
+        print("Download complete!")
+
+
+if __name__ == "__main__":
+    # Run from the project root: python attendease/download_model.py
+    download_sface()
+    download_yunet()
@@ -206,6 +206,149 @@ JAZZMIN_UI_TWEAKS = {
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 print(BASE_DIR)
 
+# Face Recognition
+# Embedding engine: 'deepface' (DeepFace + TensorFlow) or 'opencv' (YuNet +
+# SFace ONNX run by cv2, no TensorFlow; download the weights with
+# `python attendease/download_model.py`). Only embeddings made by this engine
+# are matched, so after switching, re-embed stored faces with
+# `manage.py compute_embeddings --stale`.
+FACE_ENGINE = 'deepface'
+FACE_DETECTOR_SCORE_THRESHOLD = 0.8  # YuNet confidence needed to accept a face
+FACE_EMBEDDING_BATCH_SIZE = 32  # aligned faces per recognition forward pass
+# Warm up the face models in a background thread under `manage.py runserver`
+# (gunicorn workers always warm up, see gunicorn.conf.py)
+FACE_WARMUP_ON_RUNSERVER = False
+# Seconds between checks for embedding changes made by other processes; with
+# snapshots on, a snapshot older than the database is republished (None =
+# rely on signals and published snapshots only)
+FACE_GALLERY_REFRESH_INTERVAL = 5.0
+# Candidates shown in the per-scan ranking table. The table is only built when
+# the 'accounts.utils' logger below is set to DEBUG.
+FACE_MATCH_DIAGNOSTICS_TOP_K = 10
+# Share the gallery between gunicorn workers as a memory-mapped snapshot in
+# MEDIA_ROOT/gallery_snapshots (republished FACE_GALLERY_SNAPSHOT_DELAY
+# seconds after the last embedding change)
+FACE_GALLERY_SNAPSHOTS = True
+FACE_GALLERY_SNAPSHOT_DELAY = 2.0
+# 'exact' (brute force) or 'ivf' (approximate index, used once the gallery
+# holds FACE_IVF_MIN_EMBEDDINGS rows). FACE_IVF_NPROBE trades latency for
+# recall; compare settings with `manage.py benchmark_face_index`.
+FACE_MATCH_INDEX = 'exact'
+FACE_IVF_MIN_EMBEDDINGS = 20000
+FACE_IVF_LISTS = None  # None = sqrt(number of embeddings)
+FACE_IVF_NPROBE = 8
+# Accuracy trade-off: with FACE_MATCH_PREFILTER_USERS > 0, exact matching
+# first ranks users by their mean embedding and re-scores only the closest
+# that many users. This is approximate: a user whose mean is far but who has
+# one close embedding can be missed. It also bypasses the full
+# reduced-precision scan below. 0 (default) scores every embedding; only
+# enable the prefilter once `manage.py evaluate_face_matching` shows no
+# decision changes on real data.
+FACE_MATCH_PREFILTER_USERS = 0
+# Precision of the gallery copy scanned on every match: 'float32', 'float16'
+# (2x smaller) or 'int8' (4x smaller). The best FACE_MATCH_RERANK_USERS users
+# of a reduced-precision scan are re-scored in float32 (0 = no re-rank). The
+# scan covers every row unless the centroid prefilter is on and there are
+# more users than FACE_MATCH_PREFILTER_USERS. This saves memory, not scan
+# time: the scan widens the codes and multiplies in float32, and NumPy widens
+# float16 slowly, so prefer 'int8'.
+# Check the error on real data with `manage.py evaluate_face_matching --precision int8`.
+FACE_GALLERY_PRECISION = 'float32'
+FACE_MATCH_RERANK_USERS = 10
+# Maximum cosine distance for a recognised face (0.30 = ~70% confidence minimum)
+FACE_MATCH_THRESHOLD = 0.30
+
+# Client face box (ROI): frames sent with a face box are decoded at 1/2, 1/4
+# or 1/8 resolution as long as the face keeps FACE_ROI_MIN_FACE_SIZE pixels,
+# then cropped to the box padded by FACE_ROI_PADDING of its size per side.
+FACE_ROI_MIN_FACE_SIZE = 100
+FACE_ROI_PADDING = 0.4
+
+# Recognition cache: decisions are reused for FACE_CACHE_TTL seconds (0 turns
+# the cache off) when the 256-bit dHash of a frame's face crop is within
+# FACE_CACHE_HASH_DISTANCE bits of a recent one from the same scanner (a
+# match is only reused once the embedding confirms it), or its embedding
+# within FACE_CACHE_EMBEDDING_DISTANCE of a recent embedding. Keep both far
+# below what separates two people; hit rates are at api/stats/recognition-cache/.
+FACE_CACHE_TTL = 3.0
+FACE_CACHE_MAX_ENTRIES = 64
+FACE_CACHE_HASH_DISTANCE = 8
+FACE_CACHE_EMBEDDING_DISTANCE = 0.05
+
+# Micro-batch concurrent scans within a worker: one model call and one gallery
+# match per batch of up to FACE_INFERENCE_MAX_BATCH frames. The batch is held
+# open for FACE_INFERENCE_MAX_WAIT_MS only while a burst is in progress.
+FACE_INFERENCE_BATCHING = True
+FACE_INFERENCE_MAX_BATCH = 8
+FACE_INFERENCE_MAX_WAIT_MS = 5
+FACE_INFERENCE_TIMEOUT = 30.0  # seconds a request waits for its result
+
+# Inference pool: with FACE_INFERENCE_POOL_PROCESSES > 0 the gunicorn master
+# starts that many model-holding processes and HTTP workers hand frames to
+# them through shared memory instead of loading the models themselves.
+# FACE_INFERENCE_POOL_THREADS caps the math-library threads of each model
+# process (0 = library default); size processes x threads to the cores.
+# Model processes that exit are restarted; while none is running, and for
+# frames a dying process held, workers embed inline.
+FACE_INFERENCE_POOL_PROCESSES = int(os.environ.get('FACE_INFERENCE_POOL_PROCESSES', '0'))
+FACE_INFERENCE_POOL_THREADS = int(os.environ.get('FACE_INFERENCE_POOL_THREADS', '0'))
+FACE_INFERENCE_POOL_MAX_BATCH = 8  # frames per model call in a model process
+FACE_INFERENCE_POOL_SLOTS = 32  # frames in flight across all HTTP workers (at most 255)
+FACE_INFERENCE_POOL_SLOT_BYTES = 1920 * 1080 * 3  # larger frames are downscaled to fit
+FACE_INFERENCE_POOL_STARTUP_TIMEOUT = 120.0  # seconds to wait for the models to load
+
+# The api/stats/* and metrics/ endpoints expose per-worker recognition data:
+# they answer staff sessions, and requests with `Authorization: Bearer <token>`
+# when FACE_STATS_TOKEN is set (e.g. for Prometheus)
+FACE_STATS_TOKEN = os.environ.get('FACE_STATS_TOKEN') or None
+
+# Async endpoints (accounts/async_views.py), used by the scanner pages when
+# served by the ASGI profile (GUNICORN_ASGI=1 in gunicorn.conf.py). Decoding
+# and inference run on FACE_ASYNC_INFERENCE_THREADS threads; beyond
+# FACE_ASYNC_MAX_PENDING queued jobs requests get a 503.
+FACE_ASYNC_ENDPOINTS = os.environ.get('GUNICORN_ASGI', '0') == '1'
+FACE_ASYNC_INFERENCE_THREADS = 4
+FACE_ASYNC_MAX_PENDING = 256
+
+# Quality gate run on scanner frames before the embedding model
+# (accounts/face_quality.py); rejected frames get a retry hint
+FACE_QUALITY_CHECKS = True
+FACE_QUALITY_ANALYSIS_SIZE = 160  # longest side of the downscaled copy that is measured
+FACE_QUALITY_MIN_BRIGHTNESS = 40  # mean luminance of the face, 0-255
+FACE_QUALITY_MAX_BRIGHTNESS = 220
+FACE_QUALITY_MIN_SHARPNESS = 40.0  # Laplacian variance of the full-resolution face, reduced to 112x112
+FACE_QUALITY_MIN_FACE_SIZE = 60  # shorter side of the face, in decoded frame pixels
+FACE_QUALITY_MAX_ROLL = 25  # degrees of head tilt (needs the YuNet weights)
+FACE_QUALITY_MAX_YAW = 0.35  # nose offset from the eye midpoint, in eye distances (YuNet)
+
+# Face tracking on the streaming socket (accounts/face_tracker.py): frames of
+# a face identified by FACE_TRACK_CONFIRM_MATCHES agreeing embeddings reuse
+# its match until the track is lost or is due for re-verification. A reused
+# match is only reported; attendance is marked from embedded frames
+FACE_TRACKING = True
+FACE_TRACK_MIN_IOU = 0.3  # box overlap that continues a track
+FACE_TRACK_MAX_AGE = 1.0  # seconds without a box before a track is lost
+FACE_TRACK_CONFIRM_MATCHES = 2
+FACE_TRACK_REVERIFY_SECONDS = 3.0
+
+# Group scans ('multi_face' on the recognize endpoints) embed and mark at
+# most this many faces per frame, largest first
+FACE_MULTI_FACE_MAX_FACES = 10
+
+# Streaming recognition socket (accounts/recognition_socket.py, /ws/recognize/
+# on the ASGI profile); larger frames close the connection
+FACE_SOCKET_MAX_FRAME_BYTES = 2 * 1024 * 1024
+
+# Stage timing of the recognition and registration views (accounts/metrics.py):
+# Server-Timing response headers and the Prometheus metrics/ endpoint; the
+# percentiles cover the last FACE_METRICS_WINDOW requests per view and stage
+FACE_METRICS_ENABLED = True
+FACE_METRICS_WINDOW = 1024
+
+# Monthly attendance summaries are refreshed in the background once scans
+# for a user have been quiet this many seconds
+ATTENDANCE_SUMMARY_DELAY = 5.0
+
 # Logging Configuration for Face Recognition
 LOGGING = {
     'version': 1,
@@ -241,11 +384,19 @@ LOGGING = {
             'level': 'INFO',
             'propagate': False,
         },
+        # Set to DEBUG to log the per-scan candidate ranking table (to the
+        # console; the file handler stays at INFO)
         'accounts.utils': {
             'handlers': ['console', 'face_recognition_file'],
             'level': 'INFO',
             'propagate': False,
         },
+        # The other accounts modules (face engine, gallery, inference, cache...)
+        'accounts': {
+            'handlers': ['console', 'face_recognition_file'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         'django': {
             'handlers': ['console'],
             'level': 'INFO',
@@ -1,10 +1,11 @@
 import os
 from django.conf import settings
 from django.http import JsonResponse
-from deepface import DeepFace
 
 def verify_faces(request):
     try:
+        from deepface import DeepFace  # imported on use: pulls in TensorFlow
+
         # Pick two sample images from your face DB
         img1 = os.path.join(settings.MEDIA_ROOT, "faces", "FCA@123", "FCA@123_2.jpg")
         img2 = os.path.join(settings.MEDIA_ROOT, "faces", "rk", "rk_1.jpg")
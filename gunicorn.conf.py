@@ -0,0 +1,65 @@
+"""
+Gunicorn configuration (used by the Procfile via -c gunicorn.conf.py).
+
+Face models are warmed up before a worker takes traffic, so the first scan
+after a deploy or worker recycle is as fast as any other:
+
+- every worker builds its own models after loading the app, in
+  post_worker_init. With GUNICORN_PRELOAD=1 the master imports the app
+  but still builds no models: TensorFlow starts threads and sessions that
+  do not survive fork, so models built in the master could hang or crash
+  the workers that inherit them;
+- with FACE_INFERENCE_POOL_PROCESSES > 0 the master starts the model
+  processes of accounts/inference_pool.py before forking, and workers only
+  wait for them to be ready.
+"""
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '0') == '1'
+
+# Workers are not heartbeating while they build the models
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# Threaded (gthread) workers are opt-in: with GUNICORN_THREADS above 1,
+# concurrent scans in one worker share batched model calls
+# (accounts/inference_scheduler.py), at the cost of more requests contending
+# for the GIL and the model in each process. The default keeps gunicorn's
+# sync worker, one request per process, where every batch holds one frame.
+threads = int(os.environ.get('GUNICORN_THREADS', '1'))
+
+# ASGI profile: GUNICORN_ASGI=1 runs uvicorn workers, and the scanner pages
+# switch to the async endpoints (accounts/async_views.py). A worker then
+# keeps hundreds of kiosk requests in flight on one event loop while
+# inference runs on its bounded thread pool. Serve attendease.asgi:application:
+#   GUNICORN_ASGI=1 gunicorn attendease.asgi:application -c gunicorn.conf.py
+if os.environ.get('GUNICORN_ASGI', '0') == '1':
+    worker_class = 'uvicorn_worker.UvicornWorker'
+
+
+def on_starting(server):
+    # Start the inference pool before any worker forks so they all inherit it
+    if int(os.environ.get('FACE_INFERENCE_POOL_PROCESSES', '0')) > 0:
+        import django
+
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'attendease.settings')
+        django.setup()
+
+        from accounts.inference_pool import start_pool
+        start_pool()
+
+
+def on_exit(server):
+    from accounts.inference_pool import stop_pool
+
+    stop_pool()
+
+
+def _warm_up(log):
+    from accounts.warmup import warm_up
+
+    if not warm_up():
+        log.error("Face model warm-up failed; models will load on the first scan")
+
+
+def post_worker_init(worker):
+    _warm_up(worker.log)